@@ -1,116 +1,174 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from fastapi_filter import FilterDepends
 from sqlalchemy.orm import Session
 from app.database.models import User, Platform, CredentialDetail, UserIntegration
-from app.database.connection import get_db
+from app.database.connection import get_db, get_read_db, run_sync, session_route
 from app.auth.auth import admin_authenticate
+from app.auth.revocation import revocation_store
 from app.database.schemas import (
     UserResponseSchema,
     PlatformSchema,
     PlatformResponseSchema,
     UserIntegrationSchema,
     UserIntegrationResponseSchema,
-    CurrentUserResponseSchema,
     CredentialDetailSchema,
     CredentialDetailResponseSchema,
     AdminIntegrationSchema,
     AdminCredentialDetailSchema,
+    UserAdminSchema,
+    StatsResponseSchema,
 )
 from app.filters.filter import UserFilter, PlatformFilter, CredentialDetailFilter
+from app.filters.pagination import CursorPage
+from app.config import settings
+from app.serialization import RowsResponse
+from app.etag import ConditionalGet
 from app.service.admins.get.user_service import UserService
 from app.service.admins.get.platform_service import PlatformService
 from app.service.admins.get.credential_service import CredentialService
 from app.service.admins.post.integration_post import IntegrationPostService
 from app.service.admins.post.credential_post import CredentialPostService
 from app.service.admins.post.platform_post import PlatformPostService
+from app.service.admins.post.user_post import UserPostService
+from app.service.admins.get.stats_service import StatsService
+from app.service.admins.post.stats_post import StatsPostService
+from app.service.admins.get.search_service import (
+    SEARCH_LIMIT_DEFAULT,
+    SEARCH_LIMIT_MAX,
+    SearchService,
+)
 from typing import List
+from app.database.query_budget import QueryBudgetRoute, query_budget
 
-router = APIRouter(prefix="/admin")
+router = APIRouter(prefix="/admin", route_class=QueryBudgetRoute)
 
 
 # Get details of all users:
 @router.get("/users", response_model=List[UserResponseSchema])
-def get_users(
+@query_budget(2)
+@session_route
+async def get_users(
+    response: Response,
     admin: User = Depends(admin_authenticate),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     filters: UserFilter = FilterDepends(UserFilter),
+    page: CursorPage = Depends(),
 ) -> List[User]:
     """
-    This route will return the details of all users after verfiying user has admin access
+    This route will return a page of the details of all users after verfiying user has admin access,
+    the cursor of the next page is sent in the X-Next-Cursor header
     """
     user_service = UserService(db)
-    return user_service.get_all_users(filters)
+    if settings.fast_serialization:
+        rows = await run_sync(db, user_service.get_all_user_rows, filters, page)
+        rows_response = RowsResponse(UserResponseSchema, rows)
+        page.set_header(rows_response)
+        return rows_response
+    users = await run_sync(db, user_service.get_all_users, filters, page)
+    page.set_header(response)
+    return users
 
 
 # Get details of one user :
 @router.get("/users/{user_id}", response_model=UserResponseSchema)
-def get_one_user(
+@query_budget(2)
+@session_route
+async def get_one_user(
     user_id: int,
     admin: User = Depends(admin_authenticate),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ) -> User:
     """
     This route will return the details of one user after verifying that user has admin access
     """
     user_service = UserService(db)
-    user = user_service.get_user_by_id(user_id)
+    user = await run_sync(db, user_service.get_user_by_id, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 
 # Get all platforms a user is integrated with :
-@router.get("/users/{user_id}/platforms", response_model=CurrentUserResponseSchema)
-def get_platforms_for_user(
+@router.get(
+    "/users/{user_id}/platforms", response_model=List[PlatformResponseSchema]
+)
+@query_budget(3)
+@session_route
+async def get_platforms_for_user(
     user_id: int,
     admin: User = Depends(admin_authenticate),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     filters: PlatformFilter = FilterDepends(PlatformFilter),
 ):
     """
     This route will return all platforms that a user in integrated with
     """
     platform_service = PlatformService(db)
-    platforms = platform_service.get_user_platforms(user_id, filters)
+    platforms = await run_sync(db, platform_service.get_user_platforms, user_id, filters)
     if platforms is None:
         raise HTTPException(status_code=404, detail="User not found")
+    if settings.fast_serialization:
+        return RowsResponse(
+            PlatformResponseSchema, [platform.to_row() for platform in platforms]
+        )
     return platforms
 
 
 # Get details of one platform
 @router.get("/platforms/{platform_id}", response_model=PlatformResponseSchema)
-def get_one_platform(
+@query_budget(2)
+@session_route
+async def get_one_platform(
     platform_id: int,
+    response: Response,
     admin: User = Depends(admin_authenticate),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
+    conditional: ConditionalGet = Depends(),
 ) -> Platform:
     """
-    This route will return the details of a specific platform
+    This route will return the details of a specific platform, with an ETag. A request whose
+    If-None-Match matches it gets a 304 without serializing the platform
     """
     platform_service = PlatformService(db)
-    platform = platform_service.get_platform_by_id(platform_id)
+    platform = await run_sync(db, platform_service.get_platform_by_id, platform_id)
     if not platform:
         raise HTTPException(status_code=404, detail="Platform not found")
+    # The platform is a snapshot from the platform catalog, its values are its version
+    not_modified = conditional.not_modified(platform.id, platform.name, platform.description)
+    if not_modified:
+        return not_modified
+    conditional.set_header(response)
     return platform
 
 
 # Get the credentials of a user for a specific platform
 @router.get(
     "/users/{user_id}/{platform_id}/credentials",
-    response_model=CredentialDetailResponseSchema,
+    response_model=List[CredentialDetailResponseSchema],
 )
-def get_credentials(
+@query_budget(2)
+@session_route
+async def get_credentials(
     user_id: int,
     platform_id: int,
     admin: User = Depends(admin_authenticate),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     filters: CredentialDetailFilter = FilterDepends(CredentialDetailFilter),
 ):
     """
     This route will return the credentials of a user of a specific platform
     """
     credential_service = CredentialService(db)
-    credentials = credential_service.get_user_credentials(user_id, platform_id, filters)
+    if settings.fast_serialization:
+        rows = await run_sync(
+            db, credential_service.get_user_credential_rows, user_id, platform_id, filters
+        )
+        if not rows:
+            raise HTTPException(status_code=404, detail="Credentials not found")
+        return RowsResponse(CredentialDetailResponseSchema, rows)
+    credentials = await run_sync(
+        db, credential_service.get_user_credentials, user_id, platform_id, filters
+    )
     if not credentials:
         raise HTTPException(status_code=404, detail="Credentials not found")
     return credentials
@@ -118,7 +176,9 @@ def get_credentials(
 
 # Create a platform
 @router.post("/platform/", response_model=PlatformResponseSchema)
-def add_platform(
+@query_budget(4)
+@session_route
+async def add_platform(
     platform_data: PlatformSchema,
     admin: User = Depends(admin_authenticate),
     db: Session = Depends(get_db),
@@ -127,11 +187,13 @@ def add_platform(
     This route will allow an admin to create a platform
     """
     platform_service = PlatformPostService(db)
-    return platform_service.create_platform(platform_data)
+    return await run_sync(db, platform_service.create_platform, platform_data)
 
 
 @router.post("/user-integration", response_model=UserIntegrationResponseSchema)
-def assign_user_to_platform(
+@query_budget(5)
+@session_route
+async def assign_user_to_platform(
     integration_data: AdminIntegrationSchema,
     admin: User = Depends(admin_authenticate),
     db: Session = Depends(get_db),
@@ -140,11 +202,13 @@ def assign_user_to_platform(
     Assigns a user to a platform, integrating them into it.
     """
     integration_service = IntegrationPostService(db)
-    return integration_service.assign_user(integration_data)
+    return await run_sync(db, integration_service.assign_user, integration_data)
 
 
 @router.post("/credential/", response_model=CredentialDetailResponseSchema)
-def add_credential(
+@query_budget(4)
+@session_route
+async def add_credential(
     credential_data: AdminCredentialDetailSchema,
     admin: User = Depends(admin_authenticate),
     db: Session = Depends(get_db),
@@ -153,4 +217,108 @@ def add_credential(
     Adds credentials for a user's integration with a platform.
     """
     credential_service = CredentialPostService(db)
-    return credential_service.add_credential(credential_data)
+    return await run_sync(db, credential_service.add_credential, credential_data)
+
+
+# Search users by username
+@router.get("/search/users", response_model=List[UserResponseSchema])
+@query_budget(2)
+@session_route
+async def search_users(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(SEARCH_LIMIT_DEFAULT, ge=1, le=SEARCH_LIMIT_MAX),
+    admin: User = Depends(admin_authenticate),
+    db: Session = Depends(get_read_db),
+):
+    """
+    This route will return the users whose username contains q, best matches first, for typeahead
+    """
+    search_service = SearchService(db)
+    return await run_sync(db, search_service.search_users, q, limit)
+
+
+# Search platforms by name and description
+@router.get("/search/platforms", response_model=List[PlatformResponseSchema])
+@query_budget(1)
+@session_route
+async def search_platforms(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(SEARCH_LIMIT_DEFAULT, ge=1, le=SEARCH_LIMIT_MAX),
+    admin: User = Depends(admin_authenticate),
+    db: Session = Depends(get_read_db),
+):
+    """
+    This route will return the platforms whose name or description contains q, name matches first
+    """
+    search_service = SearchService(db)
+    return await run_sync(db, search_service.search_platforms, q, limit)
+
+
+# Log a user out everywhere
+@router.post("/users/{user_id}/logout")
+@query_budget(3)
+@session_route
+async def force_logout(
+    user_id: int,
+    admin: User = Depends(admin_authenticate),
+    db: Session = Depends(get_db),
+) -> dict:
+    """
+    This route will revoke every access token and refresh token issued to a user so far
+    """
+    user_service = UserService(db)
+    user = await run_sync(db, user_service.get_user_by_id, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    await run_sync(db, revocation_store.revoke_user, db, str(user.username))
+    return {"detail": "User logged out"}
+
+
+# Grant or remove the admin privileges of a user
+@router.put("/users/{user_id}/admin", response_model=UserResponseSchema)
+@query_budget(4)
+@session_route
+async def set_user_admin(
+    user_id: int,
+    data: UserAdminSchema,
+    admin: User = Depends(admin_authenticate),
+    db: Session = Depends(get_db),
+):
+    """
+    This route will grant or remove the admin privileges of a user, the access tokens issued to the user
+    before the change stop carrying its old privileges at once
+    """
+    user_post_service = UserPostService(db)
+    return await run_sync(db, user_post_service.set_admin, user_id, data.is_admin)
+
+
+# Get the integration and credential statistics of every platform
+@router.get("/stats", response_model=StatsResponseSchema)
+@query_budget(2)
+@session_route
+async def get_stats(
+    live: bool = Query(False),
+    admin: User = Depends(admin_authenticate),
+    db: Session = Depends(get_read_db),
+):
+    """
+    This route will return the integrations (active and inactive) and credentials of each platform and
+    their totals, read from the counters kept by the writes, or counted from the tables when live
+    """
+    stats_service = StatsService(db)
+    return await run_sync(db, stats_service.get_stats, live)
+
+
+# Recount the platform statistics
+@router.post("/stats/rebuild", response_model=StatsResponseSchema)
+@query_budget(4)
+@session_route
+async def rebuild_stats(
+    admin: User = Depends(admin_authenticate),
+    db: Session = Depends(get_db),
+):
+    """
+    This route will replace the platform statistics counters with counts from the tables and return them
+    """
+    stats_post_service = StatsPostService(db)
+    return await run_sync(db, stats_post_service.rebuild)
@@ -0,0 +1,51 @@
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from fastapi_filter import FilterDepends
+from app.database.models import User
+from app.database.connection import USE_ASYNC_DB, async_read_session, read_session
+from app.auth.auth import admin_authenticate
+from app.database.schemas import CredentialBatchSchema
+from app.filters.filter import CredentialDetailFilter
+from app.service.admins.get.credential_batch_service import (
+    CredentialBatchService,
+    credential_batch_statement,
+)
+from app.database.query_budget import QueryBudgetRoute
+
+router = APIRouter(prefix="/admin", route_class=QueryBudgetRoute)
+
+
+# Get the credentials of many users and platforms at once
+@router.post("/credentials/batch")
+def get_credential_batch(
+    batch: CredentialBatchSchema,
+    request: Request,
+    gzip: bool = Query(False),
+    admin: User = Depends(admin_authenticate),
+    filters: CredentialDetailFilter = FilterDepends(CredentialDetailFilter),
+):
+    """
+    This route will stream as NDJSON the integration and decrypted credentials of each of the
+    (user_id, platform_id) pairs, or of the users of one platform, with the credentials matching the
+    filters, read with a single query from its own read session (an AsyncSession with
+    USE_ASYNC_DB). It is gzipped if asked to
+    """
+    statement = credential_batch_statement(batch, filters)
+
+    def chunks():
+        with read_session(request) as db:
+            credential_batch_service = CredentialBatchService(db)
+            yield from credential_batch_service.stream(statement, gzip)
+
+    async def async_chunks():
+        async with async_read_session(request) as db:
+            credential_batch_service = CredentialBatchService(db)
+            async for chunk in credential_batch_service.stream_async(statement, gzip):
+                yield chunk
+
+    headers = {"Content-Encoding": "gzip"} if gzip else {}
+    return StreamingResponse(
+        async_chunks() if USE_ASYNC_DB else chunks(),
+        media_type="application/x-ndjson",
+        headers=headers,
+    )
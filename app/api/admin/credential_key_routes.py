@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+from typing import Optional
+from app.database.models import User
+from app.database.connection import get_db, run_sync, session_route
+from app.auth.auth import admin_authenticate
+from app.database.schemas import KeyRotationResultSchema
+from app.service.admins.post.credential_key_post import CredentialKeyPostService
+from app.database.query_budget import QueryBudgetRoute
+
+router = APIRouter(prefix="/admin", route_class=QueryBudgetRoute)
+
+
+# Rotate the keys encrypting the credential values
+@router.post("/credentials/rotate-keys", response_model=KeyRotationResultSchema)
+@session_route
+async def rotate_credential_keys(
+    new_data_keys: bool = True,
+    platform_id: Optional[int] = None,
+    admin: User = Depends(admin_authenticate),
+    db: Session = Depends(get_db),
+):
+    """
+    This route will rewrap the data keys with the current master key, give each platform (or only
+    platform_id) a new data key when new_data_keys is set, and seal again in batches every credential
+    value that isn't sealed with the newest key of its platform
+    """
+    credential_key_service = CredentialKeyPostService(db)
+    return await run_sync(
+        db, credential_key_service.rotate_keys, new_data_keys, platform_id
+    )
@@ -0,0 +1,94 @@
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from fastapi_filter import FilterDepends
+from app.database.models import User
+from app.database.connection import USE_ASYNC_DB, async_read_session, read_session
+from app.auth.auth import admin_authenticate
+from app.filters.filter import UserFilter, UserIntegrationFilter, CredentialDetailFilter
+from app.service.admins.get.export_service import (
+    CREDENTIAL_EXPORT_COLUMNS,
+    INTEGRATION_EXPORT_COLUMNS,
+    USER_EXPORT_COLUMNS,
+    ExportService,
+    export_statement,
+)
+from app.database.query_budget import QueryBudgetRoute
+
+router = APIRouter(prefix="/admin/export", route_class=QueryBudgetRoute)
+
+
+def stream_export(request: Request, statement, name: str, compress: bool) -> StreamingResponse:
+    """
+    Streams an export from its own read session, the response outlives the session of the request.
+    With USE_ASYNC_DB it is an AsyncSession streaming on the event loop, so a long export holds
+    neither a worker thread nor a sync connection
+    """
+
+    def chunks():
+        with read_session(request) as db:
+            export_service = ExportService(db)
+            yield from export_service.export(statement, compress)
+
+    async def async_chunks():
+        async with async_read_session(request) as db:
+            export_service = ExportService(db)
+            async for chunk in export_service.export_async(statement, compress):
+                yield chunk
+
+    headers = {"Content-Disposition": f'attachment; filename="{name}.ndjson"'}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        async_chunks() if USE_ASYNC_DB else chunks(),
+        media_type="application/x-ndjson",
+        headers=headers,
+    )
+
+
+# Export all users
+@router.get("/users")
+def export_users(
+    request: Request,
+    gzip: bool = Query(False),
+    admin: User = Depends(admin_authenticate),
+    filters: UserFilter = FilterDepends(UserFilter),
+):
+    """
+    This route will stream the users matching the filters as NDJSON, gzipped if asked to
+    """
+    return stream_export(request, export_statement(USER_EXPORT_COLUMNS, filters), "users", gzip)
+
+
+# Export all integrations
+@router.get("/integrations")
+def export_integrations(
+    request: Request,
+    gzip: bool = Query(False),
+    admin: User = Depends(admin_authenticate),
+    filters: UserIntegrationFilter = FilterDepends(UserIntegrationFilter),
+):
+    """
+    This route will stream the user integrations matching the filters as NDJSON, gzipped if asked to
+    """
+    return stream_export(
+        request,
+        export_statement(INTEGRATION_EXPORT_COLUMNS, filters), "integrations", gzip
+    )
+
+
+# Export the metadata of all credentials
+@router.get("/credentials")
+def export_credentials(
+    request: Request,
+    gzip: bool = Query(False),
+    admin: User = Depends(admin_authenticate),
+    filters: CredentialDetailFilter = FilterDepends(CredentialDetailFilter),
+):
+    """
+    This route will stream the credentials matching the filters as NDJSON without their values,
+    gzipped if asked to
+    """
+    return stream_export(
+        request,
+        export_statement(CREDENTIAL_EXPORT_COLUMNS, filters), "credentials", gzip
+    )
@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Depends, Request
+from sqlalchemy.orm import Session
+from app.database.models import User
+from app.database.connection import get_db
+from app.auth.auth import admin_authenticate
+from app.database.schemas import ImportKind, ImportResultSchema
+from app.service.admins.post.import_post import ImportService, read_records
+from app.database.query_budget import QueryBudgetRoute
+
+router = APIRouter(prefix="/admin", route_class=QueryBudgetRoute)
+
+
+# Bulk import users, integrations or credentials
+@router.post("/import/{kind}", response_model=ImportResultSchema)
+async def import_records(
+    kind: ImportKind,
+    request: Request,
+    admin: User = Depends(admin_authenticate),
+    db: Session = Depends(get_db),
+):
+    """
+    This route will import a streamed NDJSON or CSV upload in batches, rows that fail are reported
+    with their line number without stopping the rest of the upload
+    """
+    records = read_records(request.stream(), request.headers.get("content-type", ""))
+    import_service = ImportService(db)
+    return await import_service.import_records(kind, records)
@@ -0,0 +1,59 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from app.database.connection import (
+    async_pool_metrics,
+    pool_metrics,
+    replica_pool_metrics,
+    replica_router,
+)
+from app.auth.auth import admin_principal_authenticate
+from app.auth.cache import Principal, principal_cache
+from app.auth.password import password_hasher
+from app.auth.rate_limit import login_rate_limiter
+from app.auth.rehash import password_rehasher
+from app.auth.revocation import revocation_store
+from app.auth.user_versions import user_versions
+from app.database.catalog import platform_catalog
+from app.database.encryption import credential_cipher
+from app.database.search_index import user_search_index
+from app.instrumentation import InstrumentedRoute, route_metrics
+
+router = APIRouter(prefix="/admin", route_class=InstrumentedRoute)
+
+
+# Get the runtime metrics of this worker
+@router.get("/metrics")
+def get_metrics(admin: Principal = Depends(admin_principal_authenticate)) -> dict:
+    """
+    This route will return the connection pool, replica, cache, credential key, password hashing, rehashing and login rate limit metrics of this worker
+    """
+    replica_metrics = [metrics for pair in replica_pool_metrics.values() for metrics in pair]
+    pools = {
+        metrics.name: metrics.snapshot()
+        for metrics in (pool_metrics, async_pool_metrics, *replica_metrics)
+        if metrics.pool is not None
+    }
+    return {
+        "pools": pools,
+        "replicas": replica_router.stats(),
+        "principal_cache": principal_cache.stats(),
+        "revocations": revocation_store.stats(),
+        "user_versions": user_versions.stats(),
+        "password_hasher": password_hasher.stats(),
+        "password_rehash": password_rehasher.stats(),
+        "login_rate_limit": login_rate_limiter.stats(),
+        "platform_catalog": platform_catalog.stats(),
+        "credential_keys": credential_cipher.stats(),
+        "user_search_index": user_search_index.stats(),
+    }
+
+
+# Get the per-route request histograms of this worker in the Prometheus text format
+@router.get("/metrics/prometheus", response_class=PlainTextResponse)
+def get_prometheus_metrics(admin: Principal = Depends(admin_principal_authenticate)) -> PlainTextResponse:
+    """
+    This route will return the request duration, SQL, pool wait, auth and serialization histograms of each route
+    """
+    return PlainTextResponse(
+        route_metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -1,46 +1,90 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from datetime import timedelta
-from app.auth.utils import (
-    ACCESS_TOKEN_EXPIRE_MINUTES,
-    create_access_token,
-    REFRESH_TOKEN_EXPIRE_DAYS,
-    create_refresh_token,
-)
-from app.database.connection import get_db
-from app.database.schemas import UserSchema
+from typing import Optional
+from app.auth.auth import logout, oauth2_scheme, refresh_access_token, user_authenticate
+from app.auth.utils import issue_tokens
+from app.database.connection import get_db, run_sync, session_route
+from app.database.schemas import LogoutSchema, RefreshTokenSchema
 from app.database.models import User
-from app.auth.password import verify_password
+from app.auth.password import password_hasher, password_needs_update
+from app.auth.rate_limit import client_address, login_rate_limiter
+from app.auth.rehash import password_rehasher
+from app.database.query_budget import QueryBudgetRoute, query_budget
 
-router = APIRouter()
+router = APIRouter(route_class=QueryBudgetRoute)
+
+
+def get_user_by_username(db: Session, username: str):
+    """
+    Fetches a user by their username
+    """
+    return db.query(User).filter(User.username == username).first()
 
 
 @router.post("/login")
-def login(data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+@query_budget(1)
+async def login(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    data: OAuth2PasswordRequestForm = Depends(),
+    db: Session = Depends(get_db),
+):
     """
     This route will allow users to login with their username and password to recieve their
-    access token
+    access token, the password is verified in the password hashing pool once the login is
+    within the rate limits of its address and of the failed logins of its username from that
+    address. A password hashed with an older scheme or cost is rehashed in the background
     """
-    user = db.query(User).filter(User.username == data.username).first()
+    # Refuse the attempts over the limits before reading the user or running bcrypt
+    client_ip = client_address(request)
+    await login_rate_limiter.check(client_ip, data.username)
+
+    user = await run_sync(db, get_user_by_username, db, data.username)
+    # The same error and the same hashing work for both, so neither the response nor its timing
+    # tells which usernames exist
     if not user:
-        raise HTTPException(status_code=401, detail="Invalid username")
+        await password_hasher.verify_dummy(data.password)
+        await login_rate_limiter.failed(client_ip, data.username)
+        raise HTTPException(status_code=401, detail="Invalid username or password")
 
     hashed_password = str(user.password)
-    if not verify_password(data.password, hashed_password):
-        raise HTTPException(status_code=401, detail="Invalid password")
-
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username}, expires=access_token_expires
-    )
-    refresh_token_expires = timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-    refresh_token = create_refresh_token(
-        data={"sub": user.username}, expires=refresh_token_expires
-    )
-
-    return {
-        "Access Token": access_token,
-        "Refresh Token": refresh_token,
-        "Token type": "Bearer",
-    }
+    if not await password_hasher.verify(data.password, hashed_password):
+        await login_rate_limiter.failed(client_ip, data.username)
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+
+    # A hash of an older scheme or cost is replaced once the response is sent
+    if password_needs_update(hashed_password):
+        background_tasks.add_task(
+            password_rehasher.rehash, user.id, hashed_password, data.password
+        )
+    return issue_tokens(user)
+
+
+# Rotate a refresh token
+@router.post("/refresh")
+@query_budget(2)
+@session_route
+async def refresh(data: RefreshTokenSchema, db: Session = Depends(get_db)):
+    """
+    This route will exchange a refresh token for a new access token and refresh token, each refresh
+    token can be used once
+    """
+    return await run_sync(db, refresh_access_token, data.refresh_token, db)
+
+
+# Log out of the current session
+@router.post("/logout")
+@query_budget(3)
+@session_route
+async def logout_user(
+    data: Optional[LogoutSchema] = None,
+    token: str = Depends(oauth2_scheme),
+    user: User = Depends(user_authenticate),
+    db: Session = Depends(get_db),
+) -> dict:
+    """
+    This route will revoke the access token of the request and, when it is sent, its refresh token
+    """
+    await run_sync(db, logout, token, data.refresh_token if data else None, db)
+    return {"detail": "Logged out"}
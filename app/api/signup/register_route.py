@@ -1,29 +1,39 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from app.database.connection import get_db
+from app.database.connection import get_db, run_sync
 from app.database.schemas import UserSchema
 from app.database.models import User
-from app.auth.password import hash_password
+from app.auth.password import password_hasher
 from app.database.schemas import UserResponseSchema
+from app.api.signup.login_route import get_user_by_username
+from app.database.query_budget import QueryBudgetRoute, query_budget
 
-router = APIRouter()
+router = APIRouter(route_class=QueryBudgetRoute)
+
+
+def save_user(db: Session, user: User) -> User:
+    """
+    Stores a new user in the database
+    """
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user
 
 
 @router.post("/register", response_model=UserResponseSchema)
-def register_user(user: UserSchema, db: Session = Depends(get_db)):
+@query_budget(3)
+async def register_user(user: UserSchema, db: Session = Depends(get_db)):
     """
-    This route will allow users to register
+    This route will allow users to register, the password is hashed in the password hashing pool
     """
-    existing_user = db.query(User).filter(User.username == user.username).first()
+    existing_user = await run_sync(db, get_user_by_username, db, user.username)
     if existing_user:
         raise HTTPException(status_code=400, detail="username already taken")
 
-    hashed_password = hash_password(user.password)
+    hashed_password = await password_hasher.hash(user.password)
 
     new_user = User(
         username=user.username, password=hashed_password, is_admin=user.is_admin
     )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    return new_user
+    return await run_sync(db, save_user, db, new_user)
@@ -1,7 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from fastapi_filter import FilterDepends
 from sqlalchemy.orm import Session
-from app.database.connection import get_db
+from app.database.connection import get_db, get_read_db, run_sync, session_route
 from app.auth.auth import user_authenticate
 from app.database.models import User, CredentialDetail, Platform, CredentialDetail
 from app.database.schemas import (
@@ -15,67 +15,155 @@ from app.database.schemas import (
     CredentialIntegration,
 )
 from app.filters.filter import PlatformFilter, UserIntegrationFilter
+from app.filters.pagination import CursorPage
+from app.config import settings
+from app.serialization import RowsResponse
+from app.etag import ConditionalGet
 from app.service.users.post.integration import IntegrationServices
 from app.service.users.post.credential import CredentialServices
 from app.service.users.get.platform_get import PlatformGetServices
 from app.service.users.get.integration_get import IntegrationGetServices
+from app.service.users.get.version_get import VersionGetServices
 from typing import List
+from app.database.query_budget import QueryBudgetRoute, query_budget
 
-router = APIRouter(prefix="/users")
+router = APIRouter(prefix="/users", route_class=QueryBudgetRoute)
 
 
 # Get details of current user
 @router.get("/me", response_model=CurrentUserResponseSchema)
-def get_current_user(current_user: User = Depends(user_authenticate)):
+@query_budget(3)
+@session_route
+async def get_current_user(
+    response: Response,
+    current_user: User = Depends(user_authenticate),
+    db: Session = Depends(get_db),
+    conditional: ConditionalGet = Depends(),
+):
     """
-    This route will get the details of current user
+    This route will get the details of current user, with an ETag. A request whose If-None-Match
+    matches it gets a 304 without loading the platforms
     """
+    version_service = VersionGetServices(db)
+    versions = await run_sync(db, version_service.get_user_versions, current_user.id)
+    not_modified = conditional.not_modified(current_user.id, versions)
+    if not_modified:
+        return not_modified
+    conditional.set_header(response)
+    # Lazy load the platforms in one statement, refresh() would also reselect the user row
+    await run_sync(db, lambda: current_user.platforms)
     return current_user
 
 
 # Get details of platforms of current user
 @router.get("/me/platforms", response_model=List[PlatformResponseSchema])
-def get_platforms(
+@query_budget(4)
+@session_route
+async def get_platforms(
+    response: Response,
     current_user: User = Depends(user_authenticate),
-    db: Session = Depends(get_db),
+    primary: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     filters: PlatformFilter = FilterDepends(PlatformFilter),
+    page: CursorPage = Depends(),
+    conditional: ConditionalGet = Depends(),
 ):
     """
-    This route will get the platforms that current user is integrated with
+    This route will get a page of the platforms that current user is integrated with,
+    the cursor of the next page is sent in the X-Next-Cursor header. Pages have an ETag,
+    a request whose If-None-Match matches it gets a 304 without querying the page
     """
+    # The versions are read from the primary, in the session that authenticated the request
+    version_service = VersionGetServices(primary)
+    versions = await run_sync(primary, version_service.get_user_versions, current_user.id)
+    not_modified = conditional.not_modified(current_user.id, versions)
+    if not_modified:
+        return not_modified
+    # A replica lagging behind them would send older data under their ETag, the primary serves it then
+    read_version_service = VersionGetServices(db)
+    if not await run_sync(db, read_version_service.is_current, current_user.id, versions):
+        db = primary
     platform_service = PlatformGetServices(db)
-    return platform_service.get_user_platforms(current_user, filters)
+    if settings.fast_serialization:
+        rows = await run_sync(
+            db, platform_service.get_user_platform_rows, current_user, filters, page
+        )
+        rows_response = RowsResponse(PlatformResponseSchema, rows)
+        page.set_header(rows_response)
+        conditional.set_header(rows_response)
+        return rows_response
+    platforms = await run_sync(
+        db, platform_service.get_user_platforms, current_user, filters, page
+    )
+    page.set_header(response)
+    conditional.set_header(response)
+    return platforms
 
 
 # Get the user_integrations of current user
 @router.get(
     "/me/user_integrations", response_model=List[UserIntegrationWithDetailsSchema]
 )
-def get_user_integrations(
+@query_budget(5)
+@session_route
+async def get_user_integrations(
+    response: Response,
     current_user: User = Depends(user_authenticate),
-    db: Session = Depends(get_db),
+    primary: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     filters: UserIntegrationFilter = FilterDepends(UserIntegrationFilter),
+    page: CursorPage = Depends(),
+    conditional: ConditionalGet = Depends(),
 ):
+    # The versions are read from the primary, in the session that authenticated the request
+    version_service = VersionGetServices(primary)
+    versions = await run_sync(primary, version_service.get_user_versions, current_user.id)
+    not_modified = conditional.not_modified(current_user.id, versions)
+    if not_modified:
+        return not_modified
+    # A replica lagging behind them would send older data under their ETag, the primary serves it then
+    read_version_service = VersionGetServices(db)
+    if not await run_sync(db, read_version_service.is_current, current_user.id, versions):
+        db = primary
     integration_service = IntegrationGetServices(db)
-    return integration_service.get_user_integrations(current_user, filters)
+    if settings.fast_serialization:
+        rows = await run_sync(
+            db, integration_service.get_user_integration_rows, current_user, filters, page
+        )
+        rows_response = RowsResponse(UserIntegrationWithDetailsSchema, rows)
+        page.set_header(rows_response)
+        conditional.set_header(rows_response)
+        return rows_response
+    integrations = await run_sync(
+        db, integration_service.get_user_integrations, current_user, filters, page
+    )
+    page.set_header(response)
+    conditional.set_header(response)
+    return integrations
 
 
+# Integrate the current user with a platform
 @router.post("/integrate", response_model=UserIntegrationResponseSchema)
-def integrate_user(
+@query_budget(5)
+@session_route
+async def integrate_user(
     integrate_cred: CredentialIntegration,
     user: User = Depends(user_authenticate),
     db: Session = Depends(get_db),
 ):
     """
-    This route will allow the current user to integrate with a platform,store them in user_integrations table and store the credentials in credential_details table
+    This route will allow the current user to integrate with a platform,store them in user_integrations table and store the credentials in credential_details table.
+    Integrating again keeps is_active and updates the values of the credentials with the same keys
     """
     integration_service = IntegrationServices(db, integrate_cred, user)
-    response = integration_service.integrate()
+    response = await run_sync(db, integration_service.integrate)
     return response
 
 
 @router.post("/credentials/", response_model=CredentialDetailResponseSchema)
-def add_credential(
+@query_budget(4)
+@session_route
+async def add_credential(
     credential_data: CredentialDetailSchema,
     user: User = Depends(user_authenticate),
     db: Session = Depends(get_db),
@@ -84,5 +172,5 @@ def add_credential(
     This route will allow the current user to add credentials to the CredentialDetail model
     """
     credential_service = CredentialServices(db, user, credential_data)
-    response = credential_service.cred_service()
+    response = await run_sync(db, credential_service.cred_service)
     return response
@@ -1,70 +1,252 @@
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
-from sqlalchemy.orm import Session
-import os
-from dotenv import load_dotenv
-from datetime import datetime, timedelta, timezone
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, make_transient_to_detached
+from typing import Optional, Tuple
 from app.auth.utils import (
-    ACCESS_TOKEN_EXPIRE_MINUTES,
-    create_access_token,
     SECRET_KEY,
     REFRESH_KEY,
     ALGORITHM,
+    issue_tokens,
 )
-from app.database.connection import get_db
+from app.auth.cache import Principal, principal_cache
+from app.auth.revocation import revocation_store
+from app.auth.user_versions import user_versions
+from app.config import settings
+from app.database.connection import get_db, run_sync
 from app.database.models import User
+from app.instrumentation import timed
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 
-def verify_token(token: str, key: str):
+def decode_token(token: str, key: str) -> dict:
     """
-    This function will take the token and verify that it is valid before using it to authenticate or create new access token
+    This function will take the token and verify that it is valid, returning all of its claims
     """
     try:
         payload = jwt.decode(token, key, algorithms=ALGORITHM)
-        username = str(payload.get("sub"))
-        if username is None:
-            raise HTTPException(
-                status_code=401, detail="Token is invalid, sub claim is missing"
-            )
-        return username
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("sub") is None:
+        raise HTTPException(
+            status_code=401, detail="Token is invalid, sub claim is missing"
+        )
+    return payload
+
+
+def verify_token(token: str, key: str):
+    """
+    This function will take the token and verify that it is valid before using it to authenticate or create new access token
+    """
+    return str(decode_token(token, key)["sub"])
+
+
+def detached_user(principal: Principal) -> User:
+    """
+    This function will build a detached User from a principal
+    """
+    user = User(id=principal.id, username=principal.username, is_admin=principal.is_admin)
+    make_transient_to_detached(user)
+    return user
+
+
+def attach_cached_user(db: Session, principal: Principal) -> User:
+    """
+    This function will attach a principal to the session as a User without querying the database,
+    columns that are not in the principal (and relationships) are lazy loaded on first access
+    """
+    return db.merge(detached_user(principal), load=False)
+
+
+def principal_of(user: User, payload: dict) -> Principal:
+    """
+    This function will build the principal of a user read from the database
+    """
+    return Principal(
+        user.id,  # type: ignore
+        user.username,  # type: ignore
+        bool(user.is_admin),
+        payload.get("jti"),
+        payload.get("iat"),
+        user.token_version,  # type: ignore
+    )
+
+
+def principal_from_claims(payload: dict) -> Optional[Principal]:
+    """
+    This function will build a principal from the uid, adm and ver claims of an access token, or return
+    None if the token doesn't carry them
+    """
+    if not settings.access_token_claims:
+        return None
+    try:
+        return Principal(
+            int(payload["uid"]),
+            str(payload["sub"]),
+            bool(payload["adm"]),
+            payload.get("jti"),
+            payload.get("iat"),
+            int(payload["ver"]),
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def cached_principal(token: str) -> Optional[Principal]:
+    """
+    This function will return the cached principal of a token if it is still current
+    """
+    principal = principal_cache.get(token)
+    if principal is None:
+        return None
+    revocation_store.check(principal.jti, principal.username, principal.issued_at)
+    if not user_versions.is_current(principal.id, principal.version):
+        return None
+    return principal
+
+
+def claims_principal(token: str) -> Tuple[dict, Optional[Principal]]:
+    """
+    This function will verify a token and return its claims, with the principal they carry if it is current
+    """
+    payload = decode_token(token, SECRET_KEY)
+    revocation_store.check(payload.get("jti"), str(payload["sub"]), payload.get("iat"))
+    principal = principal_from_claims(payload)
+    if principal is not None and not user_versions.is_current(principal.id, principal.version):
+        # The privileges of the user changed since the token was issued
+        principal = None
+    return payload, principal
+
+
+def load_principal(token: str, db: Session) -> Tuple[Principal, Optional[User]]:
+    """
+    This function will authenticate a token from the principal cache or from the claims of the token,
+    the user is only read when neither is current. Returns the principal, and the user if it was read
+    """
+    revocation_store.refresh(db)
+    user_versions.refresh(db)
+    principal = cached_principal(token)
+    if principal is not None:
+        return principal, None
 
+    payload, principal = claims_principal(token)
+    user = None
+    if principal is None:
+        user = db.query(User).filter(User.username == str(payload["sub"])).first()
+        if user is None:
+            raise HTTPException(status_code=401, detail="User not found")
+        principal = principal_of(user, payload)
+    principal_cache.set(token, principal, payload.get("exp"))
+    return principal, user
+
+
+def authenticated_user(token: str, db: Session) -> User:
+    """
+    This function will authenticate a token and return its user, attached to the session
+    """
+    principal, user = load_principal(token, db)
+    if user is not None:
+        return user
+    return attach_cached_user(db, principal)
 
-def user_authenticate(
+
+@timed("auth")
+async def user_authenticate(
     token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
 ) -> User:
     """
     This function will grant authorization if the user exists
     """
-    username = verify_token(token, SECRET_KEY)
-    user = db.query(User).filter(User.username == username).first()
-    if user is None:
-        raise HTTPException(status_code=401, detail="User not found")
-    return user
+    return await run_sync(db, authenticated_user, token, db)
 
 
-def refresh_access_token(token: str, db: Session):
+@timed("auth")
+async def principal_authenticate(
+    token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
+) -> Principal:
     """
-    This function will create a new access token
+    This function will grant authorization like user_authenticate, but returns the principal of the user
+    instead of a User for endpoints that only need the identity
     """
-    username = verify_token(token, REFRESH_KEY)
+    principal, _ = await run_sync(db, load_principal, token, db)
+    return principal
+
+
+def check_refresh_token(token: str) -> dict:
+    """
+    This function will verify a refresh token and return its claims, it must carry a jti to be rotated
+    """
+    payload = decode_token(token, REFRESH_KEY)
+    if payload.get("jti") is None:
+        raise HTTPException(status_code=401, detail="Token cannot be refreshed, log in again")
+    return payload
+
+
+def refresh_access_token(token: str, db: Session) -> dict:
+    """
+    This function will rotate a refresh token: it is revoked and a new access token and refresh token
+    are issued. A refresh token that was already rotated is being replayed, so every token of its user
+    is revoked
+    """
+    payload = check_refresh_token(token)
+    username = str(payload["sub"])
+    revocation_store.refresh(db)
+    if revocation_store.is_token_revoked(payload["jti"]):
+        revocation_store.revoke_user(db, username)
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    revocation_store.check(payload["jti"], username, payload.get("iat"))
     user = db.query(User).filter(User.username == username).first()
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    new_access_token = create_access_token({"sub": username}, access_token_expires)
-    return {"access token": new_access_token, "token-type": "Bearer"}
+    # The claims of the new access token are read before the commit expires the user
+    tokens = issue_tokens(user)
+    try:
+        revocation_store.revoke_token(db, payload["jti"], payload["exp"])
+    except IntegrityError:
+        # Another request rotated the same token first
+        db.rollback()
+        revocation_store.revoke_user(db, username)
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    return tokens
+
 
+def logout(token: str, refresh_token: Optional[str], db: Session):
+    """
+    This function will revoke an access token and, when given, the refresh token issued with it
+    """
+    payload = decode_token(token, SECRET_KEY)
+    if payload.get("jti") is not None:
+        revocation_store.revoke_token(db, payload["jti"], payload["exp"])
+    principal_cache.invalidate_token(token)
+    if refresh_token is not None:
+        refresh_payload = check_refresh_token(refresh_token)
+        if refresh_payload["sub"] != payload["sub"]:
+            raise HTTPException(status_code=401, detail="Refresh token belongs to another user")
+        if not revocation_store.is_token_revoked(refresh_payload["jti"]):
+            revocation_store.revoke_token(db, refresh_payload["jti"], refresh_payload["exp"])
 
-def admin_authenticate(user: User = Depends(user_authenticate)) -> User:
+
+@timed("auth")
+async def admin_authenticate(user: User = Depends(user_authenticate)) -> User:
     """
     This function will verify that the authenticated user has admin privileges
     """
-    # print(user.id, user.username, user.password, user.is_admin)
+    # Privilege changes bump the token version of the user, so a principal carrying a stale admin
+    # flag is never current and the flag here is always up to date
     if not user.is_admin:  # type: ignore
         raise HTTPException(status_code=401, detail="Invalid, user is not admin")
     return user
+
+
+@timed("auth")
+async def admin_principal_authenticate(
+    principal: Principal = Depends(principal_authenticate),
+) -> Principal:
+    """
+    This function will verify that the authenticated principal has admin privileges
+    """
+    if not principal.is_admin:
+        raise HTTPException(status_code=401, detail="Invalid, user is not admin")
+    return principal
@@ -0,0 +1,144 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Optional, Set
+import os
+import time
+
+# Bounds for the principal cache, entries also never outlive their token
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+
+
+class Principal:
+    """
+    The identity of an authenticated user: the columns of the user that authorization needs and
+    the claims of its token. Safe to share between requests
+    """
+
+    __slots__ = ("id", "username", "is_admin", "jti", "issued_at", "version")
+
+    def __init__(
+        self,
+        id: int,
+        username: str,
+        is_admin: bool,
+        jti: Optional[str] = None,
+        issued_at: Optional[float] = None,
+        version: Optional[int] = None,
+    ):
+        self.id = id
+        self.username = username
+        self.is_admin = is_admin
+        # Claims of the token, so revocations are checked on cache hits too
+        self.jti = jti
+        self.issued_at = issued_at
+        # Token version of the user the admin flag was read at
+        self.version = version
+
+
+class PrincipalCache:
+    """
+    Bounded LRU cache of authenticated principals keyed by access token, with a TTL per entry
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # Secondary index so every token of a user can be dropped at once
+        self._tokens_by_username: Dict[str, Set[str]] = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, token: str) -> Optional[Principal]:
+        """
+        Returns the cached principal for a token, or None if it is missing or expired
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            principal, expires_at = entry
+            if expires_at <= now:
+                self._remove(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return principal
+
+    def set(self, token: str, principal: Principal, token_exp: Optional[float] = None):
+        """
+        Caches a principal for a token, the entry expires with the TTL or the token, whichever is first
+        """
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds
+        if token_exp is not None:
+            expires_at = min(expires_at, time.monotonic() + (token_exp - time.time()))
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (principal, expires_at)
+            self._tokens_by_username.setdefault(principal.username, set()).add(token)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_token(self, token: str):
+        """
+        Drops the cached principal of a single token
+        """
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+                self.invalidations += 1
+
+    def invalidate_user(self, username: str):
+        """
+        Drops every cached token of a user, call this after any write that changes or deletes the user
+        """
+        with self._lock:
+            for token in list(self._tokens_by_username.get(username, ())):
+                self._remove(token)
+                self.invalidations += 1
+
+    def clear(self):
+        """
+        Drops every cached principal
+        """
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._tokens_by_username.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the cache
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, token: str):
+        principal, _ = self._entries.pop(token)
+        tokens = self._tokens_by_username.get(principal.username)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_username[principal.username]
+
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL_SECONDS)
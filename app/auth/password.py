@@ -1,12 +1,82 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
 from passlib.context import CryptContext
+from threading import Lock
+from typing import List, Optional
+from app.instrumentation import record
+from app.metrics import LatencyStats
+import asyncio
+import multiprocessing
+import os
+import time
 
+try:
+    import argon2
+except ImportError:  # pragma: no cover - argon2-cffi is only needed for the argon2 scheme
+    argon2 = None
 
-pwd_context = CryptContext(schemes=["bcrypt"])
+# Schemes passwords are hashed with, comma separated. New hashes use the first one, hashes of
+# the others still verify and are rehashed with the first at the next login, so a scheme can
+# only be dropped once no stored hash uses it
+PASSWORD_SCHEMES = [
+    scheme.strip()
+    for scheme in os.getenv("PASSWORD_SCHEMES", "bcrypt").split(",")
+    if scheme.strip()
+]
+# Cost of bcrypt (log2 of its iterations), bcrypt hashes of a lower cost are rehashed at login.
+# benchmarks/bench_password.py recommends the costs fitting a latency budget on the host
+PASSWORD_BCRYPT_ROUNDS = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "12"))
+# Passes, memory in KiB and lanes of argon2id, hashes with other parameters are rehashed at login
+PASSWORD_ARGON2_TIME_COST = int(os.getenv("PASSWORD_ARGON2_TIME_COST", "3"))
+PASSWORD_ARGON2_MEMORY_COST = int(os.getenv("PASSWORD_ARGON2_MEMORY_COST", "65536"))
+PASSWORD_ARGON2_PARALLELISM = int(os.getenv("PASSWORD_ARGON2_PARALLELISM", "4"))
+
+# Verified in place of the hash of a username that doesn't exist
+DUMMY_PASSWORD = "dummy-password-of-unknown-users"
+
+# Size of the process pool doing the hashing work and how many calls may wait for it
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE_DEPTH = int(os.getenv("PASSWORD_HASH_QUEUE_DEPTH", "64"))
+
+
+def build_context(
+    schemes: List[str],
+    bcrypt_rounds: int = PASSWORD_BCRYPT_ROUNDS,
+    argon2_time_cost: int = PASSWORD_ARGON2_TIME_COST,
+    argon2_memory_cost: int = PASSWORD_ARGON2_MEMORY_COST,
+    argon2_parallelism: int = PASSWORD_ARGON2_PARALLELISM,
+) -> CryptContext:
+    """
+    Returns the context hashing passwords with the first scheme and its costs. Hashes of the other
+    schemes, or with other costs, verify and need an update
+    """
+    unknown = set(schemes) - {"bcrypt", "argon2"}
+    if not schemes or unknown:
+        raise ValueError("Password schemes must be bcrypt and/or argon2")
+    if "argon2" in schemes and argon2 is None:
+        raise RuntimeError("Install argon2-cffi to hash passwords with argon2")
+    return CryptContext(
+        schemes=schemes,
+        deprecated="auto",
+        # The minimum makes hashes of a lower cost need an update, stronger hashes are kept so
+        # lowering the setting never downgrades them
+        bcrypt__default_rounds=bcrypt_rounds,
+        bcrypt__min_rounds=bcrypt_rounds,
+        argon2__type="ID",
+        argon2__time_cost=argon2_time_cost,
+        argon2__memory_cost=argon2_memory_cost,
+        argon2__parallelism=argon2_parallelism,
+    )
+
+
+# Built from the environment in the server and in each pool worker alike
+pwd_context = build_context(PASSWORD_SCHEMES)
 
 
 def hash_password(password: str):
     """
-    Hashes a password using bcrypt
+    Hashes a password with the first of the password schemes
     """
     return pwd_context.hash(password)
 
@@ -16,3 +86,145 @@ def verify_password(hashed_password: str, plain_password: str):
     Verfies if a password matches its hash
     """
     return pwd_context.verify(hashed_password, plain_password)
+
+
+def password_needs_update(hashed_password: str) -> bool:
+    """
+    Returns whether a hash is of an older scheme or cost and should be replaced, it only parses
+    the hash so it is cheap enough for the event loop
+    """
+    return pwd_context.needs_update(hashed_password)
+
+
+def _timed_call(func, *args):
+    """
+    Runs func inside a pool worker and returns its result with the time it took
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class PasswordHasher:
+    """
+    Runs password hashing and verification in a dedicated, bounded process pool so that
+    login bursts can't use up the request threadpool
+    """
+
+    def __init__(self, max_workers: int, max_queue_depth: int):
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = Lock()
+        self._pending = 0
+        self.rejected = 0
+        self._dummy_hash: Optional[str] = None
+        self.queue_wait = LatencyStats()
+        self.hash_time = LatencyStats()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn keeps the workers free of the server's threads and sockets
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.max_queue_depth:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail="Server is busy, try again later",
+                    headers={"Retry-After": "1"},
+                )
+            self._pending += 1
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def _record(self, started: float, hash_seconds: float):
+        self.hash_time.observe(hash_seconds)
+        elapsed = time.perf_counter() - started
+        self.queue_wait.observe(max(elapsed - hash_seconds, 0.0))
+        record("password", elapsed)
+
+    async def _submit(self, func, *args):
+        self._acquire()
+        try:
+            started = time.perf_counter()
+            executor = self._get_executor()
+            try:
+                future = executor.submit(_timed_call, func, *args)
+                result, hash_seconds = await asyncio.wrap_future(future)
+            except BrokenProcessPool:
+                # A worker died, start a fresh pool on the next call
+                self._discard(executor)
+                raise HTTPException(
+                    status_code=503,
+                    detail="Server is busy, try again later",
+                    headers={"Retry-After": "1"},
+                )
+            self._record(started, hash_seconds)
+            return result
+        finally:
+            self._release()
+
+    def _discard(self, executor: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def hash(self, password: str) -> str:
+        """
+        Hashes a password in the pool, raises a 503 when the queue is full
+        """
+        return await self._submit(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """
+        Verifies a password against its hash in the pool, raises a 503 when the queue is full
+        """
+        return await self._submit(verify_password, plain_password, hashed_password)
+
+    async def verify_dummy(self, plain_password: str) -> bool:
+        """
+        Verifies a password against a hash of the first scheme and its costs, for logins of a
+        username that doesn't exist so they take as long as the others. Always returns False
+        """
+        if self._dummy_hash is None:
+            self._dummy_hash = await self.hash(DUMMY_PASSWORD)
+        await self.verify(plain_password, self._dummy_hash)
+        return False
+
+    def shutdown(self):
+        """
+        Stops the pool workers
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        """
+        Returns the queue and timing metrics of the pool
+        """
+        with self._lock:
+            pending = self._pending
+        return {
+            "workers": self.max_workers,
+            "max_queue_depth": self.max_queue_depth,
+            "pending": pending,
+            "rejected": self.rejected,
+            "queue_wait": self.queue_wait.snapshot(),
+            "hash_time": self.hash_time.snapshot(),
+        }
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_DEPTH)
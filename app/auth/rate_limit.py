@@ -0,0 +1,297 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from fastapi import HTTPException, Request
+from threading import Lock
+from typing import List, Optional
+from app.config import settings
+import ipaddress
+import logging
+import math
+import os
+import time
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - redis is only needed for the shared backend
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+# Login attempts allowed at once and refilled per minute for each client address, failed
+# logins allowed for each username from each client address, and failed logins allowed for
+# each username from all the addresses together. A burst of 0 turns that limit off
+LOGIN_USERNAME_BURST = int(os.getenv("LOGIN_USERNAME_BURST", "5"))
+LOGIN_USERNAME_PER_MINUTE = float(os.getenv("LOGIN_USERNAME_PER_MINUTE", "5"))
+LOGIN_USER_BURST = int(os.getenv("LOGIN_USER_BURST", "50"))
+LOGIN_USER_PER_MINUTE = float(os.getenv("LOGIN_USER_PER_MINUTE", "10"))
+LOGIN_IP_BURST = int(os.getenv("LOGIN_IP_BURST", "20"))
+LOGIN_IP_PER_MINUTE = float(os.getenv("LOGIN_IP_PER_MINUTE", "30"))
+
+# Bounds of the in-process buckets: how often refilled buckets are dropped and how many are kept
+LOGIN_RATE_LIMIT_SWEEP_SECONDS = float(os.getenv("LOGIN_RATE_LIMIT_SWEEP_SECONDS", "60"))
+LOGIN_RATE_LIMIT_MAX_KEYS = int(os.getenv("LOGIN_RATE_LIMIT_MAX_KEYS", "100000"))
+
+# Redis url of buckets shared by every worker, the buckets are kept in each worker when it isn't set
+LOGIN_RATE_LIMIT_REDIS_URL = os.getenv("LOGIN_RATE_LIMIT_REDIS_URL", "")
+
+
+class BucketLimit:
+    """
+    A token bucket per key: `burst` tokens at most, refilled at `per_minute` tokens a minute.
+    Every request takes one, or only the failed ones when `failures_only` is set
+    """
+
+    def __init__(self, name: str, burst: int, per_minute: float, failures_only: bool = False):
+        if burst > 0 and per_minute <= 0:
+            raise ValueError(f"The {name} limit needs a positive refill rate, or a burst of 0")
+        self.name = name
+        self.burst = burst
+        self.per_second = per_minute / 60
+        self.failures_only = failures_only
+        self.rejected = 0
+
+
+class RateLimitBackend(ABC):
+    """
+    Stores the token buckets of the rate limiter. Subclasses keep them in the worker or in a store
+    shared by every worker
+    """
+
+    @abstractmethod
+    async def take(self, key: str, burst: int, per_second: float, cost: int = 1) -> float:
+        """
+        Takes `cost` tokens from the bucket of a key if it has one, a cost of 0 only looks at it.
+        Returns 0 if it had one and otherwise the seconds until it will
+        """
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the backend
+        """
+        return {}
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """
+    Token buckets of this worker, a bucket is its token count and the time it was last updated.
+    Buckets that have refilled are dropped every `sweep_seconds`, a fresh bucket is full anyway,
+    and the least recently used ones when there are more than `max_keys`
+    """
+
+    def __init__(self, sweep_seconds: float, max_keys: int):
+        self.sweep_seconds = sweep_seconds
+        self.max_keys = max_keys
+        # key -> (tokens, updated_at, full_at), least recently updated first
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+        self._swept_at = time.monotonic()
+        self._lock = Lock()
+        self.evictions = 0
+
+    async def take(self, key: str, burst: int, per_second: float, cost: int = 1) -> float:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._swept_at >= self.sweep_seconds:
+                self._sweep(now)
+            bucket = self._buckets.pop(key, None)
+            tokens = float(burst)
+            if bucket is not None:
+                tokens = min(tokens, bucket[0] + (now - bucket[1]) * per_second)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= cost
+            else:
+                wait = (1 - tokens) / per_second
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / per_second)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+            return wait
+
+    def _sweep(self, now: float):
+        for key in [key for key, bucket in self._buckets.items() if bucket[2] <= now]:
+            del self._buckets[key]
+            self.evictions += 1
+        self._swept_at = now
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": "memory", "keys": len(self._buckets), "evictions": self.evictions}
+
+
+# Refills and takes a token atomically with the clock of the server, so the workers agree on it.
+# The bucket expires once it would be full again
+TAKE_SCRIPT = """
+local burst = tonumber(ARGV[1])
+local per_second = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = burst
+if bucket[1] then
+    tokens = math.min(burst, tonumber(bucket[1]) + (now - tonumber(bucket[2])) * per_second)
+end
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - cost
+else
+    wait = (1 - tokens) / per_second
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / per_second * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """
+    Token buckets shared by every worker in Redis, each bucket is a hash that expires once it
+    has refilled
+    """
+
+    def __init__(self, url: str, prefix: str = "login-rate-limit:"):
+        if aioredis is None:
+            raise RuntimeError("Install redis to share the login rate limits between workers")
+        self.prefix = prefix
+        self._client = aioredis.from_url(url)
+        self._take = self._client.register_script(TAKE_SCRIPT)
+
+    async def take(self, key: str, burst: int, per_second: float, cost: int = 1) -> float:
+        return float(await self._take(keys=[self.prefix + key], args=[burst, per_second, cost]))
+
+    def stats(self) -> dict:
+        return {"backend": "redis"}
+
+
+class LoginRateLimiter:
+    """
+    Admission control of the logins: a token bucket per client address taken by every login, one
+    per username and address taken by the failed ones, and a larger one per username taken by the
+    failed ones from every address. They are checked before the user is read or its password
+    verified, so credential stuffing is refused without costing a query or a bcrypt verification.
+    The failures of one address can't lock a user out of the others, and guesses spread over many
+    addresses still run out of the username's own bucket. Requests are let through when the
+    backend fails
+    """
+
+    def __init__(self, backend: RateLimitBackend, limits: List[BucketLimit]):
+        self.backend = backend
+        self.limits = limits
+        self.allowed = 0
+        self.backend_errors = 0
+        self._lock = Lock()
+
+    def _keys(self, client_ip: Optional[str], username: str) -> dict:
+        address = client_ip or "unknown"
+        return {"ip": address, "username": f"{username}@{address}", "user": username}
+
+    async def _take(self, limit: BucketLimit, key: str, cost: int) -> float:
+        try:
+            return await self.backend.take(
+                f"{limit.name}:{key}", limit.burst, limit.per_second, cost
+            )
+        except Exception:
+            logger.exception("Login rate limit backend failed, letting the request through")
+            with self._lock:
+                self.backend_errors += 1
+            return 0.0
+
+    async def check(self, client_ip: Optional[str], username: str):
+        """
+        Takes a token from the bucket of the address of a login and looks at the buckets of its
+        username, from that address and from all of them, raises a 429 when one of them is empty
+        """
+        keys = self._keys(client_ip, username)
+        for limit in self.limits:
+            if limit.burst <= 0:
+                continue
+            wait = await self._take(limit, keys[limit.name], 0 if limit.failures_only else 1)
+            if wait > 0:
+                with self._lock:
+                    limit.rejected += 1
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many login attempts, try again later",
+                    headers={"Retry-After": str(math.ceil(wait))},
+                )
+        with self._lock:
+            self.allowed += 1
+
+    async def failed(self, client_ip: Optional[str], username: str):
+        """
+        Takes a token from the buckets counting the failed logins of a username, from an address
+        and from all of them
+        """
+        keys = self._keys(client_ip, username)
+        for limit in self.limits:
+            if limit.burst > 0 and limit.failures_only:
+                await self._take(limit, keys[limit.name], 1)
+
+    def stats(self) -> dict:
+        """
+        Returns the limits, the counters and the backend metrics
+        """
+        with self._lock:
+            return {
+                "allowed": self.allowed,
+                "backend_errors": self.backend_errors,
+                "limits": {
+                    limit.name: {
+                        "burst": limit.burst,
+                        "per_minute": limit.per_second * 60,
+                        "rejected": limit.rejected,
+                    }
+                    for limit in self.limits
+                },
+                **self.backend.stats(),
+            }
+
+
+def create_backend() -> RateLimitBackend:
+    """
+    Returns the Redis backend when LOGIN_RATE_LIMIT_REDIS_URL is set and the in-process one
+    otherwise
+    """
+    if LOGIN_RATE_LIMIT_REDIS_URL:
+        return RedisRateLimitBackend(LOGIN_RATE_LIMIT_REDIS_URL)
+    return MemoryRateLimitBackend(LOGIN_RATE_LIMIT_SWEEP_SECONDS, LOGIN_RATE_LIMIT_MAX_KEYS)
+
+
+def client_address(request: Request) -> Optional[str]:
+    """
+    Returns the address of the client of a request. Behind the TRUSTED_PROXIES it is the last
+    address of X-Forwarded-For that isn't one of them, the ones before it can be forged
+    """
+    if request.client is None:
+        return None
+    address = request.client.host
+    forwarded = request.headers.get("x-forwarded-for")
+    if not forwarded or not _trusted(address):
+        return address
+    for hop in reversed([hop.strip() for hop in forwarded.split(",") if hop.strip()]):
+        address = hop
+        if not _trusted(hop):
+            break
+    return address
+
+
+def _trusted(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in settings.trusted_proxies)
+
+
+# The address is checked first, an attacker spreading guesses over many usernames runs out of it,
+# and the username from all the addresses last, it only locks out a user under a distributed attack
+login_rate_limiter = LoginRateLimiter(
+    create_backend(),
+    [
+        BucketLimit("ip", LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE),
+        BucketLimit(
+            "username", LOGIN_USERNAME_BURST, LOGIN_USERNAME_PER_MINUTE, failures_only=True
+        ),
+        BucketLimit("user", LOGIN_USER_BURST, LOGIN_USER_PER_MINUTE, failures_only=True),
+    ],
+)
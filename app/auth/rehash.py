@@ -0,0 +1,78 @@
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import update
+from threading import Lock
+from app.auth.password import password_hasher
+from app.database.connection import session_local
+from app.database.models import User
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def replace_statement(user_id: int, old_hash: str, new_hash: str):
+    """
+    Replaces the password hash of a user, only if it is still the one that was verified so a
+    password changed meanwhile is kept
+    """
+    return (
+        update(User)
+        .where(User.id == user_id, User.password == old_hash)
+        .values(password=new_hash)
+    )
+
+
+class PasswordRehasher:
+    """
+    Replaces the hash of a password that needs an update (an older scheme or cost) after a
+    successful login. It runs as a background task once the login response is sent, hashing in
+    the password hashing pool and writing from a session of its own. A rehash that finds the pool
+    busy is skipped, the next login tries again
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.rehashed = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    async def _new_hash(self, password: str):
+        try:
+            return await password_hasher.hash(password)
+        except HTTPException:
+            self._count("skipped")
+            return None
+
+    def _store(self, user_id: int, old_hash: str, new_hash: str) -> bool:
+        with session_local() as db:
+            result = db.execute(replace_statement(user_id, old_hash, new_hash))
+            db.commit()
+            return result.rowcount == 1
+
+    async def rehash(self, user_id: int, old_hash: str, password: str):
+        """
+        Rehashes the password of a user and stores it
+        """
+        try:
+            new_hash = await self._new_hash(password)
+            if new_hash is None:
+                return
+            stored = await run_in_threadpool(self._store, user_id, old_hash, new_hash)
+            self._count("rehashed" if stored else "skipped")
+        except Exception:
+            self._count("failed")
+            logger.exception("Rehashing the password of user %s failed", user_id)
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the rehashes
+        """
+        with self._lock:
+            return {"rehashed": self.rehashed, "skipped": self.skipped, "failed": self.failed}
+
+
+password_rehasher = PasswordRehasher()
@@ -0,0 +1,187 @@
+from fastapi import HTTPException
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+from app.auth.cache import principal_cache
+from app.auth.utils import REFRESH_TOKEN_EXPIRE_DAYS
+from app.database.models import TokenRevocation
+from app.database.query_budget import uncounted
+import heapq
+import os
+import time
+
+# How often a worker loads the revocations made by the other workers
+REVOCATION_REFRESH_SECONDS = float(os.getenv("REVOCATION_REFRESH_SECONDS", "5"))
+
+# A user-wide revocation outlives every token issued before it
+USER_REVOCATION_SECONDS = REFRESH_TOKEN_EXPIRE_DAYS * 24 * 3600
+
+REVOCATION_COLUMNS = (
+    TokenRevocation.id,
+    TokenRevocation.jti,
+    TokenRevocation.username,
+    TokenRevocation.issued_before,
+    TokenRevocation.expires_at,
+)
+
+
+class RevocationStore:
+    """
+    In-memory denylist of revoked tokens (by jti) and of users whose tokens issued before a
+    cutoff are revoked. Checks are dict lookups and entries are pruned once the tokens they
+    revoke have expired. The token_revocations table persists the entries, it is loaded at
+    startup and polled for the revocations of the other workers at most once every
+    REVOCATION_REFRESH_SECONDS
+    """
+
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self._tokens: Dict[str, float] = {}
+        self._users: Dict[str, Tuple[float, float]] = {}
+        # (expires_at, jti or None, username or None) of every entry, soonest first
+        self._expiry: List[Tuple[float, str, str]] = []
+        self._max_id = 0
+        self._refreshed_at = float("-inf")
+        self._lock = Lock()
+        self.revocations = 0
+        self.pruned = 0
+
+    def _add(self, jti: Optional[str], username: Optional[str], issued_before, expires_at: float):
+        if jti is not None:
+            self._tokens[jti] = expires_at
+            heapq.heappush(self._expiry, (expires_at, jti, ""))
+        elif username is not None:
+            current = self._users.get(username)
+            if current is None or current[0] < issued_before:
+                self._users[username] = (issued_before, expires_at)
+                heapq.heappush(self._expiry, (expires_at, "", username))
+
+    def _prune(self, now: float):
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, jti, username = heapq.heappop(self._expiry)
+            if jti and self._tokens.get(jti) == expires_at:
+                del self._tokens[jti]
+                self.pruned += 1
+            elif username and self._users.get(username, (0, None))[1] == expires_at:
+                del self._users[username]
+                self.pruned += 1
+
+    def _apply(self, rows: list):
+        with self._lock:
+            for row in rows:
+                if row.id > self._max_id:
+                    self._add(row.jti, row.username, row.issued_before, row.expires_at)
+                    self._max_id = row.id
+            self._prune(time.time())
+            self._refreshed_at = time.monotonic()
+
+    def _statement(self):
+        return (
+            select(*REVOCATION_COLUMNS)
+            .filter(TokenRevocation.id > self._max_id)
+            .filter(TokenRevocation.expires_at > time.time())
+            .order_by(TokenRevocation.id)
+        )
+
+    def _due(self) -> bool:
+        return time.monotonic() - self._refreshed_at >= self.refresh_seconds
+
+    def load(self, db: Session):
+        """
+        Deletes the expired revocations and loads the others, called at startup
+        """
+        db.execute(delete(TokenRevocation).filter(TokenRevocation.expires_at <= time.time()))
+        db.commit()
+        self._apply(db.execute(self._statement()).all())
+
+    def refresh(self, db: Session):
+        """
+        Loads the revocations made since the last refresh, if it is due
+        """
+        if not self._due():
+            return
+        # The refresh is shared by every request of the worker, don't charge it to this one
+        with uncounted():
+            rows = db.execute(self._statement()).all()
+        self._apply(rows)
+
+    def is_token_revoked(self, jti: Optional[str]) -> bool:
+        """
+        Returns whether a token was revoked by its jti
+        """
+        return jti is not None and jti in self._tokens
+
+    def is_revoked(self, jti: Optional[str], username: str, issued_at: Optional[float]) -> bool:
+        """
+        Returns whether a token was revoked, by its jti or by a revocation of every token of its user
+        """
+        if jti is not None and jti in self._tokens:
+            return True
+        revocation = self._users.get(username)
+        # Tokens without an issue time predate revocations, a user-wide revocation covers them
+        return revocation is not None and (issued_at is None or issued_at <= revocation[0])
+
+    def check(self, jti: Optional[str], username: str, issued_at: Optional[float]):
+        """
+        Refuses a revoked token
+        """
+        if self.is_revoked(jti, username, issued_at):
+            raise HTTPException(status_code=401, detail="Token has been revoked")
+
+    def _token_values(self, jti: str, expires_at: float) -> dict:
+        return {"jti": jti, "expires_at": expires_at}
+
+    def _user_values(self, username: str) -> dict:
+        now = time.time()
+        return {
+            "username": username,
+            "issued_before": now,
+            "expires_at": now + USER_REVOCATION_SECONDS,
+        }
+
+    def _revoked(self, values: dict):
+        with self._lock:
+            self._add(
+                values.get("jti"),
+                values.get("username"),
+                values.get("issued_before"),
+                values["expires_at"],
+            )
+            self.revocations += 1
+        if values.get("username") is not None:
+            principal_cache.invalidate_user(values["username"])
+
+    def revoke_token(self, db: Session, jti: str, expires_at: float):
+        """
+        Revokes a single token by its jti until it expires
+        """
+        values = self._token_values(jti, expires_at)
+        db.execute(insert(TokenRevocation).values(**values))
+        db.commit()
+        self._revoked(values)
+
+    def revoke_user(self, db: Session, username: str):
+        """
+        Revokes every token of a user issued until now
+        """
+        values = self._user_values(username)
+        db.execute(insert(TokenRevocation).values(**values))
+        db.commit()
+        self._revoked(values)
+
+    def stats(self) -> dict:
+        """
+        Returns the size and counters of the denylist
+        """
+        with self._lock:
+            return {
+                "tokens": len(self._tokens),
+                "users": len(self._users),
+                "max_id": self._max_id,
+                "revocations": self.revocations,
+                "pruned": self.pruned,
+            }
+
+
+revocation_store = RevocationStore(REVOCATION_REFRESH_SECONDS)
@@ -0,0 +1,81 @@
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from threading import Lock
+from typing import Dict, Optional
+from app.database.models import User
+from app.database.query_budget import uncounted
+from app.database.versions import USERS, read_version
+import os
+import time
+
+# How often a worker checks whether another worker changed the token version of a user,
+# changes made by the same worker are seen at once
+USER_VERSION_CHECK_SECONDS = float(os.getenv("USER_VERSION_CHECK_SECONDS", "1"))
+
+
+class UserVersions:
+    """
+    In-process copy of the token versions of the users, for checking the version claim of
+    access tokens without reading the user. Only users whose privileges ever changed have a
+    version above 0, so the copy stays small. Writers bump the users version in the database,
+    so each worker notices within USER_VERSION_CHECK_SECONDS that its copy is stale
+    """
+
+    def __init__(self, check_seconds: float):
+        self.check_seconds = check_seconds
+        self._versions: Dict[int, int] = {}
+        self._version: Optional[int] = None
+        self._checked_at = float("-inf")
+        self._lock = Lock()
+        self.loads = 0
+
+    def _due(self) -> bool:
+        return time.monotonic() - self._checked_at >= self.check_seconds
+
+    def _statement(self):
+        return select(User.id, User.token_version).filter(User.token_version > 0)
+
+    def _store(self, version: int, rows):
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if rows is not None:
+                self._versions = {row.id: row.token_version for row in rows}
+                self._version = version
+                self.loads += 1
+
+    def refresh(self, db: Session):
+        """
+        Reloads the versions if another worker changed one, at most once per check interval
+        """
+        if not self._due():
+            return
+        # The refresh is shared by every request of the worker, don't charge it to this one
+        with uncounted():
+            version = read_version(db, USERS)
+            rows = None
+            if version != self._version:
+                rows = db.execute(self._statement()).all()
+        self._store(version, rows)
+
+    def is_current(self, user_id: int, version: Optional[int]) -> bool:
+        """
+        Returns whether a token version is not older than the known version of the user
+        """
+        return version is not None and version >= self._versions.get(user_id, 0)
+
+    def set(self, user_id: int, version: int):
+        """
+        Records a version written by this worker, call this after committing the change
+        """
+        with self._lock:
+            self._versions[user_id] = version
+
+    def stats(self) -> dict:
+        """
+        Returns the size and counters of the copy
+        """
+        with self._lock:
+            return {"size": len(self._versions), "version": self._version, "loads": self.loads}
+
+
+user_versions = UserVersions(USER_VERSION_CHECK_SECONDS)
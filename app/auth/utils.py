@@ -1,12 +1,11 @@
 from jose import jwt
 from datetime import datetime, timezone, timedelta
-import os
-from dotenv import load_dotenv
+from app.config import settings
+import time
+import uuid
 
-# Load the environment variables
-load_dotenv()
-SECRET_KEY = os.getenv("SECRET_KEY", "")
-REFRESH_KEY = os.getenv("REFRESH_KEY", "")
+SECRET_KEY = settings.secret_key
+REFRESH_KEY = settings.refresh_key
 
 # Set the algorithm for jwt
 ALGORITHM = "HS256"
@@ -16,6 +15,14 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 
 
+def token_claims(expire: datetime) -> dict:
+    """
+    This function will return the expiry, issue time and unique id (jti) claims of a new token,
+    the jti and issue time are what the revocation denylist matches tokens by
+    """
+    return {"exp": expire, "iat": time.time(), "jti": uuid.uuid4().hex}
+
+
 def create_access_token(data: dict, expires: timedelta):
     """
     This function will create the access token by using jwt.encode on the data that user gave,
@@ -23,7 +30,7 @@ def create_access_token(data: dict, expires: timedelta):
     """
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + expires
-    to_encode.update({"exp": expire})
+    to_encode.update(token_claims(expire))
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
@@ -34,5 +41,33 @@ def create_refresh_token(data: dict, expires: timedelta):
     """
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + expires
-    to_encode.update({"exp": expire})
+    to_encode.update(token_claims(expire))
     return jwt.encode(to_encode, REFRESH_KEY, algorithm=ALGORITHM)
+
+
+def access_claims(user) -> dict:
+    """
+    This function will return the claims identifying a user in an access token, with the id, admin flag
+    and token version of the user when ACCESS_TOKEN_CLAIMS is set
+    """
+    claims = {"sub": user.username}
+    if settings.access_token_claims:
+        claims.update(uid=user.id, adm=bool(user.is_admin), ver=user.token_version or 0)
+    return claims
+
+
+def issue_tokens(user) -> dict:
+    """
+    This function will create a new access token and refresh token for a user
+    """
+    access_token = create_access_token(
+        access_claims(user), timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    refresh_token = create_refresh_token(
+        {"sub": user.username}, timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    )
+    return {
+        "Access Token": access_token,
+        "Refresh Token": refresh_token,
+        "Token type": "Bearer",
+    }
@@ -0,0 +1,83 @@
+from dotenv import load_dotenv
+import ipaddress
+import os
+
+
+def _flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+class Settings:
+    """
+    Database, security and startup settings of the app, read once from the environment and
+    the .env file
+    """
+
+    def __init__(self):
+        # Database urls, the async one is derived from DATABASE_URL when it isn't set
+        self.database_url = os.getenv("DATABASE_URL", "")
+        self.async_database_url = os.getenv("ASYNC_DATABASE_URL", "")
+        # Read replicas serving the GET routes, comma separated. Their async urls are derived
+        # like ASYNC_DATABASE_URL
+        self.replica_database_urls = [
+            url.strip() for url in os.getenv("REPLICA_DATABASE_URLS", "").split(",") if url.strip()
+        ]
+        # round_robin or least_outstanding (sessions of this worker open on the replica)
+        self.replica_selection = os.getenv("REPLICA_SELECTION", "round_robin")
+        # Reads of a user go to the primary for this long after one of their writes
+        self.replica_read_your_writes_seconds = float(
+            os.getenv("REPLICA_READ_YOUR_WRITES_SECONDS", "5")
+        )
+        # A replica whose connection failed is retried after this long
+        self.replica_retry_seconds = float(os.getenv("REPLICA_RETRY_SECONDS", "10"))
+        # Serve the routers from the async session instead of the sync one
+        self.use_async_db = _flag("USE_ASYNC_DB", "false")
+        # Create the missing tables when the app starts. Databases managed by the alembic
+        # migrations can turn this off, so workers start without running any DDL
+        self.create_schema_on_startup = _flag("CREATE_SCHEMA_ON_STARTUP", "true")
+        # List endpoints select only the columns of their response schema and encode the rows
+        # with orjson, skipping the validation of ORM objects by the response_model
+        self.fast_serialization = _flag("FAST_SERIALIZATION", "false")
+
+        # Pool settings, see https://docs.sqlalchemy.org/en/20/core/pooling.html
+        self.db_pool_size = int(os.getenv("DB_POOL_SIZE", "5"))
+        self.db_max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+        self.db_pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+        self.db_pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+        self.db_pool_pre_ping = _flag("DB_POOL_PRE_PING", "true")
+
+        # Keys signing the access and refresh tokens
+        self.secret_key = os.getenv("SECRET_KEY", "")
+        self.refresh_key = os.getenv("REFRESH_KEY", "")
+        # Embed the user id, admin flag and token version in access tokens, so requests are
+        # authenticated from the token without reading the user
+        self.access_token_claims = _flag("ACCESS_TOKEN_CLAIMS", "true")
+        # Addresses or networks of the proxies in front of the app, comma separated. The client
+        # address of a request they forward is read from X-Forwarded-For
+        self.trusted_proxies = [
+            ipaddress.ip_network(proxy.strip(), strict=False)
+            for proxy in os.getenv("TRUSTED_PROXIES", "").split(",")
+            if proxy.strip()
+        ]
+
+        # Master key wrapping the data keys that encrypt the credential values, 32 bytes in
+        # urlsafe base64. Credential values are stored in plaintext while it isn't set
+        self.credential_master_key = os.getenv("CREDENTIAL_MASTER_KEY", "")
+        # Master keys replaced by CREDENTIAL_MASTER_KEY, comma separated. Data keys they wrapped
+        # are still unwrapped until the key rotation job rewraps them
+        self.credential_previous_master_keys = [
+            key.strip()
+            for key in os.getenv("CREDENTIAL_PREVIOUS_MASTER_KEYS", "").split(",")
+            if key.strip()
+        ]
+
+
+def load_settings() -> Settings:
+    """
+    Loads the .env file into the environment and reads the settings from it
+    """
+    load_dotenv()
+    return Settings()
+
+
+settings = load_settings()
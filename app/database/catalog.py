@@ -0,0 +1,267 @@
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from threading import Lock
+from typing import Dict, Iterable, List, Optional
+from app.filters.filter import PlatformFilter
+from .models import Platform
+from .query_budget import uncounted
+from .search_index import NgramIndex
+from .versions import PLATFORMS, read_version
+import os
+import re
+import time
+
+# How often a worker compares its catalog with the version in the database, writes made
+# by the same worker are seen at once
+PLATFORM_CATALOG_CHECK_SECONDS = float(os.getenv("PLATFORM_CATALOG_CHECK_SECONDS", "5"))
+
+PLATFORM_COLUMNS = (Platform.id, Platform.name, Platform.description)
+
+
+class CachedPlatform:
+    """
+    Snapshot of a platform row, safe to share between requests
+    """
+
+    __slots__ = ("id", "name", "description")
+
+    def __init__(self, id: int, name: str, description: Optional[str]):
+        self.id = id
+        self.name = name
+        self.description = description
+
+    def to_model(self) -> Platform:
+        """
+        Returns a detached Platform with the values of the snapshot, for relationships to point to
+        """
+        platform = Platform(id=self.id, name=self.name, description=self.description)
+        make_transient_to_detached(platform)
+        return platform
+
+    def to_row(self) -> dict:
+        """
+        Returns the values of the snapshot as a dict shaped like PlatformResponseSchema
+        """
+        return {"id": self.id, "name": self.name, "description": self.description}
+
+
+def _like_pattern(value: str):
+    # Same wrapping in % as fastapi_filter applies to ilike values without a wildcard
+    if "%" not in value:
+        value = f"%{value}%"
+    pattern = "".join(
+        ".*" if char == "%" else "." if char == "_" else re.escape(char) for char in value
+    )
+    return re.compile(pattern, re.IGNORECASE | re.DOTALL)
+
+
+def filter_platforms(
+    platforms: Iterable[CachedPlatform], filters: PlatformFilter
+) -> List[CachedPlatform]:
+    """
+    Applies the filtering and ordering of a PlatformFilter to platforms held in memory
+    """
+    platforms = list(platforms)
+    for field_name, value in filters.filtering_fields:
+        name, _, operator = field_name.partition("__")
+        if operator == "ilike":
+            pattern = _like_pattern(value)
+            platforms = [
+                p
+                for p in platforms
+                if getattr(p, name) is not None and pattern.fullmatch(getattr(p, name))
+            ]
+        else:
+            platforms = [p for p in platforms if getattr(p, name) == value]
+    # Sort by the last key first, the sorts are stable. NULLs go last as in the paginated lists
+    for field in reversed(filters.order_by or []):
+        name = field.lstrip("+-")
+        if name not in CachedPlatform.__slots__:
+            raise HTTPException(status_code=400, detail=f"Cannot order by {name}")
+        present = [p for p in platforms if getattr(p, name) is not None]
+        present.sort(key=lambda p: getattr(p, name), reverse=field.startswith("-"))
+        platforms = present + [p for p in platforms if getattr(p, name) is None]
+    return platforms
+
+
+class PlatformCatalog:
+    """
+    In-process copy of the platforms table. It is loaded in one query and serves id lookups,
+    filtered lists and the platforms embedded in responses from memory. Writers bump the
+    platforms version in the database, so each worker notices within
+    PLATFORM_CATALOG_CHECK_SECONDS that its copy is stale
+    """
+
+    def __init__(self, check_seconds: float):
+        self.check_seconds = check_seconds
+        self._platforms: Dict[int, CachedPlatform] = {}
+        self._name_index = NgramIndex()
+        self._description_index = NgramIndex()
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+        self._lock = Lock()
+        self.loads = 0
+        self.checks = 0
+
+    def _due(self, force: bool) -> bool:
+        return (
+            force
+            or self._version is None
+            or time.monotonic() - self._checked_at >= self.check_seconds
+        )
+
+    def _is_newer(self, version: int) -> bool:
+        # A replica behind the database the catalog was loaded from reports an older version
+        return self._version is None or version > self._version
+
+    def _store(self, version: int, rows) -> None:
+        with self._lock:
+            self.checks += 1
+            self._checked_at = time.monotonic()
+            if rows is not None:
+                self._platforms = {row.id: CachedPlatform(*row) for row in rows}
+                self._name_index = NgramIndex()
+                self._name_index.add_many((row.id, row.name) for row in rows)
+                self._description_index = NgramIndex()
+                self._description_index.add_many(
+                    (row.id, row.description) for row in rows if row.description
+                )
+                self._version = version
+                self.loads += 1
+
+    def ensure_fresh(self, db: Session, force: bool = False) -> bool:
+        """
+        Reloads the catalog if its version changed, at most once per check interval unless forced.
+        Returns whether the version was checked
+        """
+        if not self._due(force):
+            return False
+        # The refresh is shared by every request of the worker, don't charge it to this one
+        with uncounted():
+            version = read_version(db, PLATFORMS)
+            rows = None
+            if self._is_newer(version):
+                rows = db.execute(select(*PLATFORM_COLUMNS)).all()
+        self._store(version, rows)
+        return True
+
+    def invalidate(self):
+        """
+        Makes the next lookup check the version, call this after committing a platform write
+        """
+        with self._lock:
+            self._checked_at = float("-inf")
+
+    def get(self, db: Session, platform_id: int) -> Optional[CachedPlatform]:
+        """
+        Returns a platform by its id, or None if it doesn't exist
+        """
+        checked = self.ensure_fresh(db)
+        platform = self._platforms.get(platform_id)
+        if platform is None and not checked:
+            # The platform may have been created by another worker since the last check
+            self.ensure_fresh(db, force=True)
+            platform = self._platforms.get(platform_id)
+        return platform
+
+    def get_many(self, db: Session, ids: Iterable[int]) -> Dict[int, CachedPlatform]:
+        """
+        Returns the platforms of the given ids by id, ids that don't exist are left out
+        """
+        checked = self.ensure_fresh(db)
+        ids = set(ids)
+        if not checked and any(i not in self._platforms for i in ids):
+            self.ensure_fresh(db, force=True)
+        return self._get_many(ids)
+
+    def _get_many(self, ids: set) -> Dict[int, CachedPlatform]:
+        platforms = self._platforms
+        return {i: platforms[i] for i in ids if i in platforms}
+
+    def all(self, db: Session) -> List[CachedPlatform]:
+        """
+        Returns every platform, by id
+        """
+        self.ensure_fresh(db)
+        return sorted(self._platforms.values(), key=lambda platform: platform.id)
+
+    def filter(
+        self, db: Session, filters: PlatformFilter, ids: Optional[Iterable[int]] = None
+    ) -> List[CachedPlatform]:
+        """
+        Returns the platforms, or only the given ids, matching a filter
+        """
+        checked = self.ensure_fresh(db)
+        if ids is not None:
+            ids = list(ids)
+            if not checked and any(i not in self._platforms for i in ids):
+                self.ensure_fresh(db, force=True)
+        return self._filter(filters, ids)
+
+    def _filter(
+        self, filters: PlatformFilter, ids: Optional[List[int]]
+    ) -> List[CachedPlatform]:
+        platforms = self._platforms
+        if ids is None:
+            selected = platforms.values()
+        else:
+            selected = [platforms[i] for i in ids if i in platforms]
+        return filter_platforms(selected, filters)
+
+    def search(self, db: Session, query: str, limit: int) -> List[CachedPlatform]:
+        """
+        Returns the platforms best matching a search, name matches rank above description matches
+        """
+        self.ensure_fresh(db)
+        return self._search(query, limit)
+
+    def _search(self, query: str, limit: int) -> List[CachedPlatform]:
+        ids = self._name_index.search(query, limit)
+        if len(ids) < limit:
+            ids += [
+                platform_id
+                for platform_id in self._description_index.search(query, limit)
+                if platform_id not in ids
+            ]
+        return [self._platforms[platform_id] for platform_id in ids[:limit]]
+
+    def _missing(self, instances: list) -> bool:
+        return any(
+            instance.platform_id is not None and instance.platform_id not in self._platforms
+            for instance in instances
+        )
+
+    def _set_platforms(self, instances: list) -> list:
+        for instance in instances:
+            platform = self._platforms.get(instance.platform_id)
+            set_committed_value(
+                instance, "platform", platform.to_model() if platform is not None else None
+            )
+        return instances
+
+    def attach(self, db: Session, instances: list) -> list:
+        """
+        Sets the platform relationship of loaded rows (integrations, credentials) from the catalog
+        instead of joining the platforms table
+        """
+        checked = self.ensure_fresh(db)
+        if not checked and self._missing(instances):
+            self.ensure_fresh(db, force=True)
+        return self._set_platforms(instances)
+
+    def stats(self) -> dict:
+        """
+        Returns the size and counters of the catalog
+        """
+        with self._lock:
+            return {
+                "size": len(self._platforms),
+                "version": self._version,
+                "loads": self.loads,
+                "checks": self.checks,
+            }
+
+
+platform_catalog = PlatformCatalog(PLATFORM_CATALOG_CHECK_SECONDS)
@@ -1,27 +1,350 @@
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session, sessionmaker
+from threading import Lock
+from app.config import settings
+from app.instrumentation import time_queries
 from .models import Base
-from dotenv import load_dotenv
-import os
+from .pool import PoolMetrics, pool_options
+from .query_budget import count_queries
+from .replicas import Replica, ReplicaRouter
+import inspect
 
-# Load the environment variables
-load_dotenv()
+# Get the database url from the settings
+DATABASE_URL = settings.database_url
 
-# Get the database url from .env
-DATABASE_URL = os.getenv("DATABASE_URL", "")
+# Serve the routers from the async session instead of the sync one
+USE_ASYNC_DB = settings.use_async_db
 
-# Create a connection to the DATABASE_URL
-engine = create_engine(DATABASE_URL)
-session_local = sessionmaker(autoflush=False, autocommit=False, bind=engine)
+# Async drivers for the sync urls we support
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
 
-# Create the database if it doesn't exist
-Base.metadata.create_all(engine)
 
+def to_async_url(url: str) -> str:
+    """
+    Converts a sync database url to the matching async driver url
+    """
+    scheme, separator, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + separator + rest
 
-# Create a dependency injection function to get the database
-def get_db():
+
+# Get the async database url from the settings, or derive it from DATABASE_URL
+ASYNC_DATABASE_URL = settings.async_database_url or to_async_url(DATABASE_URL)
+
+# The engines are created on first use (or by init_database at startup), so importing the
+# app neither connects nor needs a reachable database
+pool_metrics = PoolMetrics("primary")
+async_pool_metrics = PoolMetrics("async")
+_engine = None
+_session_factory = None
+_async_engine = None
+_async_session_factory = None
+_lock = Lock()
+
+# Set while a session_route handler runs as a sync route, run_sync calls the functions in place then
+_inline_sessions: ContextVar[bool] = ContextVar("inline_sessions", default=False)
+
+# The read replicas of the GET routes, see app.database.replicas
+replica_router = ReplicaRouter(
+    [
+        Replica(f"replica{index}", url, to_async_url(url))
+        for index, url in enumerate(settings.replica_database_urls, start=1)
+    ],
+    settings.replica_selection,
+    settings.replica_read_your_writes_seconds,
+    settings.replica_retry_seconds,
+)
+replica_pool_metrics = {
+    replica.name: (PoolMetrics(replica.name), PoolMetrics(f"{replica.name}-async"))
+    for replica in replica_router.replicas
+}
+
+
+def _create_engine(url: str, metrics: PoolMetrics):
+    engine = create_engine(url, **pool_options(url))
+    metrics.instrument(engine)
+    count_queries(engine)
+    time_queries(engine)
+    return engine, sessionmaker(autoflush=False, autocommit=False, bind=engine)
+
+
+def _create_async_engine(url: str, metrics: PoolMetrics):
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    engine = create_async_engine(url, **pool_options(url, is_async=True))
+    metrics.instrument(engine)
+    count_queries(engine)
+    time_queries(engine)
+    return engine, async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+
+def get_engine():
+    """
+    Returns the engine of DATABASE_URL, creating it with the pool sized from the settings
+    """
+    global _engine, _session_factory
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                _engine, _session_factory = _create_engine(DATABASE_URL, pool_metrics)
+    return _engine
+
+
+def get_async_engine():
+    """
+    Returns the async engine of ASYNC_DATABASE_URL, creating it on first use. Greenlet and
+    the async drivers (asyncpg, aiosqlite) stay optional dependencies until then
+    """
+    global _async_engine, _async_session_factory
+    if _async_engine is None:
+        with _lock:
+            if _async_engine is None:
+                _async_engine, _async_session_factory = _create_async_engine(
+                    ASYNC_DATABASE_URL, async_pool_metrics
+                )
+    return _async_engine
+
+
+def replica_session(replica: Replica):
+    """
+    Returns a new session of a replica, creating its engine on first use
+    """
+    if replica.engine is None:
+        with _lock:
+            if replica.engine is None:
+                replica.engine, replica.session_factory = _create_engine(
+                    replica.url, replica_pool_metrics[replica.name][0]
+                )
+    return replica.session_factory()
+
+
+def async_replica_session(replica: Replica):
+    """
+    Returns a new async session of a replica, creating its async engine on first use
+    """
+    if replica.async_engine is None:
+        with _lock:
+            if replica.async_engine is None:
+                replica.async_engine, replica.async_session_factory = _create_async_engine(
+                    replica.async_url, replica_pool_metrics[replica.name][1]
+                )
+    return replica.async_session_factory()
+
+
+def session_local():
+    """
+    Returns a new session of the database
+    """
+    get_engine()
+    return _session_factory()
+
+
+def async_session_local():
+    """
+    Returns a new async session of the database
+    """
+    get_async_engine()
+    return _async_session_factory()
+
+
+def init_database():
+    """
+    Creates the engines the app serves from and, when CREATE_SCHEMA_ON_STARTUP is set, the
+    missing tables. Called once at startup
+    """
+    engine = get_engine()
+    if USE_ASYNC_DB:
+        get_async_engine()
+    if settings.create_schema_on_startup:
+        Base.metadata.create_all(engine)
+
+
+async def dispose_database():
+    """
+    Closes the pooled connections of the engines that were created
+    """
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    if _engine is not None:
+        _engine.dispose()
+    for replica in replica_router.replicas:
+        if replica.async_engine is not None:
+            await replica.async_engine.dispose()
+        if replica.engine is not None:
+            replica.engine.dispose()
+
+
+def sync_facade(db) -> Session:
+    """
+    Returns the Session an async session proxies, the routers and services work with it through
+    run_sync
+    """
+    session = db.sync_session
+    session.info["async_session"] = db
+    return session
+
+
+async def run_sync(db: Session, function, *args, **kwargs):
+    """
+    Runs a function using a session of a request without blocking the event loop: on the greenlet
+    of its async session when the session is the facade of one, so its statements go through the
+    async driver, in place when the handler is a session_route already running in the threadpool,
+    otherwise in the threadpool
+    """
+    async_session = db.info.get("async_session")
+    if async_session is not None:
+        return await async_session.run_sync(lambda session: function(*args, **kwargs))
+    if _inline_sessions.get():
+        return function(*args, **kwargs)
+    return await run_in_threadpool(function, *args, **kwargs)
+
+
+def _run_to_completion(endpoint, coroutine):
+    # Without an event loop the coroutine of a session_route must finish without suspending
+    try:
+        coroutine.send(None)
+    except StopIteration as finished:
+        return finished.value
+    coroutine.close()
+    raise RuntimeError(
+        f"{endpoint.__qualname__} awaited more than run_sync, it can't be a session_route"
+    )
+
+
+def session_route(endpoint):
+    """
+    Serves an async handler whose only awaits are run_sync calls as a sync route when USE_ASYNC_DB
+    is off, so FastAPI runs the whole request in the threadpool once as it did before the async
+    layer, instead of taking a thread hop for each run_sync. With USE_ASYNC_DB it stays async
+    """
+    if USE_ASYNC_DB:
+        return endpoint
+
+    def sync_endpoint(*args, **kwargs):
+        token = _inline_sessions.set(True)
+        try:
+            return _run_to_completion(endpoint, endpoint(*args, **kwargs))
+        finally:
+            _inline_sessions.reset(token)
+
+    # Copied by hand, the __wrapped__ of functools.wraps would make FastAPI unwrap it back to the
+    # coroutine function and await its result
+    for attribute in ("__module__", "__name__", "__qualname__", "__doc__"):
+        setattr(sync_endpoint, attribute, getattr(endpoint, attribute))
+    sync_endpoint.__dict__.update(endpoint.__dict__)
+    sync_endpoint.__signature__ = inspect.signature(endpoint)
+    return sync_endpoint
+
+
+def _get_sync_db(request: Request):
+    # The read-your-writes window opens when a write starts, for the reads racing its response,
+    # and again once it committed
+    replica_router.wrote(request)
     db = session_local()
     try:
         yield db
     finally:
         db.close()
+        replica_router.wrote(request)
+
+
+async def _get_async_db(request: Request):
+    replica_router.wrote(request)
+    try:
+        async with async_session_local() as db:
+            yield sync_facade(db)
+    finally:
+        replica_router.wrote(request)
+
+
+# Create a dependency injection function to get the database, the facade of an async session
+# when USE_ASYNC_DB is set
+get_db = _get_async_db if USE_ASYNC_DB else _get_sync_db
+
+
+@contextmanager
+def read_session(request: Request):
+    """
+    Opens a read only session for a request, of a replica when there is one that is up and the
+    user hasn't written within the read-your-writes window, otherwise of the primary
+    """
+    replica = replica_router.choose(request)
+    while replica is not None:
+        db = replica_session(replica)
+        try:
+            # Check out the connection now, so a replica that is down is skipped before the
+            # session is used
+            db.connection()
+        except DBAPIError:
+            db.close()
+            replica_router.release(replica)
+            replica_router.failed(replica)
+            replica = replica_router.choose(request)
+            continue
+        db.info["replica"] = replica.name
+        try:
+            yield db
+        except DBAPIError as error:
+            if error.connection_invalidated:
+                replica_router.failed(replica)
+            raise
+        finally:
+            db.close()
+            replica_router.release(replica)
+        return
+    with session_local() as db:
+        yield db
+
+
+@asynccontextmanager
+async def async_read_session(request: Request):
+    """
+    Opens a read only async session for a request, of a replica when there is one that is up and
+    the user hasn't written within the read-your-writes window, otherwise of the primary
+    """
+    replica = replica_router.choose(request)
+    while replica is not None:
+        db = async_replica_session(replica)
+        try:
+            await db.connection()
+        except DBAPIError:
+            await db.close()
+            replica_router.release(replica)
+            replica_router.failed(replica)
+            replica = replica_router.choose(request)
+            continue
+        db.sync_session.info["replica"] = replica.name
+        try:
+            yield db
+        except DBAPIError as error:
+            if error.connection_invalidated:
+                replica_router.failed(replica)
+            raise
+        finally:
+            await db.close()
+            replica_router.release(replica)
+        return
+    async with async_session_local() as db:
+        yield db
+
+
+def _get_sync_read_db(request: Request):
+    with read_session(request) as db:
+        yield db
+
+
+async def _get_async_read_db(request: Request):
+    async with async_read_session(request) as db:
+        yield sync_facade(db)
+
+
+# Create a dependency injection function to get a read only session, of a replica when there is one
+get_read_db = _get_async_read_db if USE_ASYNC_DB else _get_sync_read_db
@@ -0,0 +1,402 @@
+from collections import OrderedDict
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+from app.config import settings
+from .models import CredentialKey
+from .query_budget import uncounted
+from .versions import (
+    CREDENTIAL_KEYS,
+    bump_rows,
+    bump_statement,
+    read_version,
+)
+import base64
+import hashlib
+import os
+import time
+
+# Unwrapped data keys kept in memory, one per platform is enough until keys are rotated
+CREDENTIAL_KEY_CACHE_SIZE = int(os.getenv("CREDENTIAL_KEY_CACHE_SIZE", "1024"))
+# How often a worker checks whether another worker created or rewrapped a data key
+CREDENTIAL_KEY_CHECK_SECONDS = float(os.getenv("CREDENTIAL_KEY_CHECK_SECONDS", "5"))
+
+# Sealed values are "enc1:<data key id>:<nonce and ciphertext in urlsafe base64>", values
+# without the prefix were written in plaintext
+SEALED_PREFIX = "enc1:"
+NONCE_SIZE = 12
+
+KEY_COLUMNS = (
+    CredentialKey.id,
+    CredentialKey.platform_id,
+    CredentialKey.master_key_id,
+    CredentialKey.wrapped_key,
+)
+
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def _decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data.encode("ascii"))
+
+
+def master_key_id(master_key: bytes) -> str:
+    """
+    Identifies a master key without revealing it
+    """
+    return hashlib.sha256(master_key).hexdigest()[:16]
+
+
+def parse_master_key(encoded: str) -> bytes:
+    """
+    Decodes a master key from its urlsafe base64 form
+    """
+    try:
+        master_key = _decode(encoded)
+    except ValueError:
+        master_key = b""
+    if len(master_key) != 32:
+        raise ValueError("Credential master keys must be 32 bytes in urlsafe base64")
+    return master_key
+
+
+def value_aad(user_id: int, platform_id: int, key: str) -> bytes:
+    # Binds a sealed value to its row, it can't be moved to another user, platform or key
+    return f"{user_id}:{platform_id}:{key}".encode()
+
+
+def key_aad(platform_id: int) -> bytes:
+    return f"credential-key:{platform_id}".encode()
+
+
+def seal_value(
+    cipher: AESGCM, key_id: int, user_id: int, platform_id: int, key: str, value: str
+) -> str:
+    """
+    Encrypts a credential value with a data key
+    """
+    nonce = os.urandom(NONCE_SIZE)
+    sealed = cipher.encrypt(nonce, value.encode(), value_aad(user_id, platform_id, key))
+    return f"{SEALED_PREFIX}{key_id}:{_encode(nonce + sealed)}"
+
+
+def sealed_key_id(value: str) -> Optional[int]:
+    """
+    Returns the id of the data key that sealed a value, None for a plaintext value
+    """
+    if not value.startswith(SEALED_PREFIX):
+        return None
+    return int(value[len(SEALED_PREFIX) : value.index(":", len(SEALED_PREFIX))])
+
+
+def open_value(cipher: AESGCM, user_id: int, platform_id: int, key: str, value: str) -> str:
+    """
+    Decrypts a value sealed by seal_value with the same data key
+    """
+    data = _decode(value[value.index(":", len(SEALED_PREFIX)) + 1 :])
+    try:
+        plaintext = cipher.decrypt(
+            data[:NONCE_SIZE], data[NONCE_SIZE:], value_aad(user_id, platform_id, key)
+        )
+    except InvalidTag:
+        raise ValueError(
+            f"Credential {key} of user {user_id} on platform {platform_id} cannot be decrypted"
+        )
+    return plaintext.decode()
+
+
+class MasterKeys:
+    """
+    The master key wrapping new data keys, and the previous master keys still unwrapping
+    the data keys they wrapped
+    """
+
+    def __init__(self, current: str, previous: Iterable[str]):
+        self._ciphers: Dict[str, AESGCM] = {}
+        self.current_id: Optional[str] = None
+        for encoded in list(previous) + ([current] if current else []):
+            master_key = parse_master_key(encoded)
+            self._ciphers[master_key_id(master_key)] = AESGCM(master_key)
+        if current:
+            self.current_id = master_key_id(parse_master_key(current))
+
+    def wrap(self, platform_id: int, data_key: bytes) -> Tuple[str, str]:
+        """
+        Wraps a data key with the current master key, returns the master key id and the wrapped key
+        """
+        if self.current_id is None:
+            raise RuntimeError("Set CREDENTIAL_MASTER_KEY to encrypt credential values")
+        nonce = os.urandom(NONCE_SIZE)
+        wrapped = self._ciphers[self.current_id].encrypt(nonce, data_key, key_aad(platform_id))
+        return self.current_id, _encode(nonce + wrapped)
+
+    def unwrap(self, platform_id: int, master_id: str, wrapped: str) -> bytes:
+        """
+        Unwraps a data key with the master key that wrapped it
+        """
+        cipher = self._ciphers.get(master_id)
+        if cipher is None:
+            raise RuntimeError(
+                f"Master key {master_id} is not configured, add it to CREDENTIAL_PREVIOUS_MASTER_KEYS"
+            )
+        data = _decode(wrapped)
+        return cipher.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], key_aad(platform_id))
+
+
+class WrappedKey:
+    """
+    Snapshot of a credential_keys row
+    """
+
+    __slots__ = ("id", "platform_id", "master_key_id", "wrapped_key")
+
+    def __init__(self, id: int, platform_id: int, master_key_id: str, wrapped_key: str):
+        self.id = id
+        self.platform_id = platform_id
+        self.master_key_id = master_key_id
+        self.wrapped_key = wrapped_key
+
+
+class CredentialCipher:
+    """
+    Envelope encryption of the credential values. Each value is sealed with AES-GCM under the
+    data key of its platform, and data keys are stored in credential_keys wrapped by the master
+    key. Every worker holds the wrapped keys in memory and refreshes them like the platform
+    catalog, unwrapped keys are kept in an LRU cache so sealing or opening a value costs a
+    single AES-GCM operation
+    """
+
+    def __init__(self, master_keys: MasterKeys, cache_size: int, check_seconds: float):
+        self.master_keys = master_keys
+        self.cache_size = cache_size
+        self.check_seconds = check_seconds
+        self._wrapped: Dict[int, WrappedKey] = {}
+        # Newest data key of each platform, it seals the new values
+        self._active: Dict[int, int] = {}
+        self._ciphers: "OrderedDict[int, AESGCM]" = OrderedDict()
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+        self._lock = Lock()
+        self.loads = 0
+        self.created = 0
+        self.hits = 0
+        self.unwraps = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.master_keys.current_id is not None
+
+    def _due(self, force: bool) -> bool:
+        return (
+            force
+            or self._version is None
+            or time.monotonic() - self._checked_at >= self.check_seconds
+        )
+
+    def _store(self, version: int, rows) -> None:
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if rows is not None:
+                self._wrapped = {row.id: WrappedKey(*row) for row in rows}
+                self._active = {}
+                for key in self._wrapped.values():
+                    if key.id > self._active.get(key.platform_id, 0):
+                        self._active[key.platform_id] = key.id
+                # A rewrapped key unwraps to the same data key, cached ciphers stay valid
+                self._version = version
+                self.loads += 1
+
+    def ensure_fresh(self, db: Session, force: bool = False) -> bool:
+        """
+        Reloads the wrapped keys if their version changed, at most once per check interval unless
+        forced. Returns whether the version was checked
+        """
+        if not self._due(force):
+            return False
+        # The refresh is shared by every request of the worker, don't charge it to this one
+        with uncounted():
+            version = read_version(db, CREDENTIAL_KEYS)
+            rows = None
+            if version != self._version:
+                rows = db.execute(select(*KEY_COLUMNS)).all()
+        self._store(version, rows)
+        return True
+
+    def invalidate(self):
+        """
+        Makes the next use check the version, call this after committing a key write
+        """
+        with self._lock:
+            self._checked_at = float("-inf")
+
+    def _cipher(self, key_id: int) -> AESGCM:
+        with self._lock:
+            cipher = self._ciphers.get(key_id)
+            if cipher is not None:
+                self._ciphers.move_to_end(key_id)
+                self.hits += 1
+                return cipher
+            key = self._wrapped.get(key_id)
+        if key is None:
+            raise RuntimeError(f"Credential data key {key_id} doesn't exist")
+        cipher = AESGCM(
+            self.master_keys.unwrap(key.platform_id, key.master_key_id, key.wrapped_key)
+        )
+        with self._lock:
+            self.unwraps += 1
+            self._ciphers[key_id] = cipher
+            while len(self._ciphers) > self.cache_size:
+                self._ciphers.popitem(last=False)
+        return cipher
+
+    def new_key(self, platform_id: int) -> Tuple[dict, bytes]:
+        """
+        Generates a data key for a platform, returns its credential_keys row and the data key
+        """
+        data_key = AESGCM.generate_key(bit_length=256)
+        master_id, wrapped = self.master_keys.wrap(platform_id, data_key)
+        row = {
+            "platform_id": platform_id,
+            "master_key_id": master_id,
+            "wrapped_key": wrapped,
+            "created_at": time.time(),
+        }
+        return row, data_key
+
+    def _add(self, key_id: int, row: dict, data_key: bytes):
+        with self._lock:
+            self._wrapped[key_id] = WrappedKey(
+                key_id, row["platform_id"], row["master_key_id"], row["wrapped_key"]
+            )
+            if key_id > self._active.get(row["platform_id"], 0):
+                self._active[row["platform_id"]] = key_id
+            self._ciphers[key_id] = AESGCM(data_key)
+            self.created += 1
+
+    def create_key(self, db: Session, platform_id: int) -> int:
+        """
+        Creates a data key for a platform and makes it the one sealing its new values
+        """
+        row, data_key = self.new_key(platform_id)
+        # Committed on a connection of its own, a key that stored values point to must not be
+        # rolled back with the request. Call this before the request writes anything, SQLite
+        # can't take a second writer
+        with uncounted(), db.get_bind().begin() as connection:
+            key_id = connection.execute(insert(CredentialKey).values(row)).inserted_primary_key[0]
+            connection.execute(
+                bump_statement(connection.dialect.name), bump_rows([CREDENTIAL_KEYS])
+            )
+        self._add(key_id, row, data_key)
+        return key_id
+
+    def active_key(self, db: Session, platform_id: int) -> int:
+        """
+        Returns the id of the data key sealing the new values of a platform, creating it if the
+        platform has none
+        """
+        checked = self.ensure_fresh(db)
+        key_id = self._active.get(platform_id)
+        if key_id is None and not checked:
+            # Another worker may have created it since the last check
+            self.ensure_fresh(db, force=True)
+            key_id = self._active.get(platform_id)
+        if key_id is None:
+            key_id = self.create_key(db, platform_id)
+        return key_id
+
+    def seal(self, key_id: int, user_id: int, platform_id: int, key: str, value: str) -> str:
+        """
+        Seals a value with a data key that is already loaded
+        """
+        return seal_value(self._cipher(key_id), key_id, user_id, platform_id, key, value)
+
+    def encrypt(self, db: Session, user_id: int, platform_id: int, key: str, value: str) -> str:
+        """
+        Returns the value to store for a credential, sealed when CREDENTIAL_MASTER_KEY is set
+        """
+        if not self.enabled:
+            return value
+        key_id = self.active_key(db, platform_id)
+        return self.seal(key_id, user_id, platform_id, key, value)
+
+    def decrypt_value(self, user_id: int, platform_id: int, key: str, value: str) -> str:
+        """
+        Opens a stored value whose data key is loaded, plaintext values are returned as they are
+        """
+        key_id = sealed_key_id(value)
+        if key_id is None:
+            return value
+        return open_value(self._cipher(key_id), user_id, platform_id, key, value)
+
+    def is_current(self, platform_id: int, value: str) -> bool:
+        """
+        Returns whether a stored value is sealed with the newest data key of its platform
+        """
+        key_id = sealed_key_id(value)
+        return key_id is not None and key_id == self._active.get(platform_id)
+
+    def _missing(self, credentials: list) -> bool:
+        key_ids = (sealed_key_id(credential.value) for credential in credentials)
+        return any(key_id is not None and key_id not in self._wrapped for key_id in key_ids)
+
+    def _open(self, credentials: list) -> list:
+        for credential in credentials:
+            value = self.decrypt_value(
+                credential.user_id, credential.platform_id, credential.key, credential.value
+            )
+            # Replaces the loaded value without marking the credential as modified
+            set_committed_value(credential, "value", value)
+        return credentials
+
+    def decrypt(self, db: Session, credentials: list) -> list:
+        """
+        Replaces the sealed values of loaded credentials with their plaintext
+        """
+        checked = self.ensure_fresh(db)
+        if not checked and self._missing(credentials):
+            self.ensure_fresh(db, force=True)
+        return self._open(credentials)
+
+    def decrypt_rows(self, db: Session, rows: list) -> List[str]:
+        """
+        Returns the plaintext values of credentials selected as rows (with user_id, platform_id,
+        key and value columns), in the order of the rows
+        """
+        checked = self.ensure_fresh(db)
+        if not checked and self._missing(rows):
+            self.ensure_fresh(db, force=True)
+        return self._values(rows)
+
+    def _values(self, rows: list) -> List[str]:
+        return [
+            self.decrypt_value(row.user_id, row.platform_id, row.key, row.value) for row in rows
+        ]
+
+    def stats(self) -> dict:
+        """
+        Returns the size and counters of the key ring
+        """
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "keys": len(self._wrapped),
+                "cached": len(self._ciphers),
+                "version": self._version,
+                "loads": self.loads,
+                "created": self.created,
+                "hits": self.hits,
+                "unwraps": self.unwraps,
+            }
+
+
+credential_cipher = CredentialCipher(
+    MasterKeys(settings.credential_master_key, settings.credential_previous_master_keys),
+    CREDENTIAL_KEY_CACHE_SIZE,
+    CREDENTIAL_KEY_CHECK_SECONDS,
+)
@@ -0,0 +1,40 @@
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import joinedload, selectinload
+from app.database.models import UserIntegration, CredentialDetail
+
+# Eager loading strategies matching the relationships each response schema embeds, so that
+# serializing a response never lazy loads. Many-to-one relationships are joined into the same
+# SELECT, collections are fetched with one extra SELECT ... WHERE id IN (...) per page.
+# Embedded platforms aren't loaded here, services set them from the platform catalog
+# (platform_catalog.attach) instead of joining the platforms table.
+
+# UserIntegrationResponseSchema embeds user and platform
+USER_INTEGRATION_RESPONSE = (joinedload(UserIntegration.user),)
+
+# UserIntegrationWithDetailsSchema embeds platform and details
+USER_INTEGRATION_WITH_DETAILS = (selectinload(UserIntegration.details),)
+
+# CredentialDetailResponseSchema embeds user and platform
+CREDENTIAL_DETAIL_RESPONSE = (joinedload(CredentialDetail.user),)
+
+
+def load_statement(model, id: int, options):
+    """
+    Builds the SELECT that loads a row by its id together with the relationships its response
+    embeds, replacing the state of an instance the session already holds
+    """
+    return (
+        select(model)
+        .filter(model.id == id)
+        .options(*options)
+        .execution_options(populate_existing=True)
+    )
+
+
+def reload_statement(instance, options):
+    """
+    Builds the SELECT that reloads a committed instance together with the relationships its
+    response embeds. The primary key is read from the identity key, so an instance expired by
+    the commit doesn't trigger a refresh SELECT of its own first
+    """
+    return load_statement(type(instance), inspect(instance).identity[0], options)
@@ -1,10 +1,29 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Table
+from sqlalchemy import (
+    DDL,
+    Column,
+    Float,
+    Integer,
+    String,
+    Boolean,
+    ForeignKey,
+    Index,
+    Table,
+    UniqueConstraint,
+    event,
+)
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
+# The trigram indexes need the pg_trgm extension
+event.listen(
+    Base.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
 # Association table for Many-to-Many connection between table users and platforms
 user_platform = Table(
     "user_platform",
@@ -20,12 +39,25 @@ class User(Base):
     """
 
     __tablename__ = "users"
+    # Trigram index for the username search, a GiST index can also return the closest
+    # usernames first (ORDER BY username <-> query)
+    __table_args__ = (
+        Index(
+            "ix_users_username_trgm",
+            "username",
+            postgresql_using="gist",
+            postgresql_ops={"username": "gist_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+    )
 
     id = Column(Integer, primary_key=True)
-    username = Column(String, nullable=False)
+    # Read on every login and authenticated request
+    username = Column(String, nullable=False, unique=True, index=True)
     password = Column(String, nullable=False)
     # The is_admin column will check if the user is an admin or not
     is_admin = Column(Boolean, default=False)
+    # Bumped on every privilege change, access tokens carrying an older version are stale
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Many-to-Many relationship with table platforms
     platforms = relationship(
@@ -41,6 +73,21 @@ class Platform(Base):
     """
 
     __tablename__ = "platforms"
+    # Trigram indexes serving the name__ilike and description__ilike filters
+    __table_args__ = (
+        Index(
+            "ix_platforms_name_trgm",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+        Index(
+            "ix_platforms_description_trgm",
+            "description",
+            postgresql_using="gin",
+            postgresql_ops={"description": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
@@ -58,6 +105,12 @@ class UserIntegration(Base):
     """
 
     __tablename__ = "user_integrations"
+    # A user is integrated with a platform at most once
+    __table_args__ = (
+        UniqueConstraint(
+            "user_id", "platform_id", name="uq_user_integrations_user_platform"
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -78,15 +131,105 @@ class CredentialDetail(Base):
     """
 
     __tablename__ = "credential_details"
+    # A credential key is stored once per user and platform, this also serves the
+    # (user_id, platform_id) lookups
+    __table_args__ = (
+        UniqueConstraint(
+            "user_id",
+            "platform_id",
+            "key",
+            name="uq_credential_details_user_platform_key",
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     platform_id = Column(Integer, ForeignKey("platforms.id"))
-    integration_id = Column(Integer, ForeignKey("user_integrations.id"), nullable=False)
+    integration_id = Column(
+        Integer, ForeignKey("user_integrations.id"), nullable=False, index=True
+    )
     key = Column(String, nullable=False)
+    # Sealed with the data key of the platform (see app.database.encryption), values written
+    # before encryption was enabled stay in plaintext until the key rotation job seals them
     value = Column(String, nullable=False)
 
     credential = relationship("UserIntegration", back_populates="details")
+    # Many-to-One relationships used to embed the owner and platform in responses
+    user = relationship("User")
+    platform = relationship("Platform")
+
+
+class ResourceVersion(Base):
+    """
+    Version counter of a cached resource, bumped by every write to it so that each worker
+    can tell cheaply whether its in-process copy is stale.
+    """
+
+    __tablename__ = "resource_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+# Start the shared counters along with the table, as the migration does. Writers don't rely on it,
+# bump_statement upserts the row of a resource that was never written, like the per-user ones
+event.listen(
+    ResourceVersion.__table__,
+    "after_create",
+    DDL(
+        "INSERT INTO resource_versions (name, version) "
+        "VALUES ('platforms', 1), ('users', 1), ('credential_keys', 1)"
+    ),
+)
+
+
+class TokenRevocation(Base):
+    """
+    A revoked token (by its jti) or a user whose tokens issued before a cutoff are revoked.
+    Rows are kept until the tokens they revoke would have expired anyway.
+    """
+
+    __tablename__ = "token_revocations"
+
+    id = Column(Integer, primary_key=True)
+    jti = Column(String, nullable=True, unique=True)
+    username = Column(String, nullable=True)
+    # Tokens of the user issued at or before this time (seconds since the epoch) are revoked
+    issued_before = Column(Float, nullable=True)
+    expires_at = Column(Float, nullable=False, index=True)
+
+
+class CredentialKey(Base):
+    """
+    A data key encrypting the credential values of a platform, stored wrapped by the master key.
+    The newest key of a platform seals new values, older keys are kept to open the values they
+    sealed until the key rotation job seals them again.
+    """
+
+    __tablename__ = "credential_keys"
+
+    id = Column(Integer, primary_key=True)
+    platform_id = Column(Integer, ForeignKey("platforms.id"), nullable=False, index=True)
+    # Id of the master key that wrapped the data key, see app.database.encryption.master_key_id
+    master_key_id = Column(String, nullable=False)
+    wrapped_key = Column(String, nullable=False)
+    created_at = Column(Float, nullable=False)
+
+
+class PlatformStats(Base):
+    """
+    Counts of the integrations and credentials of a platform, kept up to date by the services
+    that write them so the admin statistics are read without scanning either table.
+    A platform without a row has none of them.
+    """
+
+    __tablename__ = "platform_stats"
+
+    platform_id = Column(Integer, ForeignKey("platforms.id"), primary_key=True)
+    # A user is integrated with a platform at most once, so this is also its number of users
+    integrations = Column(Integer, nullable=False, default=0)
+    active_integrations = Column(Integer, nullable=False, default=0)
+    credentials = Column(Integer, nullable=False, default=0)
 
 
 # class PlatformCredentials(Base):
@@ -0,0 +1,129 @@
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from threading import Lock
+from app.config import settings
+from app.instrumentation import record
+from app.metrics import LatencyStats
+import time
+
+
+class PoolMetrics:
+    """
+    Counters and checkout latency of one connection pool, fed by pool events
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = Lock()
+        self.checkout_wait = LatencyStats()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.soft_invalidations = 0
+        self.timeouts = 0
+        self.pool = None
+
+    def _increment(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def instrument(self, engine):
+        """
+        Listens to the pool events of an engine (or of the sync engine of an async engine)
+        """
+        engine = getattr(engine, "sync_engine", engine)
+        engine.pool._pool_metrics = self
+        self.pool = engine.pool
+        event.listen(engine, "connect", lambda *args: self._increment("connects"))
+        event.listen(engine, "checkout", lambda *args: self._increment("checkouts"))
+        event.listen(engine, "checkin", lambda *args: self._increment("checkins"))
+        event.listen(engine, "invalidate", lambda *args: self._increment("invalidations"))
+        event.listen(
+            engine, "soft_invalidate", lambda *args: self._increment("soft_invalidations")
+        )
+
+    def snapshot(self) -> dict:
+        """
+        Returns the counters together with the live state of the pool
+        """
+        with self._lock:
+            stats = {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "soft_invalidations": self.soft_invalidations,
+                "timeouts": self.timeouts,
+            }
+        stats["checkout_wait"] = self.checkout_wait.snapshot()
+        pool = self.pool
+        if isinstance(pool, QueuePool):
+            stats.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                overflow=max(pool.overflow(), 0),
+                checked_in=pool.checkedin(),
+            )
+        return stats
+
+
+class TimedCheckoutMixin:
+    """
+    Times every checkout of a queue pool and counts the ones that time out
+    """
+
+    _pool_metrics = None
+
+    def _do_get(self):
+        metrics = self._pool_metrics
+        if metrics is None:
+            return super()._do_get()
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            metrics._increment("timeouts")
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.checkout_wait.observe(elapsed)
+            record("pool_wait", elapsed)
+
+    def recreate(self):
+        # engine.dispose() replaces the pool, keep reporting to the same metrics
+        pool = super().recreate()
+        pool._pool_metrics = self._pool_metrics
+        if self._pool_metrics is not None:
+            self._pool_metrics.pool = pool
+        return pool
+
+
+class InstrumentedQueuePool(TimedCheckoutMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_options(url: str, is_async: bool = False) -> dict:
+    """
+    Returns the create_engine pool arguments for a database url from the settings
+    """
+    options = {
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_recycle": settings.db_pool_recycle,
+    }
+    database = make_url(url).database if url else None
+    if url.startswith("sqlite") and database in (None, "", ":memory:"):
+        # In-memory SQLite keeps a single connection per thread, it has no queue to size
+        return options
+    options.update(
+        poolclass=InstrumentedAsyncAdaptedQueuePool if is_async else InstrumentedQueuePool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+    )
+    return options
@@ -0,0 +1,104 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from app.instrumentation import InstrumentedRoute
+from typing import List, Optional
+import os
+
+# Fail requests that run more SQL statements than their endpoint declares, meant for tests
+QUERY_BUDGET_ENFORCE = os.getenv("QUERY_BUDGET_ENFORCE", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Raised when a request runs more SQL statements than its endpoint's budget
+    """
+
+
+class QueryCounter:
+    """
+    Collects the SQL statements run while it is the current counter
+    """
+
+    def __init__(self):
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+_current_counter: ContextVar[Optional[QueryCounter]] = ContextVar(
+    "query_counter", default=None
+)
+
+
+def count_queries(engine):
+    """
+    Feeds every statement run on the engine (or on the sync engine of an async engine) to the current counter
+    """
+    engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        counter = _current_counter.get()
+        if counter is not None:
+            counter.statements.append(statement)
+
+
+@contextmanager
+def uncounted():
+    """
+    Leaves the statements run inside it out of the current budget, for work shared by many
+    requests such as refreshing an in-process cache
+    """
+    token = _current_counter.set(None)
+    try:
+        yield
+    finally:
+        _current_counter.reset(token)
+
+
+def query_budget(max_queries: int):
+    """
+    Declares how many SQL statements an endpoint may run, including authentication and the
+    lazy loads of response serialization. Checked by QueryBudgetRoute when QUERY_BUDGET_ENFORCE is set
+    """
+
+    def decorator(endpoint):
+        endpoint.query_budget = max_queries
+        return endpoint
+
+    return decorator
+
+
+class QueryBudgetRoute(InstrumentedRoute):
+    """
+    Route class counting the statements of each request and failing the ones over budget
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        budget = getattr(self.endpoint, "query_budget", None)
+        if budget is None or not QUERY_BUDGET_ENFORCE:
+            return handler
+
+        async def budgeted_handler(request):
+            counter = QueryCounter()
+            token = _current_counter.set(counter)
+            try:
+                response = await handler(request)
+            finally:
+                _current_counter.reset(token)
+            if counter.count > budget:
+                raise QueryBudgetExceeded(
+                    f"{request.method} {self.path} ran {counter.count} SQL statements, "
+                    f"its budget is {budget}:\n" + "\n".join(counter.statements)
+                )
+            return response
+
+        return budgeted_handler
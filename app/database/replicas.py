@@ -0,0 +1,167 @@
+from fastapi import Request
+from jose import JWTError, jwt
+from threading import Lock
+from typing import Callable, Dict, List, Optional
+import itertools
+import time
+
+# Requests that don't write, their sessions can be served by a replica
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+ROUND_ROBIN = "round_robin"
+LEAST_OUTSTANDING = "least_outstanding"
+
+
+def request_subject(request: Request) -> Optional[str]:
+    """
+    Returns the username of the bearer token of a request, without verifying the token. It only
+    picks the database a request reads from, authentication verifies the token
+    """
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        subject = jwt.get_unverified_claims(token).get("sub")
+    except JWTError:
+        return None
+    return str(subject) if subject is not None else None
+
+
+class Replica:
+    """
+    A read replica: its engines, created on first use, the sessions of this worker it is serving
+    and until when it is considered down
+    """
+
+    def __init__(self, name: str, url: str, async_url: str):
+        self.name = name
+        self.url = url
+        self.async_url = async_url
+        self.engine = None
+        self.session_factory: Optional[Callable] = None
+        self.async_engine = None
+        self.async_session_factory: Optional[Callable] = None
+        self.outstanding = 0
+        self.down_until = 0.0
+        self.sessions = 0
+        self.failures = 0
+
+
+class ReplicaRouter:
+    """
+    Picks the replica each read session is served from, round robin or the one with the fewest
+    outstanding sessions. A replica whose connection fails is skipped for `retry_seconds`, reads
+    go to the primary while every replica is down. The reads of a user within
+    `read_your_writes_seconds` of one of their writes go to the primary too, so they see the
+    write before the replicas have it. Writes are only known to the worker that served them
+    """
+
+    def __init__(
+        self,
+        replicas: List[Replica],
+        selection: str,
+        read_your_writes_seconds: float,
+        retry_seconds: float,
+    ):
+        if selection not in (ROUND_ROBIN, LEAST_OUTSTANDING):
+            raise ValueError(f"Replica selection must be {ROUND_ROBIN} or {LEAST_OUTSTANDING}")
+        self.replicas = replicas
+        self.selection = selection
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self.retry_seconds = retry_seconds
+        # Username -> end of its read-your-writes window, expired ones are swept once a window
+        self._written: Dict[str, float] = {}
+        self._swept_at = time.monotonic()
+        self._turn = itertools.count()
+        self._lock = Lock()
+        self.primary_reads = 0
+        self.pinned_reads = 0
+        self.failovers = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def wrote(self, request: Request):
+        """
+        Opens the read-your-writes window of the user of a request that writes
+        """
+        if not self.enabled or request.method in SAFE_METHODS:
+            return
+        username = request_subject(request)
+        if username is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._written[username] = now + self.read_your_writes_seconds
+            if now - self._swept_at >= self.read_your_writes_seconds:
+                self._written = {
+                    user: until for user, until in self._written.items() if until > now
+                }
+                self._swept_at = now
+
+    def choose(self, request: Request) -> Optional[Replica]:
+        """
+        Returns the replica a read session of the request is served from and counts it as
+        outstanding, or None when it must be served from the primary
+        """
+        if not self.enabled:
+            return None
+        username = request_subject(request)
+        now = time.monotonic()
+        with self._lock:
+            if username is not None and self._written.get(username, 0.0) > now:
+                self.pinned_reads += 1
+                return None
+            healthy = [replica for replica in self.replicas if replica.down_until <= now]
+            if not healthy:
+                self.primary_reads += 1
+                return None
+            # Rotate the candidates so least outstanding ties are shared round robin too
+            start = next(self._turn) % len(healthy)
+            healthy = healthy[start:] + healthy[:start]
+            replica = healthy[0]
+            if self.selection == LEAST_OUTSTANDING:
+                replica = min(healthy, key=lambda candidate: candidate.outstanding)
+            replica.outstanding += 1
+            replica.sessions += 1
+            return replica
+
+    def release(self, replica: Replica):
+        """
+        Counts a read session of a replica as done
+        """
+        with self._lock:
+            replica.outstanding -= 1
+
+    def failed(self, replica: Replica):
+        """
+        Takes a replica whose connection failed out of the rotation for `retry_seconds`
+        """
+        with self._lock:
+            replica.down_until = time.monotonic() + self.retry_seconds
+            replica.failures += 1
+            self.failovers += 1
+
+    def stats(self) -> dict:
+        """
+        Returns the state and counters of the replicas
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "selection": self.selection,
+                "primary_reads": self.primary_reads,
+                "pinned_reads": self.pinned_reads,
+                "failovers": self.failovers,
+                "read_your_writes_users": len(self._written),
+                "replicas": {
+                    replica.name: {
+                        "healthy": replica.down_until <= now,
+                        "outstanding": replica.outstanding,
+                        "sessions": replica.sessions,
+                        "failures": replica.failures,
+                    }
+                    for replica in self.replicas
+                },
+            }
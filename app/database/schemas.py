@@ -1,5 +1,10 @@
-from pydantic import BaseModel
+from enum import Enum
+from pydantic import BaseModel, Field
 from typing import Optional, List
+import os
+
+# (user_id, platform_id) pairs, or users of a platform, one credential batch can look up
+CREDENTIAL_BATCH_MAX_PAIRS = int(os.getenv("CREDENTIAL_BATCH_MAX_PAIRS", "5000"))
 
 
 class UserSchema(BaseModel):
@@ -14,6 +19,19 @@ class UserResponseSchema(BaseModel):
     is_admin: bool
 
 
+class UserAdminSchema(BaseModel):
+    is_admin: bool
+
+
+class RefreshTokenSchema(BaseModel):
+    refresh_token: str
+
+
+class LogoutSchema(BaseModel):
+    # Also revoke the refresh token issued with the access token
+    refresh_token: Optional[str] = None
+
+
 class PlatformSchema(BaseModel):
     name: str
     description: Optional[str] = None
@@ -67,6 +85,20 @@ class UserIntegrationResponseSchema(BaseModel):
     platform: PlatformResponseSchema
 
 
+class UserPlatformSchema(BaseModel):
+    user_id: int
+    platform_id: int
+
+
+class CredentialBatchSchema(BaseModel):
+    # Either (user_id, platform_id) pairs, or one platform and a list of its users
+    pairs: List[UserPlatformSchema] = Field(
+        default_factory=list, max_length=CREDENTIAL_BATCH_MAX_PAIRS
+    )
+    platform_id: Optional[int] = None
+    user_ids: List[int] = Field(default_factory=list, max_length=CREDENTIAL_BATCH_MAX_PAIRS)
+
+
 class CredentialDetailResponseSchema(BaseModel):
     id: int
     user_id: int
@@ -86,3 +118,68 @@ class UserIntegrationWithDetailsSchema(BaseModel):
     id: int
     platform: PlatformResponseSchema
     details: List[CredentialDetailSchema]
+
+
+class ImportKind(str, Enum):
+    users = "users"
+    integrations = "integrations"
+    credentials = "credentials"
+
+
+class ImportIntegrationSchema(BaseModel):
+    # The user and platform are referenced by id or by name
+    user_id: Optional[int] = None
+    username: Optional[str] = None
+    platform_id: Optional[int] = None
+    platform_name: Optional[str] = None
+    is_active: bool = True
+
+
+class ImportCredentialSchema(BaseModel):
+    user_id: Optional[int] = None
+    username: Optional[str] = None
+    platform_id: Optional[int] = None
+    platform_name: Optional[str] = None
+
+    key: str
+    value: str
+
+
+class ImportRowErrorSchema(BaseModel):
+    line: int
+    detail: str
+
+
+class ImportResultSchema(BaseModel):
+    kind: ImportKind
+    received: int
+    imported: int
+    failed: int
+    errors: List[ImportRowErrorSchema]
+    errors_truncated: bool
+
+
+class KeyRotationResultSchema(BaseModel):
+    keys_rewrapped: int
+    keys_created: int
+    scanned: int
+    resealed: int
+
+
+class PlatformStatsSchema(BaseModel):
+    platform_id: int
+    name: str
+    # Integrations are also the users integrated, a user is integrated with a platform once
+    integrations: int
+    active_integrations: int
+    inactive_integrations: int
+    credentials: int
+
+
+class StatsResponseSchema(BaseModel):
+    # Totals over all platforms
+    integrations: int
+    active_integrations: int
+    inactive_integrations: int
+    credentials: int
+    platforms: List[PlatformStatsSchema]
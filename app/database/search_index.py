@@ -0,0 +1,176 @@
+from collections import defaultdict
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from threading import Lock
+from typing import Dict, Hashable, Iterable, List, Set, Tuple
+from .models import User
+from .query_budget import uncounted
+import heapq
+import os
+import time
+
+# How often a worker adds the users registered since its last refresh to its search index
+USER_SEARCH_REFRESH_SECONDS = float(os.getenv("USER_SEARCH_REFRESH_SECONDS", "2"))
+
+
+def text_trigrams(text: str) -> Set[str]:
+    """
+    Trigrams of a text, padded like pg_trgm does so that prefixes have trigrams of their own
+    """
+    padded = "  " + text.lower() + " "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def short_grams(text: str) -> Set[str]:
+    """
+    Substrings of one and two characters of a text, what the queries shorter than a trigram match
+    """
+    text = text.lower()
+    return {text[i : i + size] for size in (1, 2) for i in range(len(text) - size + 1)}
+
+
+def query_trigrams(query: str) -> Set[str]:
+    """
+    Trigrams every text containing a query of three characters or more has
+    """
+    query = query.lower()
+    return {query[i : i + 3] for i in range(len(query) - 2)}
+
+
+class NgramIndex:
+    """
+    In-process trigram index for ranked substring search, the fallback for databases
+    without pg_trgm. Matches are ranked prefix first, then shortest (the closest to the
+    query), then alphabetically. Queries of one or two characters, the first keystrokes of a
+    typeahead, are served by their own postings split by prefix and by text length, so only
+    the shortest matches are ranked instead of every text containing a letter
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Set[Hashable]] = defaultdict(set)
+        # (gram, whether the texts only contain it) -> text length -> keys
+        self._short_postings: Dict[Tuple[str, bool], Dict[int, Set[Hashable]]] = defaultdict(
+            lambda: defaultdict(set)
+        )
+        self._texts: Dict[Hashable, str] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def add(self, key: Hashable, text: str):
+        """
+        Indexes a text under a key
+        """
+        with self._lock:
+            text = text.lower()
+            self._texts[key] = text
+            for trigram in text_trigrams(text):
+                self._postings[trigram].add(key)
+            for gram in short_grams(text):
+                self._short_postings[gram, not text.startswith(gram)][len(text)].add(key)
+
+    def add_many(self, entries: Iterable[Tuple[Hashable, str]]):
+        """
+        Indexes several (key, text) entries
+        """
+        for key, text in entries:
+            self.add(key, text)
+
+    def _candidates(self, query: str) -> Set[Hashable]:
+        # Intersect the rarest posting lists first, the candidate set only shrinks
+        postings = sorted(
+            (self._postings.get(trigram, set()) for trigram in query_trigrams(query)),
+            key=len,
+        )
+        candidates = set(postings[0])
+        for keys in postings[1:]:
+            candidates &= keys
+            if not candidates:
+                break
+        return candidates
+
+    def _search_short(self, query: str, limit: int) -> List[Hashable]:
+        # The postings are in ranking order down to the text length, only the texts of the
+        # lengths that fill the limit are sorted
+        keys: List[Hashable] = []
+        for contained in (False, True):
+            by_length = self._short_postings.get((query, contained), {})
+            for length in sorted(by_length):
+                keys += heapq.nsmallest(
+                    limit - len(keys), by_length[length], key=lambda key: (self._texts[key], key)
+                )
+                if len(keys) >= limit:
+                    return keys
+        return keys
+
+    def search(self, query: str, limit: int) -> List[Hashable]:
+        """
+        Returns the keys of the best texts containing the query
+        """
+        query = query.lower()
+        with self._lock:
+            if len(query) < 3:
+                return self._search_short(query, limit)
+            matches = []
+            for key in self._candidates(query):
+                # The trigrams only narrow the candidates, check that they contain the query
+                text = self._texts[key]
+                if query in text:
+                    matches.append((not text.startswith(query), len(text), text, key))
+        return [match[3] for match in heapq.nsmallest(limit, matches)]
+
+
+class UserSearchIndex:
+    """
+    Username search index of one worker. Usernames are never changed and users are never
+    deleted, so the index is kept current by adding the users with an id above the highest
+    one indexed, at most once every USER_SEARCH_REFRESH_SECONDS
+    """
+
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self._index = NgramIndex()
+        self._max_id = 0
+        self._refreshed_at = float("-inf")
+        self._lock = Lock()
+
+    def _statement(self):
+        return select(User.id, User.username).filter(User.id > self._max_id).order_by(User.id)
+
+    def _due(self) -> bool:
+        return time.monotonic() - self._refreshed_at >= self.refresh_seconds
+
+    def _add(self, rows: list):
+        with self._lock:
+            rows = [row for row in rows if row.id > self._max_id]
+            self._index.add_many(rows)
+            if rows:
+                self._max_id = rows[-1].id
+            self._refreshed_at = time.monotonic()
+
+    def refresh(self, db: Session):
+        """
+        Indexes the users created since the last refresh, if it is due
+        """
+        if not self._due():
+            return
+        # The refresh is shared by every request of the worker, don't charge it to this one
+        with uncounted():
+            rows = db.execute(self._statement()).all()
+        self._add(rows)
+
+    def search(self, query: str, limit: int) -> List[int]:
+        """
+        Returns the ids of the best matching users
+        """
+        return self._index.search(query, limit)
+
+    def stats(self) -> dict:
+        """
+        Returns the size of the index
+        """
+        return {"size": len(self._index), "max_id": self._max_id}
+
+
+user_search_index = UserSearchIndex(USER_SEARCH_REFRESH_SECONDS)
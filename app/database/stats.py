@@ -0,0 +1,215 @@
+from sqlalchemy import case, delete, func, insert, literal, select, true, union_all
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Optional, Tuple
+from .models import CredentialDetail, Platform, PlatformStats, UserIntegration
+from .upsert import dialect_insert, dialect_name, reports_inserts
+
+# Counters of platform_stats, in the order the statements select them
+COUNTERS = ("integrations", "active_integrations", "credentials")
+STATS_COLUMNS = ["platform_id", *COUNTERS]
+
+
+def _add_counts(statement):
+    """
+    Adds the counts of the inserted rows to the counters of their platforms, starting the row of
+    a platform that has none
+    """
+    return statement.on_conflict_do_update(
+        index_elements=[PlatformStats.platform_id],
+        set_={
+            counter: getattr(PlatformStats, counter) + getattr(statement.excluded, counter)
+            for counter in COUNTERS
+        },
+    )
+
+
+def counts_statement(dialect: str):
+    """
+    Adds counts to the counters of platforms. Execute it with the rows of count_rows
+    """
+    return _add_counts(dialect_insert(dialect, PlatformStats))
+
+
+def count_rows(integrations: Iterable[dict] = (), credentials: Iterable[dict] = ()) -> list:
+    """
+    Returns the counts of inserting new integrations and credentials, one row per platform
+    sorted so that concurrent writers update the counters in the same order
+    """
+    counts: Dict[int, List[int]] = {}
+    for row in integrations:
+        platform_counts = counts.setdefault(row["platform_id"], [0, 0, 0])
+        platform_counts[0] += 1
+        platform_counts[1] += 1 if row.get("is_active", True) else 0
+    for row in credentials:
+        counts.setdefault(row["platform_id"], [0, 0, 0])[2] += 1
+    return [
+        {"platform_id": platform_id, **dict(zip(COUNTERS, platform_counts))}
+        for platform_id, platform_counts in sorted(counts.items())
+    ]
+
+
+def _integration_changes(user_id: int, platform_id: int, is_active: bool) -> dict:
+    # Read in the statement: the integration upsert doesn't tell an insert from an update
+    integration = select(UserIntegration.id).where(
+        UserIntegration.user_id == user_id, UserIntegration.platform_id == platform_id
+    )
+    # An integration that exists keeps its is_active flag
+    return {
+        "integrations": case((integration.exists(), 0), else_=1),
+        "active_integrations": case((integration.exists(), 0), else_=1 if is_active else 0),
+    }
+
+
+def _credential_changes(user_id: int, platform_id: int, keys: List[str]) -> dict:
+    existing = (
+        select(func.count())
+        .select_from(CredentialDetail)
+        .where(
+            CredentialDetail.user_id == user_id,
+            CredentialDetail.platform_id == platform_id,
+            CredentialDetail.key.in_(keys),
+        )
+        .scalar_subquery()
+    )
+    return {"credentials": literal(len(keys)) - existing}
+
+
+def changes_statement(
+    dialect: str,
+    user_id: int,
+    integration: Optional[Tuple[int, bool]] = None,
+    credentials: Iterable[Tuple[int, str]] = (),
+):
+    """
+    Adds to the counters what upserting the (platform_id, is_active) integration and the
+    (platform_id, key) credentials of a user will change, in one INSERT ... SELECT comparing them
+    with the rows that exist. Execute it in the transaction of the upserts, before them, on a
+    database whose upserts don't report their inserts. Returns None when nothing is upserted
+    """
+    changes: Dict[int, dict] = {}
+    if integration is not None:
+        platform_id, is_active = integration
+        changes[platform_id] = _integration_changes(user_id, platform_id, is_active)
+    keys: Dict[int, set] = {}
+    for platform_id, key in credentials:
+        keys.setdefault(platform_id, set()).add(key)
+    for platform_id, platform_keys in keys.items():
+        changes.setdefault(platform_id, {}).update(
+            _credential_changes(user_id, platform_id, sorted(platform_keys))
+        )
+    if not changes:
+        return None
+
+    # The WHERE keeps SQLite from parsing ON CONFLICT as a join constraint of the SELECT
+    selects = [
+        select(
+            literal(platform_id),
+            *(platform_changes.get(counter, literal(0)) for counter in COUNTERS),
+        ).where(true())
+        for platform_id, platform_changes in sorted(changes.items())
+    ]
+    rows = selects[0] if len(selects) == 1 else union_all(*selects)
+    return _add_counts(dialect_insert(dialect, PlatformStats).from_select(STATS_COLUMNS, rows))
+
+
+def counters_statement():
+    """
+    Selects the counters of every platform that has any
+    """
+    return select(PlatformStats.platform_id, *(getattr(PlatformStats, c) for c in COUNTERS))
+
+
+def live_counts_statement():
+    """
+    Counts the integrations and credentials of every platform from the tables, with one
+    GROUP BY over each
+    """
+    integrations = (
+        select(
+            UserIntegration.platform_id,
+            func.count().label("integrations"),
+            func.sum(case((UserIntegration.is_active == true(), 1), else_=0)).label(
+                "active_integrations"
+            ),
+        )
+        .group_by(UserIntegration.platform_id)
+        .subquery()
+    )
+    credentials = (
+        select(CredentialDetail.platform_id, func.count().label("credentials"))
+        .group_by(CredentialDetail.platform_id)
+        .subquery()
+    )
+    return select(
+        Platform.id,
+        func.coalesce(integrations.c.integrations, 0),
+        func.coalesce(integrations.c.active_integrations, 0),
+        func.coalesce(credentials.c.credentials, 0),
+    ).outerjoin(
+        integrations, integrations.c.platform_id == Platform.id
+    ).outerjoin(
+        credentials, credentials.c.platform_id == Platform.id
+    )
+
+
+def rebuild_statements() -> list:
+    """
+    Replaces the counters with counts from the tables, for counters that drifted
+    """
+    return [
+        delete(PlatformStats),
+        insert(PlatformStats).from_select(STATS_COLUMNS, live_counts_statement()),
+    ]
+
+
+def count_changes(
+    db: Session,
+    user_id: int,
+    integration: Optional[Tuple[int, bool]] = None,
+    credentials: Iterable[Tuple[int, str]] = (),
+):
+    """
+    Counts the changes of upserts of a user in their transaction, call it before them. Only on
+    SQLite, whose upserts can't report their inserts: its writers hold the database lock from
+    their first write to their commit, so comparing with the rows that exist is exact there.
+    Concurrent PostgreSQL writers could both count the same new row, count_inserts counts what
+    their upserts returned instead
+    """
+    dialect = dialect_name(db)
+    if reports_inserts(dialect):
+        return
+    statement = changes_statement(dialect, user_id, integration, credentials)
+    if statement is not None:
+        db.execute(statement)
+
+
+def count_inserts(
+    db: Session,
+    integration: Optional[Tuple[int, bool, Optional[bool]]] = None,
+    credentials: Iterable[Tuple[int, Optional[bool]]] = (),
+):
+    """
+    Counts the rows upserts inserted from what they returned, the (platform_id, is_active, inserted)
+    integration and the (platform_id, inserted) credentials. Call it after them, right before the
+    commit so the counter rows stay locked briefly. Does nothing where count_changes counted them
+    """
+    if not reports_inserts(dialect_name(db)):
+        return
+    integrations = []
+    if integration is not None and integration[2]:
+        integrations.append({"platform_id": integration[0], "is_active": integration[1]})
+    add_counts(
+        db,
+        count_rows(
+            integrations,
+            [{"platform_id": platform_id} for platform_id, inserted in credentials if inserted],
+        ),
+    )
+
+
+def add_counts(db: Session, rows: list):
+    """
+    Adds the rows of count_rows to the counters in the transaction of the inserts they count
+    """
+    if rows:
+        db.execute(counts_statement(dialect_name(db)), rows)
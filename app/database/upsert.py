@@ -0,0 +1,106 @@
+from sqlalchemy import Boolean, literal, literal_column, null, select
+from sqlalchemy.dialects import postgresql, sqlite
+from typing import Iterable, List
+from .models import CredentialDetail, UserIntegration
+
+# INSERT ... ON CONFLICT statements for the write paths that used to look a row up before
+# inserting it. Both are backed by the unique constraints of their tables.
+
+
+def dialect_insert(dialect_name: str, model):
+    """
+    Returns the INSERT construct of a dialect supporting ON CONFLICT
+    """
+    if dialect_name == "postgresql":
+        return postgresql.insert(model)
+    if dialect_name == "sqlite":
+        return sqlite.insert(model)
+    raise NotImplementedError(f"Upserts are not supported on {dialect_name}")
+
+
+def dialect_name(db) -> str:
+    """
+    Returns the dialect of the database of a session, sync or async
+    """
+    return db.get_bind().dialect.name
+
+
+def reports_inserts(dialect: str) -> bool:
+    """
+    Returns whether the upserts of a dialect tell the rows they inserted from the ones they updated
+    """
+    return dialect == "postgresql"
+
+
+def inserted_column(dialect: str):
+    """
+    Returns the RETURNING column of an upsert telling the rows it inserted (true) from the ones
+    it updated (false). NULL where the database can't tell them apart (SQLite)
+    """
+    if reports_inserts(dialect):
+        # A row inserted by the statement has no transaction in its xmax yet, an updated one
+        # has the updating transaction
+        return literal_column("(xmax = 0)", Boolean).label("inserted")
+    return null().label("inserted")
+
+
+def integration_upsert(dialect: str, user_id: int, platform_id: int, is_active: bool):
+    """
+    Inserts the integration of a user with a platform, an integration that exists
+    (uq_user_integrations_user_platform) keeps its is_active flag. Returns its id and
+    inserted_column either way
+    """
+    statement = dialect_insert(dialect, UserIntegration).values(
+        user_id=user_id, platform_id=platform_id, is_active=is_active
+    )
+    # Setting the column to itself leaves the row as it is, unlike DO NOTHING it returns the id
+    return statement.on_conflict_do_update(
+        index_elements=[UserIntegration.user_id, UserIntegration.platform_id],
+        set_={"is_active": UserIntegration.is_active},
+    ).returning(UserIntegration.id, inserted_column(dialect))
+
+
+def credentials_upsert(dialect: str):
+    """
+    Inserts credentials, a credential whose key the user already has on the platform
+    (uq_credential_details_user_platform_key) gets the new value instead and stays with its
+    integration. Execute it with the list of rows: the statement is compiled once and cached,
+    and the rows are sent in one executemany (insertmanyvalues batches them into multi-row
+    INSERTs where the driver needs it). Returns the platform_id and inserted_column of each row
+    """
+    statement = dialect_insert(dialect, CredentialDetail)
+    return statement.on_conflict_do_update(
+        index_elements=[CredentialDetail.user_id, CredentialDetail.platform_id, CredentialDetail.key],
+        set_={"value": statement.excluded.value},
+    ).returning(CredentialDetail.platform_id, inserted_column(dialect))
+
+
+def unique_credentials(rows: Iterable[dict]) -> List[dict]:
+    """
+    Keeps one row per credential key, the last one. A batch can't update the same row twice
+    """
+    return list({(row["user_id"], row["platform_id"], row["key"]): row for row in rows}.values())
+
+
+def integrated_credential_upsert(
+    dialect: str, user_id: int, platform_id: int, key: str, value: str
+):
+    """
+    Inserts or updates a credential of a user on a platform, taking the integration id from
+    user_integrations in the same statement. Returns the id of the credential and inserted_column,
+    no row when the user isn't integrated with the platform
+    """
+    integration = select(
+        literal(user_id),
+        literal(platform_id),
+        UserIntegration.id,
+        literal(key),
+        literal(value),
+    ).where(UserIntegration.user_id == user_id, UserIntegration.platform_id == platform_id)
+    statement = dialect_insert(dialect, CredentialDetail).from_select(
+        ["user_id", "platform_id", "integration_id", "key", "value"], integration
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[CredentialDetail.user_id, CredentialDetail.platform_id, CredentialDetail.key],
+        set_={"value": statement.excluded.value},
+    ).returning(CredentialDetail.id, inserted_column(dialect))
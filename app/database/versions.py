@@ -0,0 +1,88 @@
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable
+from .models import ResourceVersion
+from .upsert import dialect_insert, dialect_name
+
+# Names of the versioned resources
+PLATFORMS = "platforms"
+# Bumped when the token version of any user changes
+USERS = "users"
+# Bumped when a credential data key is created or rewrapped
+CREDENTIAL_KEYS = "credential_keys"
+
+
+def user_data(user_id: int) -> str:
+    """
+    Returns the name of the version of the data of one user, bumped when their integrations or
+    credentials change
+    """
+    return f"user:{user_id}"
+
+
+def version_statement(name: str):
+    """
+    Selects the current version of a resource
+    """
+    return select(ResourceVersion.version).filter(ResourceVersion.name == name)
+
+
+def versions_statement(names: Iterable[str]):
+    """
+    Selects the current versions of several resources
+    """
+    return select(ResourceVersion.name, ResourceVersion.version).filter(
+        ResourceVersion.name.in_(names)
+    )
+
+
+def bump_statement(dialect: str):
+    """
+    Increments the version of a resource, starting it at 1 if it was never written. Execute it
+    with a row per resource, a single statement needs no lookup and can't race another writer
+    """
+    statement = dialect_insert(dialect, ResourceVersion)
+    return statement.on_conflict_do_update(
+        index_elements=[ResourceVersion.name],
+        set_={"version": ResourceVersion.version + 1},
+    )
+
+
+def bump_rows(names: Iterable[str]) -> list:
+    """
+    Returns the rows bump_statement is executed with, sorted so that concurrent writers bump
+    the versions in the same order
+    """
+    return [{"name": name, "version": 1} for name in sorted(set(names))]
+
+
+def read_version(db: Session, name: str) -> int:
+    """
+    Returns the current version of a resource, 0 if it was never written
+    """
+    return db.execute(version_statement(name)).scalar() or 0
+
+
+def read_versions(db: Session, names: Iterable[str]) -> Dict[str, int]:
+    """
+    Returns the current versions of several resources in one query, 0 for those never written
+    """
+    names = list(names)
+    versions = dict(db.execute(versions_statement(names)).all())
+    return {name: versions.get(name, 0) for name in names}
+
+
+def bump_version(db: Session, name: str):
+    """
+    Bumps the version of a resource in the transaction of the write that changes it
+    """
+    bump_versions(db, [name])
+
+
+def bump_versions(db: Session, names: Iterable[str]):
+    """
+    Bumps the versions of several resources in the transaction of the write that changes them
+    """
+    rows = bump_rows(names)
+    if rows:
+        db.execute(bump_statement(dialect_name(db)), rows)
@@ -0,0 +1,58 @@
+from fastapi import Request, Response
+from typing import Optional
+import hashlib
+
+# Header carrying the ETags of the representations the client already has
+IF_NONE_MATCH_HEADER = "If-None-Match"
+
+
+def strong_etag(*parts) -> str:
+    """
+    Returns a strong ETag for the parts a representation is built from
+    """
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """
+    Returns whether an If-None-Match header lists an ETag, compared weakly as RFC 9110 asks
+    """
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class ConditionalGet:
+    """
+    Strong ETag of a GET response and the If-None-Match check of its request. The ETag is
+    computed from the versions of what the response is built from, before it is built, so a
+    request that already has the current representation gets a 304 without the queries and the
+    serialization of the response
+    """
+
+    def __init__(self, request: Request):
+        self.request = request
+        self.etag: Optional[str] = None
+
+    def not_modified(self, *parts) -> Optional[Response]:
+        """
+        Computes the ETag from the parts (with the path and the query of the request), returns the
+        304 response if the client has this representation and None if the response must be built
+        """
+        url = self.request.url
+        self.etag = strong_etag(url.path, sorted(self.request.query_params.multi_items()), *parts)
+        if etag_matches(self.request.headers.get(IF_NONE_MATCH_HEADER), self.etag):
+            return Response(status_code=304, headers={"ETag": self.etag})
+        return None
+
+    def set_header(self, response: Response):
+        """
+        Sends the ETag of the response, if one was computed
+        """
+        if self.etag:
+            response.headers["ETag"] = self.etag
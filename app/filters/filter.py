@@ -1,6 +1,6 @@
 from fastapi_filter.contrib.sqlalchemy import Filter
 from typing import Optional, List
-from app.database.models import Platform, CredentialDetail, CredentialDetail, User
+from app.database.models import Platform, CredentialDetail, UserIntegration, User
 
 
 class UserFilter(Filter):
@@ -8,9 +8,9 @@ class UserFilter(Filter):
     Defines filtering options for querying users.
     """
 
-    username__ilike: Optional[str]
-    is_admin: Optional[bool]
-    order_by: Optional[List[str]]
+    username__ilike: Optional[str] = None
+    is_admin: Optional[bool] = None
+    order_by: Optional[List[str]] = None
 
     class Constants(Filter.Constants):
         model = User
@@ -21,9 +21,9 @@ class PlatformFilter(Filter):
     Defines filtering options for querying platforms
     """
 
-    name__ilike: Optional[str]
-    description__ilike: Optional[str]
-    order_by: Optional[List[str]]
+    name__ilike: Optional[str] = None
+    description__ilike: Optional[str] = None
+    order_by: Optional[List[str]] = None
 
     class Constants(Filter.Constants):
         model = Platform
@@ -34,11 +34,11 @@ class UserIntegrationFilter(Filter):
     Provides filters for user integrations.
     """
 
-    is_active: Optional[bool]
-    order_by: Optional[List[str]]
+    is_active: Optional[bool] = None
+    order_by: Optional[List[str]] = None
 
     class Constants(Filter.Constants):
-        model = CredentialDetail
+        model = UserIntegration
 
 
 class CredentialDetailFilter(Filter):
@@ -46,9 +46,10 @@ class CredentialDetailFilter(Filter):
     Defines filters for credential details.
     """
 
-    user_id: Optional[int]
-    platform_id: Optional[int]
-    key: Optional[str]
+    user_id: Optional[int] = None
+    platform_id: Optional[int] = None
+    key: Optional[str] = None
+    order_by: Optional[List[str]] = None
 
     class Constants(Filter.Constants):
         model = CredentialDetail
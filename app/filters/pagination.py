@@ -0,0 +1,143 @@
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import and_, false, literal, or_, tuple_
+from sqlalchemy.orm import ColumnProperty
+from typing import List, Optional
+import base64
+import binascii
+import json
+import os
+
+# Page size used when the client doesn't ask for one, and the largest it may ask for
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+
+# Response header carrying the cursor of the next page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class CursorPage:
+    """
+    Keyset (cursor) pagination over the ordering of a filter. The cursor holds the sort key values
+    of the last row of a page, so the next page is a range scan no matter how deep it is
+    """
+
+    def __init__(
+        self,
+        limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+        cursor: Optional[str] = Query(None),
+    ):
+        self.limit = limit
+        self.cursor = cursor
+        self.next_cursor: Optional[str] = None
+        self._keys: list = []
+
+    def paginate(self, query, model, order_by: Optional[List[str]] = None):
+        """
+        Orders the query by the filter ordering plus the primary key, skips past the cursor and limits it
+        """
+        self._keys = self._sort_keys(model, order_by)
+        # A column select also reads the sort keys it lacks, after its own columns, for the cursor
+        selected = {column.key for column in query.selected_columns}
+        missing = [column for name, column, _ in self._keys if name not in selected]
+        if missing:
+            query = query.add_columns(*missing)
+        if self.cursor:
+            query = query.filter(self._after(self._decode()))
+        columns = []
+        for _, column, descending in self._keys:
+            ordered = column.desc() if descending else column.asc()
+            columns.append(ordered.nulls_last() if self._nullable(column) else ordered)
+        # Fetch one extra row to know whether there is a next page
+        return query.order_by(*columns).limit(self.limit + 1)
+
+    def collect(self, rows) -> list:
+        """
+        Trims the extra row fetched by paginate and remembers the cursor of the next page
+        """
+        rows = list(rows)
+        if len(rows) > self.limit:
+            rows = rows[: self.limit]
+            self.next_cursor = self._encode(
+                [getattr(rows[-1], name) for name, _, _ in self._keys]
+            )
+        return rows
+
+    def set_header(self, response: Response):
+        """
+        Sends the cursor of the next page to the client, if there is one
+        """
+        if self.next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = self.next_cursor
+
+    def _sort_keys(self, model, order_by: Optional[List[str]]) -> list:
+        keys = []
+        for field in order_by or []:
+            name = field.lstrip("+-")
+            column = getattr(model, name, None)
+            if not isinstance(getattr(column, "property", None), ColumnProperty):
+                raise HTTPException(status_code=400, detail=f"Cannot order by {name}")
+            keys.append((name, column, field.startswith("-")))
+        # The primary key makes the ordering total, so rows are never skipped or repeated
+        if "id" not in [name for name, _, _ in keys]:
+            keys.append(("id", model.id, False))
+        return keys
+
+    @staticmethod
+    def _nullable(column) -> bool:
+        return any(c.nullable for c in column.property.columns)
+
+    def _ordering(self) -> List[str]:
+        return [("-" if descending else "") + name for name, _, descending in self._keys]
+
+    def _encode(self, values: list) -> str:
+        payload = json.dumps({"o": self._ordering(), "v": values}, separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    def _decode(self) -> list:
+        try:
+            padded = self.cursor + "=" * (-len(self.cursor) % 4)  # type: ignore
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            ordering, values = payload["o"], payload["v"]
+        except (ValueError, KeyError, TypeError, binascii.Error):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if ordering != self._ordering() or len(values) != len(self._keys):
+            raise HTTPException(
+                status_code=400, detail="Cursor does not match the requested ordering"
+            )
+        return values
+
+    def _after(self, values: list):
+        """
+        Builds the condition selecting the rows that sort after the cursor values
+        """
+        columns = [column for _, column, _ in self._keys]
+        # Bind the values with the column types, plain True/False can't be compared with < and >
+        values = [
+            None if value is None else literal(value, column.type)
+            for value, column in zip(values, columns)
+        ]
+        directions = {descending for _, _, descending in self._keys}
+        nullable = any(self._nullable(column) for column in columns)
+        if len(directions) == 1 and not nullable:
+            # A single row comparison, which an index on the sort columns can serve
+            if directions.pop():
+                return tuple_(*columns) < tuple_(*values)
+            return tuple_(*columns) > tuple_(*values)
+
+        # Mixed directions or NULLs (sorted last): expand into
+        # (a after va) OR (a = va AND b after vb) OR ...
+        conditions = []
+        for index, (_, column, descending) in enumerate(self._keys):
+            value = values[index]
+            equal = [
+                previous.is_(None) if values[i] is None else previous == values[i]
+                for i, previous in enumerate(columns[:index])
+            ]
+            if value is None:
+                after = false()
+            else:
+                after = column < value if descending else column > value
+                if self._nullable(column):
+                    after = or_(after, column.is_(None))
+            conditions.append(and_(*equal, after))
+        return or_(*conditions)
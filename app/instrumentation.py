@@ -0,0 +1,343 @@
+from contextvars import ContextVar
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+import functools
+import inspect
+import logging
+import os
+import time
+
+# Requests slower than this are logged together with their most expensive statements
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "1"))
+SLOW_REQUEST_TOP_STATEMENTS = int(os.getenv("SLOW_REQUEST_TOP_STATEMENTS", "5"))
+
+# Histogram buckets, in seconds for durations
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger("app.slow_requests")
+
+
+class RequestTimings:
+    """
+    Where the time of one request went, filled in by the engine, pool, auth and route hooks
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.route: Optional[str] = None
+        self.statements: List[Tuple[str, float]] = []
+        self.db = 0.0
+        self.pool_wait = 0.0
+        self.auth = 0.0
+        self.password = 0.0
+        self.serialization = 0.0
+        self.endpoint_finished: Optional[float] = None
+
+    def add(self, section: str, seconds: float):
+        setattr(self, section, getattr(self, section) + seconds)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """
+        Builds the Server-Timing header value, durations in milliseconds
+        """
+        entries = [
+            f'db;dur={self.db * 1000:.2f};desc="{len(self.statements)} statements"',
+            f"pool;dur={self.pool_wait * 1000:.2f}",
+            f"auth;dur={self.auth * 1000:.2f}",
+        ]
+        if self.password:
+            entries.append(f"password;dur={self.password * 1000:.2f}")
+        entries.append(f"serialize;dur={self.serialization * 1000:.2f}")
+        entries.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(entries)
+
+    def top_statements(self, limit: int) -> List[dict]:
+        """
+        Returns the statements that took the most time in total, grouped by their SQL
+        """
+        grouped: Dict[str, list] = {}
+        for statement, seconds in self.statements:
+            entry = grouped.setdefault(statement, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+        ranked = sorted(grouped.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        return [
+            {"sql": " ".join(sql.split())[:500], "count": count, "total_ms": round(total * 1000, 2)}
+            for sql, (count, total) in ranked
+        ]
+
+
+_current_timings: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def record(section: str, seconds: float):
+    """
+    Adds time spent in a section (db, pool_wait, auth, password) to the current request, if any
+    """
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(section, seconds)
+
+
+def timed(section: str):
+    """
+    Decorator recording the time spent in a function, sync or async, as a section of the
+    current request
+    """
+
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    record(section, time.perf_counter() - start)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(section, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def time_queries(engine):
+    """
+    Records the duration of every statement run on the engine (or on the sync engine of an
+    async engine) in the current request
+    """
+    engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        context._timing_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _finish(conn, cursor, statement, parameters, context, executemany):
+        timings = _current_timings.get()
+        started = getattr(context, "_timing_started", None)
+        if timings is not None and started is not None:
+            seconds = time.perf_counter() - started
+            timings.statements.append((statement, seconds))
+            timings.db += seconds
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus sense, with a count and sum
+    """
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class RouteMetrics:
+    """
+    Per-route histograms of the request timings, rendered in the Prometheus text format
+    """
+
+    # name: (help, buckets, value of the request timings)
+    HISTOGRAMS = {
+        "http_request_duration_seconds": ("Time to serve the request", DURATION_BUCKETS, None),
+        "http_request_db_seconds": ("Time spent running SQL", DURATION_BUCKETS, "db"),
+        "http_request_pool_wait_seconds": (
+            "Time spent waiting for a pooled connection",
+            DURATION_BUCKETS,
+            "pool_wait",
+        ),
+        "http_request_auth_seconds": ("Time spent authenticating", DURATION_BUCKETS, "auth"),
+        "http_request_serialization_seconds": (
+            "Time spent serializing the response",
+            DURATION_BUCKETS,
+            "serialization",
+        ),
+        "http_request_sql_statements": (
+            "SQL statements run by the request",
+            STATEMENT_BUCKETS,
+            "statements",
+        ),
+    }
+
+    def __init__(self):
+        self._lock = Lock()
+        self._histograms: Dict[Tuple[str, str, str], Histogram] = {}
+        self._requests: Dict[Tuple[str, str, int], int] = {}
+
+    def observe(self, method: str, route: str, status: int, timings: RequestTimings, total: float):
+        """
+        Records the timings of a finished request
+        """
+        with self._lock:
+            key = (method, route, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            for name, (_, buckets, attribute) in self.HISTOGRAMS.items():
+                if attribute is None:
+                    value = total
+                elif attribute == "statements":
+                    value = len(timings.statements)
+                else:
+                    value = getattr(timings, attribute)
+                histogram = self._histograms.get((name, method, route))
+                if histogram is None:
+                    histogram = self._histograms[(name, method, route)] = Histogram(buckets)
+                histogram.observe(value)
+
+    def render(self) -> str:
+        """
+        Returns the metrics in the Prometheus text exposition format
+        """
+        lines = [
+            "# HELP http_requests_total Requests served",
+            "# TYPE http_requests_total counter",
+        ]
+        with self._lock:
+            for (method, route, status), count in sorted(self._requests.items()):
+                lines.append(
+                    f'http_requests_total{{method="{method}",route="{_escape(route)}",'
+                    f'status="{status}"}} {count}'
+                )
+            for name, (description, _, _) in self.HISTOGRAMS.items():
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} histogram")
+                for (histogram_name, method, route), histogram in sorted(self._histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    labels = f'method="{method}",route="{_escape(route)}"'
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+route_metrics = RouteMetrics()
+
+
+class RequestTimingMiddleware:
+    """
+    ASGI middleware collecting the timings of each request. It sends them in the Server-Timing
+    header, feeds the per-route histograms and logs the slow requests with their top statements
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        status = 500
+
+        async def send_with_timings(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timings.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            _current_timings.reset(token)
+            total = timings.elapsed()
+            route = timings.route or "unmatched"
+            route_metrics.observe(scope["method"], route, status, timings, total)
+            if total >= SLOW_REQUEST_SECONDS:
+                logger.warning(
+                    "Slow request %s %s (%s): %.1f ms, %d statements in %.1f ms, top statements: %s",
+                    scope["method"],
+                    scope["path"],
+                    route,
+                    total * 1000,
+                    len(timings.statements),
+                    timings.db * 1000,
+                    timings.top_statements(SLOW_REQUEST_TOP_STATEMENTS),
+                )
+
+
+def _mark_endpoint_finished(function):
+    # Serialization is the time between the endpoint returning and the response being built
+    def finished():
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.endpoint_finished = time.perf_counter()
+
+    if inspect.iscoroutinefunction(function):
+
+        @functools.wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                finished()
+
+        return async_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        finally:
+            finished()
+
+    return wrapper
+
+
+class InstrumentedRoute(APIRoute):
+    """
+    Route class naming the route of the current request and timing the serialization of its response
+    """
+
+    def get_route_handler(self):
+        self.dependant.call = _mark_endpoint_finished(self.dependant.call)
+        handler = super().get_route_handler()
+        path = self.path_format
+
+        async def instrumented_handler(request):
+            timings = _current_timings.get()
+            if timings is not None:
+                timings.route = path
+            response = await handler(request)
+            if timings is not None and timings.endpoint_finished is not None:
+                timings.serialization = time.perf_counter() - timings.endpoint_finished
+            return response
+
+        return instrumented_handler
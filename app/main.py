@@ -1,14 +1,56 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError
+from app.api.admin.credential_batch_routes import router as credential_batch_router
+from app.api.admin.credential_key_routes import router as credential_key_router
+from app.api.admin.export_routes import router as export_router
+from app.api.admin.import_routes import router as import_router
+from app.api.admin.metrics_routes import router as metrics_router
 from app.api.admin.admin_routes import router as admin_router
 from app.api.signup.register_route import router as register_router
 from app.api.signup.login_route import router as login_router
 from app.api.user.user_routes import router as user_router
+from app.auth.password import password_hasher
+from app.auth.revocation import revocation_store
+from app.database.connection import dispose_database, init_database, session_local
+from app.instrumentation import RequestTimingMiddleware
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connect and create the missing tables here rather than when the app is imported
+    init_database()
+    # Load the revoked tokens, later revocations are picked up by the periodic refresh
+    with session_local() as db:
+        revocation_store.load(db)
+    yield
+    # Stop the password hashing workers
+    password_hasher.shutdown()
+    await dispose_database()
+
+
+app = FastAPI(lifespan=lifespan)
+# Server-Timing header, per-route histograms and slow request log
+app.add_middleware(RequestTimingMiddleware)
+
+
+@app.exception_handler(IntegrityError)
+async def integrity_error_handler(request: Request, exc: IntegrityError):
+    """
+    Writes that break a unique constraint conflict with an existing record
+    """
+    return JSONResponse(
+        status_code=409, content={"detail": "Conflicts with an existing record"}
+    )
 
 
 app.include_router(admin_router)
 app.include_router(register_router)
 app.include_router(login_router)
 app.include_router(user_router)
+app.include_router(export_router)
+app.include_router(import_router)
+app.include_router(credential_key_router)
+app.include_router(credential_batch_router)
+app.include_router(metrics_router)
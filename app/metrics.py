@@ -0,0 +1,35 @@
+from threading import Lock
+
+
+class LatencyStats:
+    """
+    Thread safe running count, total and max of a duration, in seconds
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        """
+        Records one duration
+        """
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def snapshot(self) -> dict:
+        """
+        Returns the recorded durations in milliseconds
+        """
+        with self._lock:
+            return {
+                "count": self.count,
+                "avg_ms": (self.total / self.count * 1000) if self.count else 0.0,
+                "max_ms": self.max * 1000,
+                "total_ms": self.total * 1000,
+            }
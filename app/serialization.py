@@ -0,0 +1,77 @@
+from fastapi import Response
+from functools import lru_cache
+from pydantic import BaseModel, TypeAdapter
+from typing import Iterable, List, Type, get_args, get_origin
+from typing_extensions import TypedDict
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - the TypeAdapter serializers are used instead
+    orjson = None
+
+
+@lru_cache(maxsize=None)
+def row_type(schema: Type[BaseModel]) -> type:
+    """
+    Returns a TypedDict with the fields of a response schema, nested schemas included, so
+    dicts shaped like the schema are serialized without building models
+    """
+    fields = {
+        name: _row_annotation(field.annotation) for name, field in schema.model_fields.items()
+    }
+    return TypedDict(f"{schema.__name__}Row", fields)  # type: ignore
+
+
+def _row_annotation(annotation):
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return row_type(annotation)
+    args = get_args(annotation)
+    if not args:
+        return annotation
+    # List[Schema], Optional[Schema] and the like keep their shape with the nested rows
+    return get_origin(annotation)[tuple(_row_annotation(arg) for arg in args)]  # type: ignore
+
+
+@lru_cache(maxsize=None)
+def list_serializer(schema: Type[BaseModel]) -> TypeAdapter:
+    """
+    Returns the serializer of lists of rows shaped like a response schema, built once per schema
+    """
+    return TypeAdapter(List[row_type(schema)])  # type: ignore
+
+
+def dump_rows(schema: Type[BaseModel], rows: list) -> bytes:
+    """
+    Encodes rows shaped like a response schema as a JSON array, with orjson when it is installed
+    """
+    if orjson is not None:
+        return orjson.dumps(rows)
+    return list_serializer(schema).dump_json(rows)
+
+
+def schema_columns(schema: Type[BaseModel], model) -> tuple:
+    """
+    Returns the columns of a model read by a flat response schema, in the order of its fields
+    """
+    return tuple(getattr(model, name) for name in schema.model_fields)
+
+
+def schema_rows(schema: Type[BaseModel], rows: Iterable) -> List[dict]:
+    """
+    Turns rows selected with schema_columns into dicts, columns selected after them (such as the
+    sort keys of a page) are left out
+    """
+    fields = tuple(schema.model_fields)
+    return [dict(zip(fields, row)) for row in rows]
+
+
+class RowsResponse(Response):
+    """
+    JSON response of a list of rows shaped like a response schema. It skips the validation of the
+    response_model, so the rows must have exactly the fields of the schema
+    """
+
+    media_type = "application/json"
+
+    def __init__(self, schema: Type[BaseModel], rows: list, **kwargs):
+        super().__init__(dump_rows(schema, rows), **kwargs)
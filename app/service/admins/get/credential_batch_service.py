@@ -0,0 +1,164 @@
+from fastapi import HTTPException
+from sqlalchemy import and_, select, tuple_
+from sqlalchemy.orm import Session
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+from app.database.encryption import credential_cipher
+from app.database.models import CredentialDetail, UserIntegration
+from app.database.schemas import CredentialBatchSchema
+from app.filters.filter import CredentialDetailFilter
+import json
+import os
+import zlib
+
+# Credentials fetched from the server-side cursor and decrypted at a time
+CREDENTIAL_BATCH_FETCH_SIZE = int(os.getenv("CREDENTIAL_BATCH_FETCH_SIZE", "1000"))
+
+# A row per credential of an integration, or a single row without a credential (NULL id, key
+# and value) for an integration without any
+CREDENTIAL_BATCH_COLUMNS = (
+    UserIntegration.id.label("integration_id"),
+    UserIntegration.user_id,
+    UserIntegration.platform_id,
+    UserIntegration.is_active,
+    CredentialDetail.id,
+    CredentialDetail.key,
+    CredentialDetail.value,
+)
+
+
+def credential_batch_statement(batch: CredentialBatchSchema, filters: CredentialDetailFilter):
+    """
+    Selects the integrations of all the pairs of a batch with their credentials matching the
+    filters in one query, the credentials of a pair next to each other and in the filter ordering
+    within it. An integration without matching credentials still has its row
+    """
+    if batch.pairs and (batch.platform_id is not None or batch.user_ids):
+        raise HTTPException(
+            status_code=422, detail="Send either pairs or platform_id with user_ids, not both"
+        )
+    if batch.pairs:
+        pairs = {(pair.user_id, pair.platform_id) for pair in batch.pairs}
+        condition = tuple_(UserIntegration.user_id, UserIntegration.platform_id).in_(pairs)
+    elif batch.platform_id is not None and batch.user_ids:
+        condition = (UserIntegration.platform_id == batch.platform_id) & (
+            UserIntegration.user_id.in_(set(batch.user_ids))
+        )
+    else:
+        raise HTTPException(status_code=422, detail="Send either pairs or platform_id with user_ids")
+
+    # The filters narrow the credentials joined to the integrations, not the integrations
+    criteria = filters.filter(select(CredentialDetail.id)).whereclause
+    join_condition = and_(
+        CredentialDetail.user_id == UserIntegration.user_id,
+        CredentialDetail.platform_id == UserIntegration.platform_id,
+        *([criteria] if criteria is not None else []),
+    )
+    query = (
+        select(*CREDENTIAL_BATCH_COLUMNS)
+        .outerjoin(CredentialDetail, join_condition)
+        .filter(condition)
+        .order_by(UserIntegration.user_id, UserIntegration.platform_id)
+    )
+    query = filters.sort(query)
+    return query.order_by(CredentialDetail.id)
+
+
+def with_credential(rows) -> list:
+    """
+    Returns the rows of a partition that have a credential, the ones to decrypt
+    """
+    return [row for row in rows if row.id is not None]
+
+
+def pair_lines(rows, values: List[str], group: Optional[dict]) -> Tuple[str, Optional[dict]]:
+    """
+    Adds a partition of rows and the decrypted values of their credentials to the pairs. Returns
+    the NDJSON lines of the pairs it completed and the last pair, which can go on in the next
+    partition
+    """
+    values = iter(values)
+    lines = []
+    for row in rows:
+        if group is None or (group["user_id"], group["platform_id"]) != (
+            row.user_id,
+            row.platform_id,
+        ):
+            if group is not None:
+                lines.append(json.dumps(group, separators=(",", ":")) + "\n")
+            group = {
+                "user_id": row.user_id,
+                "platform_id": row.platform_id,
+                "integration_id": row.integration_id,
+                "is_active": row.is_active,
+                "credentials": [],
+            }
+        if row.id is not None:
+            group["credentials"].append({"id": row.id, "key": row.key, "value": next(values)})
+    return "".join(lines), group
+
+
+def last_chunk(group: Optional[dict], compressor) -> bytes:
+    """
+    Encodes the last pair and ends the gzip stream
+    """
+    chunk = (json.dumps(group, separators=(",", ":")) + "\n").encode() if group else b""
+    if compressor is not None:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    return chunk
+
+
+def encode(lines: str, compressor) -> bytes:
+    """
+    Encodes NDJSON lines, compressed when there is a compressor
+    """
+    chunk = lines.encode()
+    return compressor.compress(chunk) if compressor is not None else chunk
+
+
+class CredentialBatchService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def stream(self, statement, compress: bool = False) -> Iterator[bytes]:
+        """
+        Streams the credentials of a batch as NDJSON, a line per integrated (user_id, platform_id)
+        pair with its integration and its decrypted credentials, optionally gzipped. Pairs that
+        aren't integrated are left out. Rows come from a server-side cursor
+        CREDENTIAL_BATCH_FETCH_SIZE at a time, so memory stays flat however many credentials are
+        read
+        """
+        result = self.db.execute(
+            statement.execution_options(yield_per=CREDENTIAL_BATCH_FETCH_SIZE)
+        )
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        group: Optional[dict] = None
+        for rows in result.partitions():
+            values = credential_cipher.decrypt_rows(self.db, with_credential(rows))
+            lines, group = pair_lines(rows, values, group)
+            chunk = encode(lines, compressor)
+            if chunk:
+                yield chunk
+        chunk = last_chunk(group, compressor)
+        if chunk:
+            yield chunk
+
+    async def stream_async(self, statement, compress: bool = False) -> AsyncIterator[bytes]:
+        """
+        Streams the credentials of a batch like stream, from the server-side cursor of an
+        AsyncSession
+        """
+        result = await self.db.stream(
+            statement.execution_options(yield_per=CREDENTIAL_BATCH_FETCH_SIZE)
+        )
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        group: Optional[dict] = None
+        async for rows in result.partitions():
+            # Loading the data keys of the key ring is a sync read of the session
+            values = await self.db.run_sync(credential_cipher.decrypt_rows, with_credential(rows))
+            lines, group = pair_lines(rows, values, group)
+            chunk = encode(lines, compressor)
+            if chunk:
+                yield chunk
+        chunk = last_chunk(group, compressor)
+        if chunk:
+            yield chunk
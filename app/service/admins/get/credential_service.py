@@ -1,7 +1,61 @@
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from app.database.models import CredentialDetail
-from typing import Optional
+from app.database.models import CredentialDetail, User
+from typing import Dict, List
 from app.filters.filter import CredentialDetailFilter
+from app.database.catalog import platform_catalog
+from app.database.loaders import CREDENTIAL_DETAIL_RESPONSE
+
+# Columns read for the rows of CredentialDetailResponseSchema, the user is joined in
+CREDENTIAL_ROW_COLUMNS = (
+    CredentialDetail.id,
+    CredentialDetail.user_id,
+    CredentialDetail.platform_id,
+    CredentialDetail.key,
+    User.username,
+    User.is_admin,
+)
+
+
+def credential_rows_statement(user_id: int, platform_id: int, filters: CredentialDetailFilter):
+    """
+    Selects the credentials of a user for a platform with their user, only the columns of the rows
+    """
+    query = (
+        select(*CREDENTIAL_ROW_COLUMNS)
+        .join(User, CredentialDetail.user_id == User.id)
+        .filter(
+            CredentialDetail.user_id == user_id,
+            CredentialDetail.platform_id == platform_id,
+        )
+    )
+    query = filters.filter(query)
+    return filters.sort(query)
+
+
+def credential_rows(credentials: list, platforms: Dict) -> List[dict]:
+    """
+    Assembles dicts shaped like CredentialDetailResponseSchema from the selected credentials and
+    the platforms from the catalog
+    """
+    rows = []
+    for credential in credentials:
+        platform = platforms.get(credential.platform_id)
+        rows.append(
+            {
+                "id": credential.id,
+                "user_id": credential.user_id,
+                "platform_id": credential.platform_id,
+                "key": credential.key,
+                "user": {
+                    "id": credential.user_id,
+                    "username": credential.username,
+                    "is_admin": credential.is_admin,
+                },
+                "platform": platform.to_row() if platform is not None else None,
+            }
+        )
+    return rows
 
 
 class CredentialService:
@@ -14,11 +68,29 @@ class CredentialService:
         """
         Retrieves credentials for a specific user on a given platform.
         """
-        query = self.db.query(CredentialDetail).filter(
-            CredentialDetail.user_id == user_id,
-            CredentialDetail.platform_id == platform_id,
+        query = (
+            select(CredentialDetail)
+            .filter(
+                CredentialDetail.user_id == user_id,
+                CredentialDetail.platform_id == platform_id,
+            )
+            .options(*CREDENTIAL_DETAIL_RESPONSE)
         )
         query = filters.filter(query)
         query = filters.sort(query)
         result = self.db.execute(query)
-        return result.scalars().all()
+        return platform_catalog.attach(self.db, result.scalars().all())
+
+    def get_user_credential_rows(
+        self, user_id: int, platform_id: int, filters: CredentialDetailFilter
+    ) -> List[dict]:
+        """
+        Retrieves credentials like get_user_credentials, as dicts shaped like
+        CredentialDetailResponseSchema read from its columns only.
+        """
+        result = self.db.execute(credential_rows_statement(user_id, platform_id, filters))
+        credentials = result.all()
+        platforms = platform_catalog.get_many(
+            self.db, {credential.platform_id for credential in credentials}
+        )
+        return credential_rows(credentials, platforms)
@@ -1,7 +1,8 @@
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
-from app.database.models import Platform, User
-from typing import List, Optional
+from app.database.models import User, user_platform
+from app.database.catalog import platform_catalog
 from app.filters.filter import PlatformFilter
 
 
@@ -11,9 +12,9 @@ class PlatformService:
 
     def get_platform_by_id(self, platform_id: int):
         """
-        Retrieves a platform by its id
+        Retrieves a platform by its id from the platform catalog
         """
-        return self.db.query(Platform).filter(Platform.id == platform_id).first()
+        return platform_catalog.get(self.db, platform_id)
 
     def get_user_platforms(self, user_id: int, filters: PlatformFilter):
         """
@@ -23,10 +24,8 @@ class PlatformService:
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
-        query = self.db.query(Platform).filter(Platform.users.contains(user))
-        query = filters.filter(query)
-        result = self.db.execute(query)
-        return result.scalars().all()
-        # result = self.db.execute(query)
-
-        # return result
+        # Only the ids come from the database, the platforms are filtered in the catalog
+        result = self.db.execute(
+            select(user_platform.c.platform_id).filter(user_platform.c.user_id == user_id)
+        )
+        return platform_catalog.filter(self.db, filters, result.scalars().all())
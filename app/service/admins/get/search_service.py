@@ -0,0 +1,64 @@
+from sqlalchemy import Float, select
+from sqlalchemy.orm import Session
+from typing import List
+from app.database.models import User
+from app.database.catalog import platform_catalog
+from app.database.search_index import user_search_index
+import os
+
+# Number of results a search returns when the client doesn't ask, and the most it may ask for
+SEARCH_LIMIT_DEFAULT = int(os.getenv("SEARCH_LIMIT_DEFAULT", "10"))
+SEARCH_LIMIT_MAX = int(os.getenv("SEARCH_LIMIT_MAX", "50"))
+
+
+def contains_pattern(query: str) -> str:
+    """
+    Builds the ILIKE pattern matching the query anywhere, with its wildcards escaped
+    """
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def trigram_user_search(query: str, limit: int):
+    """
+    Selects the users whose username contains the query, the closest first. Both the filter
+    and the ordering are served by the GiST trigram index of Postgres
+    """
+    distance = User.username.op("<->", return_type=Float)(query)
+    return (
+        select(User)
+        .filter(User.username.ilike(contains_pattern(query), escape="\\"))
+        .order_by(distance, User.id)
+        .limit(limit)
+    )
+
+
+def _uses_trigram_index(db) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+class SearchService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def search_users(self, query: str, limit: int) -> List[User]:
+        """
+        Ranked username search, served by pg_trgm on Postgres and by the in-process index elsewhere
+        """
+        if _uses_trigram_index(self.db):
+            result = self.db.execute(trigram_user_search(query, limit))
+            return result.scalars().all()
+
+        user_search_index.refresh(self.db)
+        ids = user_search_index.search(query, limit)
+        if not ids:
+            return []
+        result = self.db.execute(select(User).filter(User.id.in_(ids)))
+        users = {user.id: user for user in result.scalars()}
+        return [users[user_id] for user_id in ids if user_id in users]
+
+    def search_platforms(self, query: str, limit: int):
+        """
+        Ranked platform search by name, then description, served by the platform catalog
+        """
+        return platform_catalog.search(self.db, query, limit)
@@ -0,0 +1,47 @@
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable
+from app.database.catalog import CachedPlatform, platform_catalog
+from app.database.stats import COUNTERS, counters_statement, live_counts_statement
+
+
+def stats_response(platforms: Iterable[CachedPlatform], counts: Iterable) -> dict:
+    """
+    Assembles a dict shaped like StatsResponseSchema from the platforms of the catalog and the
+    (platform_id, integrations, active_integrations, credentials) rows, platforms without a row
+    have none
+    """
+    counts_by_platform: Dict[int, tuple] = {row[0]: tuple(row[1:]) for row in counts}
+    totals = dict.fromkeys(COUNTERS, 0)
+    rows = []
+    for platform in platforms:
+        platform_counts = dict(zip(COUNTERS, counts_by_platform.get(platform.id, (0, 0, 0))))
+        for counter, count in platform_counts.items():
+            totals[counter] += count
+        rows.append(
+            {
+                "platform_id": platform.id,
+                "name": platform.name,
+                **platform_counts,
+                "inactive_integrations": platform_counts["integrations"]
+                - platform_counts["active_integrations"],
+            }
+        )
+    return {
+        **totals,
+        "inactive_integrations": totals["integrations"] - totals["active_integrations"],
+        "platforms": rows,
+    }
+
+
+class StatsService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_stats(self, live: bool = False) -> dict:
+        """
+        Returns the integration and credential counts of every platform, from the counters the
+        writes keep, or counted from the tables when live
+        """
+        statement = live_counts_statement() if live else counters_statement()
+        counts = self.db.execute(statement).all()
+        return stats_response(platform_catalog.all(self.db), counts)
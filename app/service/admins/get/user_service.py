@@ -1,24 +1,39 @@
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from app.database.models import User
-from typing import List, Optional
+from app.database.schemas import UserResponseSchema
+from typing import List
 from app.filters.filter import UserFilter
+from app.filters.pagination import CursorPage
+from app.serialization import schema_columns, schema_rows
+
+USER_RESPONSE_COLUMNS = schema_columns(UserResponseSchema, User)
 
 
 class UserService:
     def __init__(self, db: Session):
         self.db = db
 
-    def get_all_users(self, filters: UserFilter):
+    def get_all_users(self, filters: UserFilter, page: CursorPage):
         """
-        Retrieves a list of users from the database with optional filtering
+        Retrieves a page of users from the database with optional filtering
         """
-        query = self.db.query(User)
+        query = select(User)
         query = filters.filter(query)
+        query = page.paginate(query, User, filters.order_by)
         result = self.db.execute(query)
-        return list(result.scalars().all())
-        # result = self.db.execute(query)
+        return page.collect(result.scalars().all())
 
-        # return list(result.scalars())
+    def get_all_user_rows(self, filters: UserFilter, page: CursorPage) -> List[dict]:
+        """
+        Retrieves a page of users like get_all_users, as dicts shaped like UserResponseSchema
+        read from its columns only
+        """
+        query = select(*USER_RESPONSE_COLUMNS)
+        query = filters.filter(query)
+        query = page.paginate(query, User, filters.order_by)
+        result = self.db.execute(query)
+        return schema_rows(UserResponseSchema, page.collect(result.all()))
 
     def get_user_by_id(self, user_id: int):
         """
@@ -0,0 +1,122 @@
+from fastapi import HTTPException
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+from typing import Optional
+from app.database.models import CredentialDetail, CredentialKey
+from app.database.encryption import credential_cipher
+from app.database.versions import CREDENTIAL_KEYS, bump_version
+import os
+
+# Credentials read, sealed again and committed together by the key rotation job
+CREDENTIAL_ROTATION_BATCH_SIZE = int(os.getenv("CREDENTIAL_ROTATION_BATCH_SIZE", "1000"))
+
+credentials_table = CredentialDetail.__table__
+
+# Only replaces a value that is still the one that was read, a credential written meanwhile
+# keeps its new value
+RESEAL_STATEMENT = (
+    update(credentials_table)
+    .where(
+        credentials_table.c.id == bindparam("credential_id"),
+        credentials_table.c.value == bindparam("old_value"),
+    )
+    .values(value=bindparam("new_value"))
+)
+
+
+class CredentialKeyPostService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def rotate_keys(self, new_data_keys: bool, platform_id: Optional[int] = None) -> dict:
+        """
+        Rewraps the data keys wrapped by a previous master key, optionally creates a new data key
+        per platform, then streams the credentials in batches and seals again every value that
+        isn't sealed with the newest key of its platform (plaintext values included). Each batch
+        is committed on its own, so an interrupted run can simply be started again
+        """
+        if not credential_cipher.enabled:
+            raise HTTPException(
+                status_code=400, detail="Set CREDENTIAL_MASTER_KEY to encrypt credential values"
+            )
+        result = {"keys_rewrapped": self._rewrap_keys(), "keys_created": 0}
+        if new_data_keys:
+            for key_platform_id in self._platform_ids(platform_id):
+                credential_cipher.create_key(self.db, key_platform_id)
+                result["keys_created"] += 1
+        credential_cipher.ensure_fresh(self.db, force=True)
+        result.update(self._reseal(platform_id))
+        return result
+
+    def _rewrap_keys(self) -> int:
+        master_keys = credential_cipher.master_keys
+        keys = (
+            self.db.query(CredentialKey)
+            .filter(CredentialKey.master_key_id != master_keys.current_id)
+            .all()
+        )
+        for key in keys:
+            data_key = master_keys.unwrap(key.platform_id, key.master_key_id, key.wrapped_key)
+            key.master_key_id, key.wrapped_key = master_keys.wrap(key.platform_id, data_key)
+        if keys:
+            bump_version(self.db, CREDENTIAL_KEYS)
+            self.db.commit()
+            credential_cipher.invalidate()
+        return len(keys)
+
+    def _platform_ids(self, platform_id: Optional[int]):
+        if platform_id is not None:
+            return [platform_id]
+        return self.db.execute(
+            select(CredentialDetail.platform_id)
+            .filter(CredentialDetail.platform_id.is_not(None))
+            .distinct()
+        ).scalars().all()
+
+    def _reseal(self, platform_id: Optional[int]) -> dict:
+        scanned = resealed = 0
+        last_id = 0
+        while True:
+            query = (
+                select(
+                    CredentialDetail.id,
+                    CredentialDetail.user_id,
+                    CredentialDetail.platform_id,
+                    CredentialDetail.key,
+                    CredentialDetail.value,
+                )
+                .filter(CredentialDetail.id > last_id)
+                .order_by(CredentialDetail.id)
+                .limit(CREDENTIAL_ROTATION_BATCH_SIZE)
+            )
+            if platform_id is not None:
+                query = query.filter(CredentialDetail.platform_id == platform_id)
+            rows = self.db.execute(query).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            scanned += len(rows)
+            # Sealed before the batch writes anything, a platform without a data key gets one
+            # committed on a connection of its own
+            updates = [
+                {
+                    "credential_id": row.id,
+                    "old_value": row.value,
+                    "new_value": credential_cipher.encrypt(
+                        self.db,
+                        row.user_id,
+                        row.platform_id,
+                        row.key,
+                        credential_cipher.decrypt_value(
+                            row.user_id, row.platform_id, row.key, row.value
+                        ),
+                    ),
+                }
+                for row in rows
+                if not credential_cipher.is_current(row.platform_id, row.value)
+            ]
+            if updates:
+                self.db.execute(RESEAL_STATEMENT, updates)
+            self.db.commit()
+            resealed += len(updates)
+        return {"scanned": scanned, "resealed": resealed}
@@ -1,7 +1,13 @@
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
-from app.database.models import CredentialDetail, UserIntegration
-from app.database.schemas import CredentialDetailSchema, AdminCredentialDetailSchema
+from app.database.models import CredentialDetail
+from app.database.stats import count_changes, count_inserts
+from app.database.schemas import AdminCredentialDetailSchema
+from app.database.catalog import platform_catalog
+from app.database.encryption import credential_cipher
+from app.database.loaders import CREDENTIAL_DETAIL_RESPONSE, load_statement
+from app.database.upsert import dialect_name, integrated_credential_upsert
+from app.database.versions import bump_version, user_data
 
 
 class CredentialPostService:
@@ -10,29 +16,52 @@ class CredentialPostService:
 
     def add_credential(self, credential_data: AdminCredentialDetailSchema):
         """
-        Adds a credential for a user's platform integration
+        Adds a credential for a user's platform integration, or replaces the value of the credential
+        with the same key
         """
-        integration = (
-            self.db.query(UserIntegration)
-            .filter(
-                UserIntegration.user_id == credential_data.user_id,
-                UserIntegration.platform_id == credential_data.platform_id,
-            )
-            .first()
-        )
-        if not integration:
+        # Checked first so that no data key is created for a platform that doesn't exist
+        if platform_catalog.get(self.db, credential_data.platform_id) is None:
             raise HTTPException(
                 status_code=400, detail="User is not integrated with this platform"
             )
+        value = credential_cipher.encrypt(
+            self.db,
+            credential_data.user_id,
+            credential_data.platform_id,
+            credential_data.key,
+            credential_data.value,
+        )
 
-        credential = CredentialDetail(
-            user_id=credential_data.user_id,
-            platform_id=credential_data.platform_id,
-            integration_id=integration.id,
-            key=credential_data.key,
-            value=credential_data.value,
+        count_changes(
+            self.db,
+            credential_data.user_id,
+            credentials=[(credential_data.platform_id, credential_data.key)],
         )
-        self.db.add(credential)
+        row = self.db.execute(
+            integrated_credential_upsert(
+                dialect_name(self.db),
+                credential_data.user_id,
+                credential_data.platform_id,
+                credential_data.key,
+                value,
+            )
+        ).first()
+        if row is None:
+            self.db.rollback()
+            raise HTTPException(
+                status_code=400, detail="User is not integrated with this platform"
+            )
+        credential_id, inserted = row
+        # Tell the ETags of the user's responses that their data changed
+        bump_version(self.db, user_data(credential_data.user_id))
+        count_inserts(self.db, credentials=[(credential_data.platform_id, inserted)])
         self.db.commit()
 
+        # Load with the user the response embeds in a single SELECT, the platform comes from
+        # the platform catalog
+        result = self.db.execute(
+            load_statement(CredentialDetail, credential_id, CREDENTIAL_DETAIL_RESPONSE)
+        )
+        credential = result.scalars().one()
+        platform_catalog.attach(self.db, [credential])
         return credential
@@ -0,0 +1,414 @@
+from codecs import getincrementaldecoder
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import insert, or_, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from app.auth.password import password_hasher
+from app.database.encryption import credential_cipher
+from app.database.connection import run_sync
+from app.database.models import CredentialDetail, Platform, User, UserIntegration
+from app.database.stats import add_counts, count_rows
+from app.database.versions import bump_versions, user_data
+from app.database.schemas import (
+    ImportCredentialSchema,
+    ImportIntegrationSchema,
+    ImportKind,
+    UserSchema,
+)
+import asyncio
+import csv
+import json
+import os
+
+# Rows validated, resolved and inserted together, each batch is committed on its own
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+# Row errors kept for the response, the rest are only counted
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+# Passwords an import hashes at once, the rest of the hashing pool queue is left to logins
+IMPORT_HASH_CONCURRENCY = int(
+    os.getenv("IMPORT_HASH_CONCURRENCY", str(password_hasher.max_workers * 2))
+)
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/jsonl", "application/json-lines")
+CSV_MEDIA_TYPES = ("text/csv",)
+
+ROW_SCHEMAS = {
+    ImportKind.users: UserSchema,
+    ImportKind.integrations: ImportIntegrationSchema,
+    ImportKind.credentials: ImportCredentialSchema,
+}
+
+# A record is (line number, parsed row or None, parse error or None)
+Record = Tuple[int, Optional[dict], Optional[str]]
+
+
+async def read_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Splits a streamed body into numbered lines, holding no more than one chunk in memory
+    """
+    decoder = getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    number = 0
+    try:
+        async for chunk in chunks:
+            buffer += decoder.decode(chunk)
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                number += 1
+                yield number, line.rstrip("\r")
+        buffer += decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail=f"Line {number + 1} is not valid UTF-8")
+    if buffer:
+        yield number + 1, buffer.rstrip("\r")
+
+
+async def _ndjson_records(lines: AsyncIterator[Tuple[int, str]]) -> AsyncIterator[Record]:
+    async for number, line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line), None
+        except ValueError:
+            yield number, None, "Invalid JSON"
+
+
+async def _csv_records(lines: AsyncIterator[Tuple[int, str]]) -> AsyncIterator[Record]:
+    header = None
+    async for number, line in lines:
+        if not line.strip():
+            continue
+        # One record per line, quoted fields can't span lines
+        fields = next(csv.reader([line]))
+        if header is None:
+            header = [field.strip() for field in fields]
+            continue
+        if len(fields) != len(header):
+            yield number, None, f"Expected {len(header)} fields, got {len(fields)}"
+            continue
+        # Empty cells are missing values, so optional columns can be left blank
+        yield number, {name: value for name, value in zip(header, fields) if value != ""}, None
+
+
+def read_records(chunks: AsyncIterator[bytes], content_type: str) -> AsyncIterator[Record]:
+    """
+    Parses a streamed NDJSON or CSV (with a header line) upload into numbered records
+    """
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type in NDJSON_MEDIA_TYPES:
+        return _ndjson_records(read_lines(chunks))
+    if media_type in CSV_MEDIA_TYPES:
+        return _csv_records(read_lines(chunks))
+    raise HTTPException(
+        status_code=415, detail="Upload NDJSON (application/x-ndjson) or CSV (text/csv)"
+    )
+
+
+class ImportResult:
+    """
+    Counts the rows of an import and keeps the first errors
+    """
+
+    def __init__(self, kind: ImportKind):
+        self.kind = kind
+        self.received = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+
+    def fail(self, line: int, detail: str):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line, "detail": detail})
+
+    def summary(self) -> dict:
+        return {
+            "kind": self.kind,
+            "received": self.received,
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": sorted(self.errors, key=lambda error: error["line"]),
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def _describe(exc: ValidationError) -> str:
+    return "; ".join(
+        ".".join(str(part) for part in error["loc"]) + ": " + error["msg"]
+        if error["loc"]
+        else error["msg"]
+        for error in exc.errors()
+    )
+
+
+class ImportService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    async def import_records(self, kind: ImportKind, records: AsyncIterator[Record]) -> dict:
+        """
+        Validates and imports the records in batches, a failing row is reported and skipped
+        """
+        result = ImportResult(kind)
+        schema = ROW_SCHEMAS[kind]
+        batch: list = []
+        async for number, record, error in records:
+            result.received += 1
+            if error is not None:
+                result.fail(number, error)
+                continue
+            try:
+                batch.append((number, schema.model_validate(record)))
+            except ValidationError as exc:
+                result.fail(number, _describe(exc))
+                continue
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                await self._import_batch(kind, batch, result)
+                batch = []
+        if batch:
+            await self._import_batch(kind, batch, result)
+        return result.summary()
+
+    async def _import_batch(self, kind: ImportKind, batch: list, result: ImportResult):
+        if kind == ImportKind.users:
+            batch = await run_sync(self.db, self._new_users, batch, result)
+            values = await self._hash_passwords(batch, result)
+            await run_sync(self.db, self._insert, User, values, result)
+        elif kind == ImportKind.integrations:
+            await run_sync(self.db, self._import_integrations, batch, result)
+        else:
+            await run_sync(self.db, self._import_credentials, batch, result)
+
+    def _new_users(self, batch: list, result: ImportResult) -> list:
+        """
+        Drops the rows whose username is taken, checking the whole batch in one query
+        """
+        usernames = {row.username for _, row in batch}
+        taken = set(
+            self.db.execute(select(User.username).where(User.username.in_(usernames))).scalars()
+        )
+        # Give the connection back to the pool while the passwords are hashed
+        self.db.rollback()
+        new_users = []
+        for number, row in batch:
+            if row.username in taken:
+                result.fail(number, "username already taken")
+                continue
+            taken.add(row.username)
+            new_users.append((number, row))
+        return new_users
+
+    async def _hash_passwords(self, batch: list, result: ImportResult) -> list:
+        """
+        Hashes the passwords of a batch in parallel in the password hashing pool
+        """
+        semaphore = asyncio.Semaphore(IMPORT_HASH_CONCURRENCY)
+
+        async def hash_row(number: int, row: UserSchema):
+            async with semaphore:
+                try:
+                    hashed_password = await password_hasher.hash(row.password)
+                except HTTPException as exc:
+                    result.fail(number, exc.detail)
+                    return None
+            return number, {
+                "username": row.username,
+                "password": hashed_password,
+                "is_admin": row.is_admin,
+            }
+
+        hashed = await asyncio.gather(*(hash_row(number, row) for number, row in batch))
+        return [values for values in hashed if values is not None]
+
+    def _resolve(self, batch: list, result: ImportResult) -> list:
+        """
+        Resolves the user and platform of every row with one query each, returns
+        (line, row, user_id, platform_id) for the rows whose references exist
+        """
+        user_ids = {row.user_id for _, row in batch if row.user_id is not None}
+        usernames = {row.username for _, row in batch if row.user_id is None and row.username}
+        platform_ids = {row.platform_id for _, row in batch if row.platform_id is not None}
+        platform_names = {
+            row.platform_name for _, row in batch if row.platform_id is None and row.platform_name
+        }
+
+        known_user_ids = set()
+        user_ids_by_name: Dict[str, int] = {}
+        if user_ids or usernames:
+            users = self.db.execute(
+                select(User.id, User.username).where(
+                    or_(User.id.in_(user_ids), User.username.in_(usernames))
+                )
+            )
+            for user_id, username in users:
+                known_user_ids.add(user_id)
+                user_ids_by_name[username] = user_id
+
+        known_platform_ids = set()
+        platform_ids_by_name: Dict[str, List[int]] = {}
+        if platform_ids or platform_names:
+            platforms = self.db.execute(
+                select(Platform.id, Platform.name).where(
+                    or_(Platform.id.in_(platform_ids), Platform.name.in_(platform_names))
+                )
+            )
+            for platform_id, name in platforms:
+                known_platform_ids.add(platform_id)
+                platform_ids_by_name.setdefault(name, []).append(platform_id)
+
+        resolved = []
+        for number, row in batch:
+            if row.user_id is not None:
+                user_id = row.user_id if row.user_id in known_user_ids else None
+            elif row.username:
+                user_id = user_ids_by_name.get(row.username)
+            else:
+                result.fail(number, "user_id or username is required")
+                continue
+            if user_id is None:
+                result.fail(number, "User not found")
+                continue
+
+            if row.platform_id is not None:
+                platform_id = row.platform_id if row.platform_id in known_platform_ids else None
+            elif row.platform_name:
+                matches = platform_ids_by_name.get(row.platform_name, [])
+                if len(matches) > 1:
+                    result.fail(number, "Platform name is ambiguous, use platform_id")
+                    continue
+                platform_id = matches[0] if matches else None
+            else:
+                result.fail(number, "platform_id or platform_name is required")
+                continue
+            if platform_id is None:
+                result.fail(number, "Platform not found")
+                continue
+
+            resolved.append((number, row, user_id, platform_id))
+        return resolved
+
+    def _import_integrations(self, batch: list, result: ImportResult):
+        resolved = self._resolve(batch, result)
+        pairs = {(user_id, platform_id) for _, _, user_id, platform_id in resolved}
+        existing = set()
+        if pairs:
+            integrated = self.db.execute(
+                select(UserIntegration.user_id, UserIntegration.platform_id).where(
+                    tuple_(UserIntegration.user_id, UserIntegration.platform_id).in_(pairs)
+                )
+            )
+            existing = {(user_id, platform_id) for user_id, platform_id in integrated}
+
+        values = []
+        for number, row, user_id, platform_id in resolved:
+            if (user_id, platform_id) in existing:
+                result.fail(number, "User is already integrated with this platform")
+                continue
+            existing.add((user_id, platform_id))
+            values.append(
+                (number, {"user_id": user_id, "platform_id": platform_id, "is_active": row.is_active})
+            )
+        self._insert(UserIntegration, values, result)
+
+    def _import_credentials(self, batch: list, result: ImportResult):
+        resolved = self._resolve(batch, result)
+        pairs = {(user_id, platform_id) for _, _, user_id, platform_id in resolved}
+        integration_ids = {}
+        existing = set()
+        if pairs:
+            integrations = self.db.execute(
+                select(
+                    UserIntegration.user_id, UserIntegration.platform_id, UserIntegration.id
+                ).where(tuple_(UserIntegration.user_id, UserIntegration.platform_id).in_(pairs))
+            )
+            for user_id, platform_id, integration_id in integrations:
+                integration_ids[(user_id, platform_id)] = integration_id
+            keys = {
+                (user_id, platform_id, row.key) for _, row, user_id, platform_id in resolved
+            }
+            credentials = self.db.execute(
+                select(
+                    CredentialDetail.user_id, CredentialDetail.platform_id, CredentialDetail.key
+                ).where(
+                    tuple_(
+                        CredentialDetail.user_id,
+                        CredentialDetail.platform_id,
+                        CredentialDetail.key,
+                    ).in_(keys)
+                )
+            )
+            existing = {
+                (user_id, platform_id, key) for user_id, platform_id, key in credentials
+            }
+
+        values = []
+        for number, row, user_id, platform_id in resolved:
+            integration_id = integration_ids.get((user_id, platform_id))
+            if integration_id is None:
+                result.fail(number, "User is not integrated with this platform")
+                continue
+            if (user_id, platform_id, row.key) in existing:
+                result.fail(number, "Credential already exists")
+                continue
+            existing.add((user_id, platform_id, row.key))
+            values.append(
+                (
+                    number,
+                    {
+                        "user_id": user_id,
+                        "platform_id": platform_id,
+                        "integration_id": integration_id,
+                        "key": row.key,
+                        "value": credential_cipher.encrypt(
+                            self.db, user_id, platform_id, row.key, row.value
+                        ),
+                    },
+                )
+            )
+        self._insert(CredentialDetail, values, result)
+
+    def _insert(self, model, values: list, result: ImportResult):
+        """
+        Inserts a batch with multi-row INSERT statements and commits it
+        """
+        if not values:
+            self.db.rollback()
+            return
+        try:
+            self.db.execute(insert(model), [row for _, row in values])
+            self._bump_users(model, [row for _, row in values])
+            self._count(model, [row for _, row in values])
+            self.db.commit()
+            result.imported += len(values)
+        except IntegrityError:
+            self.db.rollback()
+            # A concurrent write took some of the keys, insert row by row to find them
+            for number, row in values:
+                try:
+                    self.db.execute(insert(model), [row])
+                    self._bump_users(model, [row])
+                    self._count(model, [row])
+                    self.db.commit()
+                    result.imported += 1
+                except IntegrityError:
+                    self.db.rollback()
+                    result.fail(number, "Conflicts with an existing record")
+
+    def _bump_users(self, model, rows: list):
+        """
+        Bumps the data versions of the users whose integrations or credentials were imported
+        """
+        if model is not User:
+            bump_versions(self.db, [user_data(row["user_id"]) for row in rows])
+
+    def _count(self, model, rows: list):
+        """
+        Adds the imported integrations or credentials to the platform statistics, the imports
+        only insert new ones
+        """
+        if model is UserIntegration:
+            add_counts(self.db, count_rows(integrations=rows))
+        elif model is CredentialDetail:
+            add_counts(self.db, count_rows(credentials=rows))
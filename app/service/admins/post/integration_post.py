@@ -1,6 +1,10 @@
 from sqlalchemy.orm import Session
 from app.database.models import UserIntegration
+from app.database.stats import add_counts, count_rows
 from app.database.schemas import AdminIntegrationSchema
+from app.database.catalog import platform_catalog
+from app.database.loaders import USER_INTEGRATION_RESPONSE, reload_statement
+from app.database.versions import bump_version, user_data
 
 
 class IntegrationPostService:
@@ -15,6 +19,16 @@ class IntegrationPostService:
             user_id=integration_data.user_id, platform_id=integration_data.platform_id
         )
         self.db.add(integration)
+        # New integrations are active, flushed at the commit after the counters are updated. An
+        # integration that exists fails the INSERT and the counts roll back with it
+        add_counts(self.db, count_rows([{"platform_id": integration_data.platform_id}]))
+        # Tell the ETags of the user's responses that their data changed
+        bump_version(self.db, user_data(integration_data.user_id))
         self.db.commit()
 
+        # Reload with the user the response embeds in a single SELECT, the platform comes from
+        # the platform catalog
+        result = self.db.execute(reload_statement(integration, USER_INTEGRATION_RESPONSE))
+        integration = result.scalars().one()
+        platform_catalog.attach(self.db, [integration])
         return integration
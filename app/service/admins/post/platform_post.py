@@ -1,6 +1,8 @@
 from sqlalchemy.orm import Session
 from app.database.models import Platform
 from app.database.schemas import PlatformSchema
+from app.database.catalog import platform_catalog
+from app.database.versions import PLATFORMS, bump_version
 
 
 class PlatformPostService:
@@ -12,8 +14,13 @@ class PlatformPostService:
         Creates a new platform entry in the database
         """
         platform = Platform(
-            name=platform_data.name, descripition=platform_data.description
+            name=platform_data.name, description=platform_data.description
         )
         self.db.add(platform)
+        # Tell every worker that its platform catalog is stale
+        bump_version(self.db, PLATFORMS)
         self.db.commit()
+        platform_catalog.invalidate()
+        # Loaded here rather than by the serialization of the response, which runs on the event loop
+        self.db.refresh(platform)
         return platform
@@ -0,0 +1,19 @@
+from sqlalchemy.orm import Session
+from app.database.catalog import platform_catalog
+from app.database.stats import counters_statement, rebuild_statements
+from app.service.admins.get.stats_service import stats_response
+
+
+class StatsPostService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def rebuild(self) -> dict:
+        """
+        Recounts the platform statistics from the tables and returns them
+        """
+        for statement in rebuild_statements():
+            self.db.execute(statement)
+        self.db.commit()
+        counts = self.db.execute(counters_statement()).all()
+        return stats_response(platform_catalog.all(self.db), counts)
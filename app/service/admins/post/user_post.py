@@ -0,0 +1,33 @@
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from app.database.models import User
+from app.database.versions import USERS, bump_version
+from app.auth.cache import principal_cache
+from app.auth.user_versions import user_versions
+
+
+class UserPostService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def set_admin(self, user_id: int, is_admin: bool) -> User:
+        """
+        Grants or removes the admin privileges of a user, bumping its token version so the
+        access tokens carrying the old privileges are no longer trusted
+        """
+        user = self.db.get(User, user_id)
+        if user is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        if bool(user.is_admin) == is_admin:
+            return user
+        user.is_admin = is_admin  # type: ignore
+        user.token_version = (user.token_version or 0) + 1  # type: ignore
+        # Tell every worker that its copy of the token versions is stale
+        bump_version(self.db, USERS)
+        username, version = str(user.username), int(user.token_version)  # type: ignore
+        self.db.commit()
+        user_versions.set(user_id, version)
+        principal_cache.invalidate_user(username)
+        # Loaded here rather than by the serialization of the response, which runs on the event loop
+        self.db.refresh(user)
+        return user
@@ -1,21 +1,112 @@
+from typing import Dict, List
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from app.database.models import UserIntegration, User
+from app.database.models import CredentialDetail, UserIntegration, User
 from app.database.schemas import UserIntegrationWithDetailsSchema
 from app.filters.filter import UserIntegrationFilter
+from app.filters.pagination import CursorPage
+from app.database.catalog import platform_catalog
+from app.database.encryption import credential_cipher
+from app.database.loaders import USER_INTEGRATION_WITH_DETAILS
+
+# Columns read for the rows of UserIntegrationWithDetailsSchema, the credentials also need
+# user_id to be decrypted
+INTEGRATION_ROW_COLUMNS = (UserIntegration.id, UserIntegration.platform_id)
+DETAIL_ROW_COLUMNS = (
+    CredentialDetail.integration_id,
+    CredentialDetail.user_id,
+    CredentialDetail.platform_id,
+    CredentialDetail.key,
+    CredentialDetail.value,
+)
+
+
+def integration_rows_statement(
+    current_user: User, filters: UserIntegrationFilter, page: CursorPage
+):
+    """
+    Selects a page of the integrations of a user, only the columns of the rows
+    """
+    query = select(*INTEGRATION_ROW_COLUMNS).filter(UserIntegration.user_id == current_user.id)
+    query = filters.filter(query)
+    return page.paginate(query, UserIntegration, filters.order_by)
+
+
+def details_statement(integrations: list):
+    """
+    Selects the credentials of a page of integrations, only the columns of the rows
+    """
+    ids = [integration.id for integration in integrations]
+    return (
+        select(*DETAIL_ROW_COLUMNS)
+        .filter(CredentialDetail.integration_id.in_(ids))
+        .order_by(CredentialDetail.id)
+    )
+
+
+def integration_rows(
+    integrations: list, details: list, values: List[str], platforms: Dict
+) -> List[dict]:
+    """
+    Assembles dicts shaped like UserIntegrationWithDetailsSchema from the selected integrations,
+    their credentials with the decrypted values, and the platforms from the catalog
+    """
+    grouped: Dict[int, List[dict]] = {integration.id: [] for integration in integrations}
+    for detail, value in zip(details, values):
+        grouped[detail.integration_id].append(
+            {"platform_id": detail.platform_id, "key": detail.key, "value": value}
+        )
+    rows = []
+    for integration in integrations:
+        platform = platforms.get(integration.platform_id)
+        rows.append(
+            {
+                "id": integration.id,
+                "platform": platform.to_row() if platform is not None else None,
+                "details": grouped[integration.id],
+            }
+        )
+    return rows
 
 
 class IntegrationGetServices:
     def __init__(self, db: Session):
         self.db = db
 
-    def get_user_integrations(self, current_user: User, filters: UserIntegrationFilter):
+    def get_user_integrations(
+        self, current_user: User, filters: UserIntegrationFilter, page: CursorPage
+    ):
         """
-        Fetch user integrations for the current user, including platform details and credentials.
+        Fetch a page of user integrations for the current user, including platform details and credentials.
         """
-        query = self.db.query(UserIntegration).filter(
-            UserIntegration.user_id == current_user.id
+        query = (
+            select(UserIntegration)
+            .filter(UserIntegration.user_id == current_user.id)
+            .options(*USER_INTEGRATION_WITH_DETAILS)
         )
         query = filters.filter(query)
-        query = filters.sort(query)
+        query = page.paginate(query, UserIntegration, filters.order_by)
         result = self.db.execute(query)
-        return result.scalars().all()
+        integrations = page.collect(result.scalars().all())
+        credential_cipher.decrypt(
+            self.db, [detail for integration in integrations for detail in integration.details]
+        )
+        return platform_catalog.attach(self.db, integrations)
+
+    def get_user_integration_rows(
+        self, current_user: User, filters: UserIntegrationFilter, page: CursorPage
+    ) -> List[dict]:
+        """
+        Fetch a page of user integrations like get_user_integrations, as dicts shaped like
+        UserIntegrationWithDetailsSchema read from its columns only.
+        """
+        result = self.db.execute(integration_rows_statement(current_user, filters, page))
+        integrations = page.collect(result.all())
+        if not integrations:
+            return []
+        details = self.db.execute(details_statement(integrations)).all()
+        values = credential_cipher.decrypt_rows(self.db, details)
+        platforms = platform_catalog.get_many(
+            self.db, {integration.platform_id for integration in integrations}
+        )
+        return integration_rows(integrations, details, values, platforms)
@@ -1,19 +1,40 @@
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from typing import List
 from app.database.models import User, Platform
 from app.database.schemas import PlatformResponseSchema
 from app.filters.filter import PlatformFilter
+from app.filters.pagination import CursorPage
+from app.serialization import schema_columns, schema_rows
+
+PLATFORM_RESPONSE_COLUMNS = schema_columns(PlatformResponseSchema, Platform)
 
 
 class PlatformGetServices:
     def __init__(self, db: Session):
         self.db = db
 
-    def get_user_platforms(self, current_user: User, filters: PlatformFilter):
+    def get_user_platforms(
+        self, current_user: User, filters: PlatformFilter, page: CursorPage
+    ):
+        """
+        Fetch a page of the platforms that the current user is integrated with.
+        """
+        query = select(Platform).filter(Platform.users.contains(current_user))
+        query = filters.filter(query)
+        query = page.paginate(query, Platform, filters.order_by)
+        result = self.db.execute(query)
+        return page.collect(result.scalars().all())
+
+    def get_user_platform_rows(
+        self, current_user: User, filters: PlatformFilter, page: CursorPage
+    ) -> List[dict]:
         """
-        Fetch platforms that the current user is integrated with.
+        Fetch a page of the platforms of the current user like get_user_platforms, as dicts shaped
+        like PlatformResponseSchema read from its columns only.
         """
-        query = self.db.query(Platform).filter(Platform.users.contains(current_user))
+        query = select(*PLATFORM_RESPONSE_COLUMNS).filter(Platform.users.contains(current_user))
         query = filters.filter(query)
+        query = page.paginate(query, Platform, filters.order_by)
         result = self.db.execute(query)
-        return result.scalars().all()
+        return schema_rows(PlatformResponseSchema, page.collect(result.all()))
@@ -0,0 +1,24 @@
+from typing import Dict
+from sqlalchemy.orm import Session
+from app.database.versions import PLATFORMS, read_versions, user_data
+
+
+class VersionGetServices:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_user_versions(self, user_id: int) -> Dict[str, int]:
+        """
+        Fetch the versions of the data of a user and of the platforms, which the responses about
+        the user are built from.
+        """
+        return read_versions(self.db, [user_data(user_id), PLATFORMS])
+
+    def is_current(self, user_id: int, versions: Dict[str, int]) -> bool:
+        """
+        Returns whether the session sees the data of the versions read from the primary, a replica
+        lagging behind them would serve older data under their ETag
+        """
+        if not self.db.info.get("replica"):
+            return True
+        return self.get_user_versions(user_id) == versions
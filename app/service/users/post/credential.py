@@ -1,7 +1,13 @@
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
 from app.database.models import CredentialDetail
+from app.database.stats import count_changes, count_inserts
 from app.database.schemas import CredentialDetailSchema
+from app.database.catalog import platform_catalog
+from app.database.encryption import credential_cipher
+from app.database.loaders import CREDENTIAL_DETAIL_RESPONSE, load_statement
+from app.database.upsert import dialect_name, integrated_credential_upsert
+from app.database.versions import bump_version, user_data
 
 
 class CredentialServices:
@@ -12,29 +18,35 @@ class CredentialServices:
 
     def cred_service(self):
         """
-        Adds a new credential for a user's platform integration
+        Adds a credential for a user's platform integration, or replaces the value of the credential
+        with the same key. A single INSERT ... SELECT finds the integration and writes the credential
         """
-        integration = (
-            self.db.query(CredentialDetail)
-            .filter(
-                CredentialDetail.user_id == self.user.id,
-                CredentialDetail.platform_id == self.credential_data.platform_id,
-            )
-            .first()
-        )
-
-        if not integration:
+        data = self.credential_data
+        # Checked first so that no data key is created for a platform that doesn't exist
+        if platform_catalog.get(self.db, data.platform_id) is None:
             raise HTTPException(status_code=404, detail="Integration not found")
+        value = credential_cipher.encrypt(self.db, self.user.id, data.platform_id, data.key, data.value)
 
-        credential = CredentialDetail(
-            user_id=self.user.id,
-            platform_id=self.credential_data.platform_id,
-            integration_id=integration.id,
-            key=self.credential_data.key,
-            value=self.credential_data.value,
-        )
-
-        self.db.add(credential)
+        count_changes(self.db, self.user.id, credentials=[(data.platform_id, data.key)])
+        row = self.db.execute(
+            integrated_credential_upsert(
+                dialect_name(self.db), self.user.id, data.platform_id, data.key, value
+            )
+        ).first()
+        if row is None:
+            self.db.rollback()
+            raise HTTPException(status_code=404, detail="Integration not found")
+        credential_id, inserted = row
+        # Tell the ETags of the user's responses that their data changed
+        bump_version(self.db, user_data(self.user.id))
+        count_inserts(self.db, credentials=[(data.platform_id, inserted)])
         self.db.commit()
 
+        # Load with the user the response embeds in a single SELECT, the platform comes from
+        # the platform catalog
+        result = self.db.execute(
+            load_statement(CredentialDetail, credential_id, CREDENTIAL_DETAIL_RESPONSE)
+        )
+        credential = result.scalars().one()
+        platform_catalog.attach(self.db, [credential])
         return credential
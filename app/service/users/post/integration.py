@@ -1,7 +1,34 @@
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
-from app.database.models import User, CredentialDetail, UserIntegration, Platform
 from app.database.schemas import CredentialIntegration
+from app.database.catalog import platform_catalog
+from app.database.encryption import credential_cipher
+from app.database.loaders import USER_INTEGRATION_RESPONSE, load_statement
+from app.database.models import UserIntegration
+from app.database.stats import count_changes, count_inserts
+from app.database.versions import bump_version, user_data
+from app.database.upsert import (
+    credentials_upsert,
+    dialect_name,
+    integration_upsert,
+    unique_credentials,
+)
+
+
+def credential_rows(user_id: int, credentials: list, integration_id: int, values: list) -> list:
+    """
+    Builds the credential_details rows of an integration from the credentials and their sealed values
+    """
+    return [
+        {
+            "user_id": user_id,
+            "platform_id": cred.platform_id,
+            "integration_id": integration_id,
+            "key": cred.key,
+            "value": value,
+        }
+        for cred, value in zip(credentials, values)
+    ]
 
 
 class IntegrationServices:
@@ -17,46 +44,65 @@ class IntegrationServices:
 
     def integrate(self):
         """
-        Establishes an integration between an user and platform
+        Establishes an integration between an user and platform, or updates it and its
+        credentials if it exists. Runs one upsert for the integration and one batch for all the credentials,
+        and one statement counting them in the platform statistics
         """
-        existing_user = self.db.query(User).filter(User.id == self.user.id).first()
-        existing_platform = (
-            self.db.query(Platform)
-            .filter(Platform.id == self.integrate_cred.integration_data.platform_id)
-            .first()
-        )
-        if not existing_user or not existing_platform:
+        integration_data = self.integrate_cred.integration_data
+        existing_platform = platform_catalog.get(self.db, integration_data.platform_id)
+        if not existing_platform:
             raise HTTPException(status_code=404, detail="User or Platform not found")
-
-        integration = (
-            self.db.query(UserIntegration)
-            .filter(
-                UserIntegration.user_id == self.user.id,
-                UserIntegration.platform_id
-                == self.integrate_cred.integration_data.platform_id,
+        # The credentials are written with the integration's id, they must be of its platform
+        if any(
+            cred.platform_id != integration_data.platform_id
+            for cred in self.integrate_cred.credentials
+        ):
+            raise HTTPException(
+                status_code=422, detail="Credentials must be of the platform of the integration"
             )
-            .first()
-        )
 
-        if not integration:
-            integration = UserIntegration(
-                user_id=self.user.id,
-                platform_id=self.integrate_cred.integration_data.platform_id,
-                is_active=self.integrate_cred.integration_data.is_active,
+        # Sealed before anything is written, creating a data key commits on a connection of its own
+        values = [
+            credential_cipher.encrypt(self.db, self.user.id, cred.platform_id, cred.key, cred.value)
+            for cred in self.integrate_cred.credentials
+        ]
+
+        # On SQLite the changes are counted first, by comparing with the rows before the upserts
+        count_changes(
+            self.db,
+            self.user.id,
+            (integration_data.platform_id, integration_data.is_active),
+            [(cred.platform_id, cred.key) for cred in self.integrate_cred.credentials],
+        )
+        dialect = dialect_name(self.db)
+        integration_id, inserted = self.db.execute(
+            integration_upsert(
+                dialect, self.user.id, integration_data.platform_id, integration_data.is_active
             )
-            self.db.add(integration)
-            self.db.flush()
-
-        for cred in self.integrate_cred.credentials:
-            credential = CredentialDetail(
-                user_id=self.user.id,
-                platform_id=cred.platform_id,
-                integration_id=integration.id,
-                key=cred.key,
-                value=cred.value,
+        ).one()
+        credentials = []
+        if values:
+            rows = credential_rows(
+                self.user.id, self.integrate_cred.credentials, integration_id, values
             )
-            self.db.add(credential)
-
+            credentials = self.db.execute(
+                credentials_upsert(dialect), unique_credentials(rows)
+            ).all()
+        # Tell the ETags of the user's responses that their data changed
+        bump_version(self.db, user_data(self.user.id))
+        # Elsewhere the upserts returned what they inserted
+        count_inserts(
+            self.db,
+            (integration_data.platform_id, integration_data.is_active, inserted),
+            credentials,
+        )
         self.db.commit()
 
+        # Load with the user the response embeds in a single SELECT, the platform comes from
+        # the platform catalog
+        result = self.db.execute(
+            load_statement(UserIntegration, integration_id, USER_INTEGRATION_RESPONSE)
+        )
+        integration = result.scalars().one()
+        platform_catalog.attach(self.db, [integration])
         return integration
@@ -0,0 +1,247 @@
+"""
+Benchmarks the authentication and read hot paths of the API in-process.
+
+The FastAPI app from app/main.py is served through httpx's ASGI transport against a freshly
+seeded SQLite database, so runs are reproducible on one machine. See benchmarks/README.md.
+"""
+from datetime import timedelta
+from typing import Callable, Dict, List, Tuple
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.report import add_output_arguments, finish, summarize  # noqa: E402
+
+# A scenario builds the (method, url, request options) of its n-th request
+Request = Tuple[str, str, dict]
+
+
+class Scenario:
+    def __init__(self, name: str, build: Callable[[int], Request], login: bool = False):
+        self.name = name
+        self.build = build
+        # Logins are bound by bcrypt and get their own (smaller) request count
+        self.login = login
+
+
+def build_scenarios(args, tokens: List[str], admin_token: str) -> Dict[str, Scenario]:
+    from benchmarks.seed import BENCH_PASSWORD, username
+
+    def user_headers(n: int) -> dict:
+        return {"Authorization": f"Bearer {tokens[n % len(tokens)]}"}
+
+    admin_headers = {"Authorization": f"Bearer {admin_token}"}
+    run_id = int(time.time())
+
+    def integrate(n: int) -> Request:
+        user = n % len(tokens)
+        platform_id = user % args.platforms + 1
+        credentials = [
+            # Keys are unique per request, credentials are unique per user, platform and key
+            {"platform_id": platform_id, "key": f"bench-{run_id}-{n}-{k}", "value": "secret"}
+            for k in range(args.integrate_credentials)
+        ]
+        body = {
+            "integration_data": {"platform_id": platform_id, "is_active": True},
+            "credentials": credentials,
+        }
+        return "POST", "/users/integrate", {"json": body, "headers": user_headers(n)}
+
+    scenarios = [
+        Scenario(
+            "login",
+            lambda n: (
+                "POST",
+                "/login",
+                {"data": {"username": username(n % args.users), "password": BENCH_PASSWORD}},
+            ),
+            login=True,
+        ),
+        Scenario("users_me", lambda n: ("GET", "/users/me", {"headers": user_headers(n)})),
+        Scenario(
+            "users_me_platforms",
+            lambda n: ("GET", "/users/me/platforms", {"headers": user_headers(n)}),
+        ),
+        Scenario(
+            "users_me_integrations",
+            lambda n: ("GET", "/users/me/user_integrations", {"headers": user_headers(n)}),
+        ),
+        Scenario(
+            "admin_users_filtered",
+            lambda n: (
+                "GET",
+                "/admin/users",
+                {
+                    "params": {
+                        "username__ilike": f"user{n % 10}%",
+                        "is_admin": "false",
+                        "order_by": "-username",
+                        "limit": 50,
+                    },
+                    "headers": admin_headers,
+                },
+            ),
+        ),
+        Scenario("integrate", integrate),
+        Scenario("admin_stats", lambda n: ("GET", "/admin/stats", {"headers": admin_headers})),
+        Scenario(
+            "admin_stats_live",
+            lambda n: ("GET", "/admin/stats", {"params": {"live": "true"}, "headers": admin_headers}),
+        ),
+    ]
+    return {scenario.name: scenario for scenario in scenarios}
+
+
+async def run_scenario(client, scenario: Scenario, requests: int, concurrency: int, first: int):
+    """
+    Sends `requests` requests from `concurrency` concurrent clients, returns the summary
+    """
+    latencies: List[float] = []
+    errors = 0
+    numbers = iter(range(first, first + requests))
+
+    async def client_loop():
+        nonlocal errors
+        for n in numbers:
+            method, url, options = scenario.build(n)
+            start = time.perf_counter()
+            response = await client.request(method, url, **options)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+async def run(args) -> Dict[str, dict]:
+    import httpx
+    from app.main import app
+    from app.auth.utils import create_access_token
+    from benchmarks.seed import ADMIN_USERNAME, username
+
+    expires = timedelta(hours=1)
+    tokens = [
+        create_access_token({"sub": username(index)}, expires)
+        for index in range(min(args.users, args.token_users))
+    ]
+    admin_token = create_access_token({"sub": ADMIN_USERNAME}, expires)
+    scenarios = build_scenarios(args, tokens, admin_token)
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            number = 0
+            for name in args.scenarios:
+                scenario = scenarios[name]
+                requests = args.login_requests if scenario.login else args.requests
+                for concurrency in args.concurrency:
+                    # Warm up the caches, pools and the password hashing workers first
+                    await run_scenario(client, scenario, args.warmup, concurrency, number)
+                    number += args.warmup
+                    summary = await run_scenario(client, scenario, requests, concurrency, number)
+                    number += requests
+                    summary["concurrency"] = concurrency
+                    results[f"{name}@c{concurrency}"] = summary
+                    print(
+                        f"{name}@c{concurrency}: {summary['throughput_rps']} req/s, "
+                        f"p50 {summary['p50_ms']} ms, p99 {summary['p99_ms']} ms, "
+                        f"{summary['errors']} errors",
+                        flush=True,
+                    )
+    return results
+
+
+SCENARIOS = [
+    "login",
+    "users_me",
+    "users_me_platforms",
+    "users_me_integrations",
+    "admin_users_filtered",
+    "integrate",
+    "admin_stats",
+    "admin_stats_live",
+]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--platforms", type=int, default=20)
+    parser.add_argument("--integrations-per-user", type=int, default=3)
+    parser.add_argument("--credentials-per-integration", type=int, default=5)
+    parser.add_argument(
+        "--integrate-credentials",
+        type=int,
+        default=10,
+        help="credentials sent with each /users/integrate request",
+    )
+    parser.add_argument(
+        "--token-users", type=int, default=100, help="distinct users the requests are spread over"
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--requests", type=int, default=300, help="requests per scenario and concurrency")
+    parser.add_argument("--login-requests", type=int, default=40)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument(
+        "--database", help="SQLite file to seed, a temporary one is used by default"
+    )
+    add_output_arguments(parser, "api")
+    args = parser.parse_args()
+
+    database = args.database or os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench.db")
+    url = f"sqlite:///{os.path.abspath(database)}"
+    # The app reads its settings when it is imported, so they are set before anything imports it
+    os.environ["DATABASE_URL"] = url
+    os.environ.setdefault("SECRET_KEY", "bench-secret")
+    os.environ.setdefault("REFRESH_KEY", "bench-refresh")
+    # Credential values are sealed as in production, 32 bytes in urlsafe base64
+    os.environ.setdefault("CREDENTIAL_MASTER_KEY", "YmVuY2gtY3JlZGVudGlhbC1tYXN0ZXIta2V5LTAwMDA=")
+    os.environ["QUERY_BUDGET_ENFORCE"] = "false"
+    # Requests queue behind each other here, the slow request log would only add noise
+    os.environ.setdefault("SLOW_REQUEST_SECONDS", "3600")
+    # Every login comes from one address and the users repeat, the login scenario measures bcrypt
+    # rather than the rate limits, see bench_login.py for those
+    os.environ.setdefault("LOGIN_IP_BURST", "0")
+    os.environ.setdefault("LOGIN_USERNAME_BURST", "0")
+    os.environ.setdefault("LOGIN_USER_BURST", "0")
+
+    from benchmarks.seed import seed_database
+
+    seed_database(
+        url,
+        args.users,
+        args.platforms,
+        args.integrations_per_user,
+        args.credentials_per_integration,
+    )
+    results = asyncio.run(run(args))
+
+    settings = {
+        name: getattr(args, name)
+        for name in (
+            "users",
+            "platforms",
+            "integrations_per_user",
+            "credentials_per_integration",
+            "integrate_credentials",
+            "token_users",
+            "requests",
+            "login_requests",
+        )
+    }
+    settings["async_db"] = os.getenv("USE_ASYNC_DB", "false")
+    return finish("api", args, settings, results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
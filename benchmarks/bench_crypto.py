@@ -0,0 +1,128 @@
+"""
+Benchmarks sealing and opening credential values with the envelope encryption of app.database.encryption.
+
+Runs in-process without a database, every operation of a sample uses the same data key.
+See benchmarks/README.md.
+"""
+from typing import Callable, Dict, List
+import argparse
+import base64
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.report import add_output_arguments, finish, summarize  # noqa: E402
+
+
+def measure(operation: Callable[[int], object], samples: int, batch: int) -> dict:
+    """
+    Times `samples` batches of `batch` operations, each latency is the mean of a batch since a
+    single operation is too short for the clock
+    """
+    latencies: List[float] = []
+    wall = time.perf_counter()
+    for sample in range(samples):
+        started = time.perf_counter()
+        for index in range(batch):
+            operation(index)
+        latencies.append((time.perf_counter() - started) / batch)
+    wall = time.perf_counter() - wall
+    # Every operation of a batch counts as a request with the mean latency of its batch
+    result = summarize(latencies * batch, wall)
+    # The millisecond percentiles round microsecond operations away, keep them in microseconds too
+    ordered = sorted(latencies)
+    result["p50_us"] = round(ordered[len(ordered) // 2] * 1e6, 3)
+    result["mean_us"] = round(sum(ordered) / len(ordered) * 1e6, 3)
+    return result
+
+
+def run(args) -> Dict[str, dict]:
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    from app.database.encryption import (
+        CredentialCipher,
+        MasterKeys,
+        WrappedKey,
+        open_value,
+        seal_value,
+    )
+
+    master_key = base64.urlsafe_b64encode(os.urandom(32)).decode()
+    cipher = CredentialCipher(MasterKeys(master_key, []), args.cache_size, 3600)
+    platform_id, user_id, key = 1, 1, "token"
+    row, data_key = cipher.new_key(platform_id)
+    # The key ring as ensure_fresh would load it, without the database
+    cipher._wrapped = {1: WrappedKey(1, platform_id, row["master_key_id"], row["wrapped_key"])}
+    cipher._active = {platform_id: 1}
+    data_cipher = AESGCM(data_key)
+
+    results = {}
+    for size in args.sizes:
+        value = "x" * size
+        sealed = cipher.seal(1, user_id, platform_id, key, value)
+        operations = {
+            # The path of every write, the data key comes from the LRU cache
+            "seal": lambda index: cipher.seal(1, user_id, platform_id, key, value),
+            # The path of every read
+            "open": lambda index: cipher.decrypt_value(user_id, platform_id, key, sealed),
+            # The AES-GCM operations alone, the difference is the key lookup
+            "seal_raw": lambda index: seal_value(data_cipher, 1, user_id, platform_id, key, value),
+            "open_raw": lambda index: open_value(data_cipher, user_id, platform_id, key, sealed),
+        }
+        for name, operation in operations.items():
+            results[f"{name}@{size}B"] = measure(operation, args.samples, args.batch)
+
+    def cold_open(index: int):
+        # A data key missing from the LRU cache is unwrapped with the master key first
+        cipher._ciphers.clear()
+        cipher.decrypt_value(user_id, platform_id, key, sealed_small)
+
+    sealed_small = cipher.seal(1, user_id, platform_id, key, "x" * args.sizes[0])
+    results[f"open_cold_key@{args.sizes[0]}B"] = measure(cold_open, args.samples, args.batch)
+
+    # What the envelope saves: deriving a key from a secret for every value with a slow KDF
+    salt = os.urandom(16)
+
+    def kdf_seal(index: int):
+        kdf = PBKDF2HMAC(hashes.SHA256(), 32, salt, args.kdf_iterations)
+        seal_value(AESGCM(kdf.derive(b"secret")), 1, user_id, platform_id, key, "x" * args.sizes[0])
+
+    results[f"seal_per_value_kdf@{args.sizes[0]}B"] = measure(kdf_seal, args.kdf_samples, 1)
+
+    for name, result in sorted(results.items()):
+        print(f"{name}: p50 {result['p50_us']} us, mean {result['mean_us']} us", flush=True)
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=200, help="operations timed together")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[32, 256, 4096], help="value sizes in bytes"
+    )
+    parser.add_argument("--cache-size", type=int, default=1024)
+    parser.add_argument(
+        "--kdf-iterations",
+        type=int,
+        default=600000,
+        help="PBKDF2 iterations of the per-value KDF the envelope is compared with",
+    )
+    parser.add_argument("--kdf-samples", type=int, default=5)
+    add_output_arguments(parser, "crypto")
+    args = parser.parse_args()
+
+    results = run(args)
+    settings = {
+        name: getattr(args, name)
+        for name in ("samples", "batch", "sizes", "cache_size", "kdf_iterations", "kdf_samples")
+    }
+    return finish("crypto", args, settings, results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
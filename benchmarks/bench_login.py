@@ -0,0 +1,204 @@
+"""
+Benchmarks the logins of legitimate users while an attacker stuffs credentials into /login.
+
+The app is served in-process through httpx's ASGI transport against a freshly seeded SQLite
+database, each request from the client address of its sender. See benchmarks/README.md.
+"""
+from collections import Counter
+from typing import Dict, List
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.report import add_output_arguments, finish, summarize  # noqa: E402
+
+# Whether the attacker runs during the phase and whether the login rate limits are on
+PHASES = {
+    "no_attack": (False, True),
+    "attack_unlimited": (True, False),
+    "attack_limited": (True, True),
+}
+
+
+async def post_login(app, address: str, username: str, password: str) -> int:
+    """
+    Sends a login from a client address, returns the status code
+    """
+    import httpx
+
+    transport = httpx.ASGITransport(app=app, client=(address, 50000))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        response = await client.post("/login", data={"username": username, "password": password})
+    return response.status_code
+
+
+async def run_phase(app, args, attack: bool, first: int) -> Dict[str, dict]:
+    """
+    Logs in `legit_requests` users from `legit_concurrency` clients, each from its own address,
+    while `attackers` clients send `attack_rps` wrong passwords a second for the target users from
+    `attacker_addresses` addresses. The attack starts `attack_lead` seconds before the legitimate
+    logins, so the bursts of the buckets are spent, and stops when they are done
+    """
+    from benchmarks.seed import BENCH_PASSWORD, username
+
+    legit_users = args.users - args.targets
+    latencies: List[float] = []
+    errors = 0
+    numbers = iter(range(first, first + args.legit_requests))
+    done = asyncio.Event()
+    attack_latencies: List[float] = []
+    statuses: Counter = Counter()
+
+    async def legit_loop():
+        nonlocal errors
+        for n in numbers:
+            started = time.perf_counter()
+            status = await post_login(
+                app, f"10.1.{n // 250 % 250}.{n % 250}", username(n % legit_users), BENCH_PASSWORD
+            )
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors += 1
+
+    async def attack_loop(attacker: int):
+        n = attacker
+        interval = args.attackers / args.attack_rps
+        next_at = time.perf_counter()
+        while not done.is_set():
+            next_at += interval
+            started = time.perf_counter()
+            status = await post_login(
+                app,
+                f"203.0.113.{n % args.attacker_addresses + 1}",
+                username(legit_users + n % args.targets),
+                f"guess-{n}",
+            )
+            attack_latencies.append(time.perf_counter() - started)
+            statuses[status] += 1
+            n += args.attackers
+            # Attackers pace themselves, the server isn't the only thing they wait for
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+    attack_started = time.perf_counter()
+    attackers = [asyncio.ensure_future(attack_loop(a)) for a in range(args.attackers if attack else 0)]
+    if attack:
+        await asyncio.sleep(args.attack_lead)
+    started = time.perf_counter()
+    await asyncio.gather(*(legit_loop() for _ in range(args.legit_concurrency)))
+    wall = time.perf_counter() - started
+    done.set()
+    await asyncio.gather(*attackers)
+
+    results = {"legit": summarize(latencies, wall, errors)}
+    if attack:
+        # The attacker succeeding would be an error
+        results["attack"] = summarize(
+            attack_latencies, time.perf_counter() - attack_started, statuses[200]
+        )
+        results["attack"]["statuses"] = {str(status): count for status, count in sorted(statuses.items())}
+    return results
+
+
+async def run(args) -> Dict[str, dict]:
+    from app.main import app
+    from app.auth.rate_limit import (
+        LOGIN_RATE_LIMIT_MAX_KEYS,
+        LOGIN_RATE_LIMIT_SWEEP_SECONDS,
+        MemoryRateLimitBackend,
+        login_rate_limiter,
+    )
+    from benchmarks.seed import BENCH_PASSWORD, username
+
+    limits = login_rate_limiter.limits
+    results = {}
+    async with app.router.lifespan_context(app):
+        # Start the password hashing workers
+        for n in range(args.warmup):
+            await post_login(app, "10.0.0.1", username(n), BENCH_PASSWORD)
+        # Every phase logs in other users
+        number = args.warmup
+        for phase in args.phases:
+            attack, limited = PHASES[phase]
+            login_rate_limiter.backend = MemoryRateLimitBackend(
+                LOGIN_RATE_LIMIT_SWEEP_SECONDS, LOGIN_RATE_LIMIT_MAX_KEYS
+            )
+            login_rate_limiter.limits = limits if limited else []
+            for name, summary in (await run_phase(app, args, attack, number)).items():
+                results[f"{name}@{phase}"] = summary
+                print(
+                    f"{name}@{phase}: {summary['throughput_rps']} req/s, "
+                    f"p50 {summary['p50_ms']} ms, p99 {summary['p99_ms']} ms, "
+                    f"{summary.get('statuses', str(summary['errors']) + ' errors')}",
+                    flush=True,
+                )
+            number += args.legit_requests
+    login_rate_limiter.limits = limits
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--targets", type=int, default=10, help="users the attacker guesses for")
+    parser.add_argument("--legit-requests", type=int, default=60, help="legitimate logins per phase")
+    parser.add_argument("--legit-concurrency", type=int, default=4)
+    parser.add_argument("--attackers", type=int, default=16, help="concurrent attacker clients")
+    parser.add_argument("--attack-rps", type=float, default=50, help="attempts a second of the attack")
+    parser.add_argument(
+        "--attack-lead", type=float, default=30, help="seconds the attack runs before it is measured"
+    )
+    parser.add_argument("--attacker-addresses", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=4)
+    parser.add_argument("--phases", nargs="+", choices=list(PHASES), default=list(PHASES))
+    add_output_arguments(parser, "login")
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench.db")
+    # The app reads its settings when it is imported, so they are set before anything imports it
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    os.environ.setdefault("SECRET_KEY", "bench-secret")
+    os.environ.setdefault("REFRESH_KEY", "bench-refresh")
+    os.environ["QUERY_BUDGET_ENFORCE"] = "false"
+    os.environ.setdefault("SLOW_REQUEST_SECONDS", "3600")
+
+    from benchmarks.seed import seed_database
+
+    seed_database(os.environ["DATABASE_URL"], args.users, 1, 0, 0)
+    results = asyncio.run(run(args))
+
+    settings = {
+        name: getattr(args, name)
+        for name in (
+            "users",
+            "targets",
+            "legit_requests",
+            "legit_concurrency",
+            "attackers",
+            "attack_rps",
+            "attack_lead",
+            "attacker_addresses",
+        )
+    }
+    settings["limits"] = {
+        name: os.getenv(name)
+        for name in (
+            "LOGIN_USERNAME_BURST",
+            "LOGIN_USERNAME_PER_MINUTE",
+            "LOGIN_USER_BURST",
+            "LOGIN_USER_PER_MINUTE",
+            "LOGIN_IP_BURST",
+            "LOGIN_IP_PER_MINUTE",
+        )
+    }
+    settings["async_db"] = os.getenv("USE_ASYNC_DB", "false")
+    return finish("login", args, settings, results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
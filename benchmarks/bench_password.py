@@ -0,0 +1,133 @@
+"""
+Calibrates the password hashing costs of app.auth.password against a login latency budget.
+
+Times verifying a password with bcrypt at several rounds and argon2id at several time, memory
+and parallelism costs on this host, then recommends the strongest costs whose p95 fits the
+budget. Runs in-process without a database. See benchmarks/README.md.
+"""
+from typing import Dict, List, Optional
+import argparse
+import itertools
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.report import add_output_arguments, finish, summarize  # noqa: E402
+
+PASSWORD = "calibration-password"
+
+
+def measure(context, samples: int) -> dict:
+    """
+    Times `samples` verifications of a hash made by the context, what every login pays
+    """
+    hashed = context.hash(PASSWORD)
+    latencies: List[float] = []
+    wall = time.perf_counter()
+    for _ in range(samples):
+        started = time.perf_counter()
+        context.verify(PASSWORD, hashed)
+        latencies.append(time.perf_counter() - started)
+    return summarize(latencies, time.perf_counter() - wall)
+
+
+def fits(result: dict, target_ms: float) -> bool:
+    return result["p95_ms"] <= target_ms
+
+
+def run(args) -> Dict[str, dict]:
+    from app.auth.password import argon2, build_context
+
+    results = {}
+    bcrypt_choice: Optional[int] = None
+    for rounds in sorted(args.bcrypt_rounds):
+        result = measure(build_context(["bcrypt"], bcrypt_rounds=rounds), args.samples)
+        results[f"bcrypt@rounds{rounds}"] = result
+        print(f"bcrypt rounds {rounds}: p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms", flush=True)
+        if fits(result, args.target_ms):
+            bcrypt_choice = rounds
+        elif result["p50_ms"] > 2 * args.target_ms:
+            # Every round doubles the cost, the higher ones can't fit either
+            break
+
+    argon2_choice = None
+    if argon2 is None:
+        print("argon2-cffi isn't installed, skipping argon2")
+    else:
+        for time_cost, memory_cost, parallelism in itertools.product(
+            args.argon2_time_costs, args.argon2_memory_costs, args.argon2_parallelism
+        ):
+            context = build_context(
+                ["argon2"],
+                argon2_time_cost=time_cost,
+                argon2_memory_cost=memory_cost,
+                argon2_parallelism=parallelism,
+            )
+            result = measure(context, args.samples)
+            results[f"argon2@t{time_cost},m{memory_cost},p{parallelism}"] = result
+            print(
+                f"argon2id t={time_cost} m={memory_cost} KiB p={parallelism}: "
+                f"p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms",
+                flush=True,
+            )
+            # Memory is what makes guessing on GPUs expensive, then passes, then fewer lanes
+            strength = (memory_cost, time_cost, -parallelism)
+            if fits(result, args.target_ms) and (argon2_choice is None or strength > argon2_choice[0]):
+                argon2_choice = (strength, time_cost, memory_cost, parallelism, result)
+
+    print(f"\nRecommended for a {args.target_ms} ms budget (p95 of one verification):")
+    if bcrypt_choice is None:
+        print("  bcrypt: none of the rounds fit the budget")
+    else:
+        result = results[f"bcrypt@rounds{bcrypt_choice}"]
+        print(
+            f"  PASSWORD_SCHEMES=bcrypt PASSWORD_BCRYPT_ROUNDS={bcrypt_choice}"
+            f"  (p95 {result['p95_ms']} ms, {round(1000 / result['mean_ms'], 1)} logins/s per worker)"
+        )
+    if argon2_choice is not None:
+        _, time_cost, memory_cost, parallelism, result = argon2_choice
+        print(
+            f"  PASSWORD_SCHEMES=argon2,bcrypt PASSWORD_ARGON2_TIME_COST={time_cost} "
+            f"PASSWORD_ARGON2_MEMORY_COST={memory_cost} PASSWORD_ARGON2_PARALLELISM={parallelism}"
+            f"  (p95 {result['p95_ms']} ms, {round(1000 / result['mean_ms'], 1)} logins/s per worker, "
+            f"{memory_cost // 1024} MiB per hash)"
+        )
+    elif argon2 is not None:
+        print("  argon2: none of the costs fit the budget")
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--target-ms", type=float, default=250, help="latency budget of one password verification"
+    )
+    parser.add_argument("--samples", type=int, default=5, help="verifications timed per setting")
+    parser.add_argument("--bcrypt-rounds", type=int, nargs="+", default=[10, 11, 12, 13, 14])
+    parser.add_argument("--argon2-time-costs", type=int, nargs="+", default=[1, 2, 3, 4])
+    parser.add_argument(
+        "--argon2-memory-costs", type=int, nargs="+", default=[19456, 65536], help="in KiB"
+    )
+    parser.add_argument("--argon2-parallelism", type=int, nargs="+", default=[1, 4])
+    add_output_arguments(parser, "password")
+    args = parser.parse_args()
+
+    results = run(args)
+    settings = {
+        name: getattr(args, name)
+        for name in (
+            "samples",
+            "bcrypt_rounds",
+            "argon2_time_costs",
+            "argon2_memory_costs",
+            "argon2_parallelism",
+        )
+    }
+    return finish("password", args, settings, results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+Benchmarks serializing lists of the response schemas of app.database.schemas, per item.
+
+Runs in-process without a database: the ORM objects and rows are built once, only their
+serialization is timed. See benchmarks/README.md.
+"""
+from typing import Callable, Dict, List
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.report import add_output_arguments, finish, summarize  # noqa: E402
+
+
+def measure(operation: Callable[[], object], samples: int, items: int) -> dict:
+    """
+    Times `samples` serializations of a list of `items` items, each latency is the cost per item
+    """
+    latencies: List[float] = []
+    wall = time.perf_counter()
+    for _ in range(samples):
+        started = time.perf_counter()
+        operation()
+        latencies.append((time.perf_counter() - started) / items)
+    wall = time.perf_counter() - wall
+    # Every item counts as a request with the per-item latency of its list
+    result = summarize(latencies * items, wall)
+    # The millisecond percentiles round microsecond costs away, keep them in microseconds too
+    ordered = sorted(latencies)
+    result["p50_us"] = round(ordered[len(ordered) // 2] * 1e6, 3)
+    result["mean_us"] = round(sum(ordered) / len(ordered) * 1e6, 3)
+    return result
+
+
+def build_items(size: int, details: int, platforms: int) -> Dict[type, tuple]:
+    """
+    Returns, for each list response schema, `size` ORM objects as the services load them and the
+    same items as rows shaped like the schema
+    """
+    from app.database.models import CredentialDetail, Platform, User, UserIntegration
+    from app.database.schemas import (
+        CredentialDetailResponseSchema,
+        CurrentUserResponseSchema,
+        PlatformResponseSchema,
+        UserIntegrationResponseSchema,
+        UserIntegrationWithDetailsSchema,
+        UserResponseSchema,
+    )
+
+    def user(index: int) -> User:
+        return User(id=index, username=f"user{index}", password="x", is_admin=False)
+
+    def platform(index: int) -> Platform:
+        return Platform(
+            id=index % platforms + 1,
+            name=f"platform{index % platforms}",
+            description=f"Benchmark platform {index % platforms}",
+        )
+
+    def user_row(index: int) -> dict:
+        return {"id": index, "username": f"user{index}", "is_admin": False}
+
+    def platform_row(index: int) -> dict:
+        return {
+            "id": index % platforms + 1,
+            "name": f"platform{index % platforms}",
+            "description": f"Benchmark platform {index % platforms}",
+        }
+
+    def integration(index: int) -> UserIntegration:
+        item = UserIntegration(id=index, user_id=1, platform_id=index % platforms + 1, is_active=True)
+        item.user = user(1)
+        item.platform = platform(index)
+        item.details = [
+            CredentialDetail(
+                id=index * details + number,
+                user_id=1,
+                platform_id=item.platform_id,
+                integration_id=index,
+                key=f"key{number}",
+                value=f"value{number}",
+            )
+            for number in range(details)
+        ]
+        return item
+
+    def credential(index: int) -> CredentialDetail:
+        item = CredentialDetail(
+            id=index, user_id=1, platform_id=index % platforms + 1, key=f"key{index}", value="x"
+        )
+        item.user = user(1)
+        item.platform = platform(index)
+        return item
+
+    def current_user(index: int) -> User:
+        item = user(index)
+        item.platforms = [platform(index + offset) for offset in range(details)]
+        return item
+
+    indexes = range(1, size + 1)
+    return {
+        UserResponseSchema: ([user(i) for i in indexes], [user_row(i) for i in indexes]),
+        PlatformResponseSchema: (
+            [platform(i) for i in indexes],
+            [platform_row(i) for i in indexes],
+        ),
+        UserIntegrationResponseSchema: (
+            [integration(i) for i in indexes],
+            [
+                {
+                    "id": i,
+                    "user_id": 1,
+                    "platform_id": i % platforms + 1,
+                    "is_active": True,
+                    "user": user_row(1),
+                    "platform": platform_row(i),
+                }
+                for i in indexes
+            ],
+        ),
+        UserIntegrationWithDetailsSchema: (
+            [integration(i) for i in indexes],
+            [
+                {
+                    "id": i,
+                    "platform": platform_row(i),
+                    "details": [
+                        {"platform_id": i % platforms + 1, "key": f"key{n}", "value": f"value{n}"}
+                        for n in range(details)
+                    ],
+                }
+                for i in indexes
+            ],
+        ),
+        CredentialDetailResponseSchema: (
+            [credential(i) for i in indexes],
+            [
+                {
+                    "id": i,
+                    "user_id": 1,
+                    "platform_id": i % platforms + 1,
+                    "key": f"key{i}",
+                    "user": user_row(1),
+                    "platform": platform_row(i),
+                }
+                for i in indexes
+            ],
+        ),
+        CurrentUserResponseSchema: (
+            [current_user(i) for i in indexes],
+            [
+                {
+                    "username": f"user{i}",
+                    "platforms": [platform_row(i + offset) for offset in range(details)],
+                }
+                for i in indexes
+            ],
+        ),
+    }
+
+
+def run(args) -> Dict[str, dict]:
+    from pydantic import TypeAdapter
+    from app.serialization import list_serializer, orjson
+
+    results = {}
+    for size in args.sizes:
+        for schema, (objects, rows) in build_items(size, args.details, args.platforms).items():
+            response_model = TypeAdapter(List[schema])  # type: ignore
+            serializer = list_serializer(schema)
+            # Both paths must produce the same document
+            expected = response_model.dump_json(
+                response_model.validate_python(objects, from_attributes=True)
+            )
+            assert json.loads(serializer.dump_json(rows)) == json.loads(expected), schema
+
+            paths = {
+                # What FastAPI does with the ORM objects a list endpoint returns
+                "response_model": lambda: response_model.dump_json(
+                    response_model.validate_python(objects, from_attributes=True)
+                ),
+                # The rows path without orjson, with the precompiled serializer of the rows
+                "type_adapter": lambda: serializer.dump_json(rows),
+                # The stdlib encoder, for reference
+                "json": lambda: json.dumps(rows, separators=(",", ":")).encode(),
+            }
+            if orjson is not None:
+                paths["orjson"] = lambda: orjson.dumps(rows)
+            for name, operation in paths.items():
+                results[f"{schema.__name__}:{name}@{size}"] = measure(
+                    operation, args.samples, size
+                )
+
+    for name, result in sorted(results.items()):
+        print(f"{name}: p50 {result['p50_us']} us/item, mean {result['mean_us']} us/item", flush=True)
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10, 100, 1000], help="items per list"
+    )
+    parser.add_argument(
+        "--details",
+        type=int,
+        default=5,
+        help="credentials per integration and platforms per user in the nested schemas",
+    )
+    parser.add_argument("--platforms", type=int, default=20)
+    add_output_arguments(parser, "serialization")
+    args = parser.parse_args()
+
+    results = run(args)
+    settings = {name: getattr(args, name) for name in ("samples", "sizes", "details", "platforms")}
+    return finish("serialization", args, settings, results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+Benchmarks how long a fresh worker takes to import the app, start it and serve its first request.
+
+Every sample is a new Python process, as in a rolling restart, against a seeded SQLite
+database. See benchmarks/README.md.
+"""
+from typing import Dict, List
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.report import add_output_arguments, finish, summarize  # noqa: E402
+
+# Runs in each worker process, prints the durations of its phases in seconds as JSON
+WORKER = """
+import time
+started = time.perf_counter()
+import asyncio, json
+import httpx
+ready = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+
+async def serve():
+    from app.auth.utils import create_access_token
+    from benchmarks.seed import ADMIN_USERNAME
+    from datetime import timedelta
+    headers = {"Authorization": "Bearer " + create_access_token({"sub": ADMIN_USERNAME}, timedelta(hours=1))}
+    transport = httpx.ASGITransport(app=app.main.app)
+    async with app.main.app.router.lifespan_context(app.main.app):
+        started_up = time.perf_counter()
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.get("/admin/users", headers=headers)
+            response.raise_for_status()
+        served = time.perf_counter()
+    return started_up, served
+
+started_up, served = asyncio.run(serve())
+print(json.dumps({
+    "import": imported - ready,
+    "startup": started_up - imported,
+    "first_request": served - started_up,
+    "ready": served - ready,
+}))
+"""
+
+PHASES = ("import", "startup", "first_request", "ready")
+
+
+def run_worker(env: dict) -> Dict[str, float]:
+    output = subprocess.run(
+        [sys.executable, "-c", WORKER],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(args, url: str) -> Dict[str, dict]:
+    results = {}
+    for create_schema in args.create_schema:
+        env = dict(
+            os.environ,
+            DATABASE_URL=url,
+            CREATE_SCHEMA_ON_STARTUP=create_schema,
+            QUERY_BUDGET_ENFORCE="false",
+            SLOW_REQUEST_SECONDS=os.getenv("SLOW_REQUEST_SECONDS", "3600"),
+            PYTHONPATH=ROOT,
+        )
+        env.setdefault("SECRET_KEY", "bench-secret")
+        env.setdefault("REFRESH_KEY", "bench-refresh")
+        # The first processes warm the file system cache and write the bytecode
+        for _ in range(args.warmup):
+            run_worker(env)
+        samples: Dict[str, List[float]] = {phase: [] for phase in PHASES}
+        wall = time.perf_counter()
+        for _ in range(args.runs):
+            for phase, seconds in run_worker(env).items():
+                samples[phase].append(seconds)
+        wall = time.perf_counter() - wall
+        for phase in PHASES:
+            name = f"{phase}@create_schema={create_schema}"
+            results[name] = summarize(samples[phase], wall)
+            print(
+                f"{name}: p50 {results[name]['p50_ms']} ms, p95 {results[name]['p95_ms']} ms",
+                flush=True,
+            )
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20, help="worker processes per setting")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument(
+        "--create-schema",
+        nargs="+",
+        choices=["true", "false"],
+        default=["true", "false"],
+        help="CREATE_SCHEMA_ON_STARTUP values to measure",
+    )
+    parser.add_argument(
+        "--database", help="SQLite file to seed, a temporary one is used by default"
+    )
+    add_output_arguments(parser, "startup")
+    args = parser.parse_args()
+
+    database = args.database or os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench.db")
+    url = f"sqlite:///{os.path.abspath(database)}"
+
+    from benchmarks.seed import seed_database
+
+    seed_database(url, args.users, 20, 3, 5)
+    results = run(args, url)
+
+    settings = {name: getattr(args, name) for name in ("runs", "users", "create_schema")}
+    settings["async_db"] = os.getenv("USE_ASYNC_DB", "false")
+    return finish("startup", args, settings, results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+Latency summaries, JSON results and baseline comparison shared by the benchmarks.
+"""
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import json
+import os
+import platform
+import subprocess
+import sys
+
+# Metrics compared against the baseline, and whether a higher value is better
+COMPARED_METRICS = {"throughput_rps": True, "p50_ms": False, "p95_ms": False}
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of already sorted values
+    """
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], wall_seconds: float, errors: int = 0) -> dict:
+    """
+    Throughput and latency percentiles (in milliseconds) of a run
+    """
+    values = sorted(latencies)
+    count = len(values)
+    return {
+        "requests": count,
+        "errors": errors,
+        "throughput_rps": round(count / wall_seconds, 2) if wall_seconds else 0.0,
+        "mean_ms": round(sum(values) / count * 1000, 3) if count else 0.0,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if count else 0.0,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> dict:
+    """
+    Describes where the benchmark ran, results are only comparable on the same machine
+    """
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def write_results(path: str, document: dict):
+    """
+    Writes a results document as JSON, creating its directory
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(document, file, indent=2, sort_keys=True)
+        file.write("\n")
+
+
+def load_results(path: str) -> Optional[dict]:
+    """
+    Reads a results document, None if it doesn't exist
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+    Returns a line per metric that got worse than the baseline by more than the tolerance
+    (a fraction, 0.25 is 25%)
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            current, previous = result.get(metric), reference.get(metric)
+            if not current or not previous:
+                continue
+            change = (current - previous) / previous
+            worse = -change if higher_is_better else change
+            if worse > tolerance:
+                regressions.append(
+                    f"{name} {metric}: {previous} -> {current} ({change:+.0%})"
+                )
+    return regressions
+
+
+def print_table(results: Dict[str, dict], baseline: Optional[Dict[str, dict]] = None):
+    """
+    Prints the results, with the change from the baseline when there is one
+    """
+    columns = ("requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+    print(f"{'benchmark':40}" + "".join(f"{column:>16}" for column in columns))
+    for name, result in sorted(results.items()):
+        cells = []
+        for column in columns:
+            cell = f"{result.get(column, '')}"
+            reference = (baseline or {}).get(name, {}).get(column)
+            if column in COMPARED_METRICS and reference:
+                cell += f" ({(result[column] - reference) / reference:+.0%})"
+            cells.append(f"{cell:>16}")
+        print(f"{name:40}" + "".join(cells))
+
+
+def finish(suite: str, args, settings: dict, results: Dict[str, dict]) -> int:
+    """
+    Writes the results, compares them with the baseline and returns the exit status,
+    1 when a metric regressed beyond the tolerance
+    """
+    document = {"suite": suite, "environment": environment(), "settings": settings, "results": results}
+    write_results(args.output, document)
+    baseline = load_results(args.baseline)
+    baseline_results = None
+    if baseline is not None and baseline.get("settings") == settings:
+        baseline_results = baseline["results"]
+    elif baseline is not None:
+        print(f"Baseline {args.baseline} was run with other settings, not comparing")
+    print_table(results, baseline_results)
+    print(f"\nResults written to {args.output}")
+
+    if args.save_baseline:
+        write_results(args.baseline, document)
+        print(f"Saved as the baseline {args.baseline}")
+        return 0
+    if baseline_results is None:
+        return 0
+    regressions = compare(results, baseline_results, args.tolerance)
+    if regressions:
+        print(f"\nRegressions beyond {args.tolerance:.0%} of {args.baseline}:")
+        for line in regressions:
+            print("  " + line)
+        return 1
+    print(f"\nNo regressions beyond {args.tolerance:.0%} of {args.baseline}")
+    return 0
+
+
+def add_output_arguments(parser, suite: str):
+    """
+    Adds the output and baseline options every benchmark takes
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser.add_argument(
+        "--output",
+        default=os.path.join(here, "results", f"{suite}.json"),
+        help="where to write the results",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=os.path.join(here, "baselines", f"{suite}.json"),
+        help="results to compare against",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="fraction a metric may get worse than the baseline before it is reported",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store these results as the new baseline instead of comparing",
+    )
@@ -0,0 +1,105 @@
+"""
+Seeds a database with a deterministic data set for the benchmarks.
+"""
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from sqlalchemy import create_engine, insert
+from app.database.models import (
+    Base,
+    CredentialDetail,
+    CredentialKey,
+    Platform,
+    User,
+    UserIntegration,
+    user_platform,
+)
+from app.auth.password import hash_password
+from app.database.encryption import credential_cipher, seal_value
+from app.database.stats import rebuild_statements
+
+BENCH_PASSWORD = "bench-password"
+ADMIN_USERNAME = "bench-admin"
+CHUNK = 5000
+
+
+def username(index: int) -> str:
+    return f"user{index}"
+
+
+def _insert(connection, table, rows: list):
+    for start in range(0, len(rows), CHUNK):
+        connection.execute(insert(table), rows[start : start + CHUNK])
+
+
+def seed_database(
+    url: str,
+    users: int,
+    platforms: int,
+    integrations_per_user: int,
+    credentials_per_integration: int,
+):
+    """
+    Creates the tables and fills them: one admin, `users` users integrated with
+    `integrations_per_user` platforms each, with `credentials_per_integration` credentials
+    per integration. Every user has the password BENCH_PASSWORD. Credential values are sealed
+    with a data key per platform when CREDENTIAL_MASTER_KEY is set
+    """
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    # One bcrypt hash shared by every user, hashing each password would take minutes
+    password = hash_password(BENCH_PASSWORD)
+    integrations_per_user = min(integrations_per_user, platforms)
+
+    user_rows = [{"id": 1, "username": ADMIN_USERNAME, "password": password, "is_admin": True}]
+    user_rows += [
+        {"id": index + 2, "username": username(index), "password": password, "is_admin": False}
+        for index in range(users)
+    ]
+    platform_rows = [
+        {"id": index + 1, "name": f"platform{index}", "description": f"Benchmark platform {index}"}
+        for index in range(platforms)
+    ]
+    key_rows, ciphers = [], {}
+    if credential_cipher.enabled:
+        for row in platform_rows:
+            key_row, data_key = credential_cipher.new_key(row["id"])
+            key_rows.append(dict(key_row, id=row["id"]))
+            ciphers[row["id"]] = AESGCM(data_key)
+
+    def value(user_id: int, platform_id: int, key: str, plaintext: str) -> str:
+        if not ciphers:
+            return plaintext
+        return seal_value(ciphers[platform_id], platform_id, user_id, platform_id, key, plaintext)
+
+    integration_rows, association_rows, credential_rows = [], [], []
+    for index in range(users):
+        user_id = index + 2
+        for offset in range(integrations_per_user):
+            platform_id = (index + offset) % platforms + 1
+            integration_id = len(integration_rows) + 1
+            integration_rows.append(
+                {"id": integration_id, "user_id": user_id, "platform_id": platform_id, "is_active": True}
+            )
+            association_rows.append({"user_id": user_id, "platform_id": platform_id})
+            credential_rows += [
+                {
+                    "user_id": user_id,
+                    "platform_id": platform_id,
+                    "integration_id": integration_id,
+                    "key": f"key{number}",
+                    "value": value(user_id, platform_id, f"key{number}", f"value{number}"),
+                }
+                for number in range(credentials_per_integration)
+            ]
+
+    with engine.begin() as connection:
+        _insert(connection, User, user_rows)
+        _insert(connection, Platform, platform_rows)
+        _insert(connection, CredentialKey, key_rows)
+        _insert(connection, UserIntegration, integration_rows)
+        _insert(connection, user_platform, association_rows)
+        _insert(connection, CredentialDetail, credential_rows)
+        # The rows bypass the services, so the platform statistics are counted from them
+        for statement in rebuild_statements():
+            connection.execute(statement)
+    engine.dispose()
@@ -0,0 +1,84 @@
+"""Deduplicate rows and add the indexes and unique constraints of the hot lookups
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Maps every user to the surviving user of its username, the one with the lowest id
+SURVIVING_USER = (
+    "(SELECT MIN(u2.id) FROM users u2 WHERE u2.username = "
+    "(SELECT u1.username FROM users u1 WHERE u1.id = {column}))"
+)
+SURVIVING_USERS = "(SELECT MIN(id) FROM users GROUP BY username)"
+SURVIVING_INTEGRATIONS = "(SELECT MIN(id) FROM user_integrations GROUP BY user_id, platform_id)"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 1. Merge users sharing a username into the oldest one, moving their rows over
+    for table in ("user_integrations", "credential_details"):
+        op.execute(
+            f"UPDATE {table} SET user_id = {SURVIVING_USER.format(column=table + '.user_id')} "
+            f"WHERE user_id NOT IN {SURVIVING_USERS}"
+        )
+    op.execute(
+        "INSERT INTO user_platform (user_id, platform_id) "
+        f"SELECT DISTINCT {SURVIVING_USER.format(column='up.user_id')}, up.platform_id "
+        f"FROM user_platform up WHERE up.user_id NOT IN {SURVIVING_USERS} "
+        "AND NOT EXISTS (SELECT 1 FROM user_platform kept WHERE kept.platform_id = up.platform_id "
+        f"AND kept.user_id = {SURVIVING_USER.format(column='up.user_id')})"
+    )
+    op.execute(f"DELETE FROM user_platform WHERE user_id NOT IN {SURVIVING_USERS}")
+    op.execute(f"DELETE FROM users WHERE id NOT IN {SURVIVING_USERS}")
+
+    # 2. Merge integrations of the same user and platform into the oldest one
+    op.execute(
+        "UPDATE credential_details SET integration_id = "
+        "(SELECT MIN(ui2.id) FROM user_integrations ui2 JOIN user_integrations ui1 "
+        "ON ui1.user_id = ui2.user_id AND ui1.platform_id = ui2.platform_id "
+        "WHERE ui1.id = credential_details.integration_id) "
+        f"WHERE integration_id NOT IN {SURVIVING_INTEGRATIONS}"
+    )
+    op.execute(f"DELETE FROM user_integrations WHERE id NOT IN {SURVIVING_INTEGRATIONS}")
+
+    # 3. Keep the latest value of a credential key per user and platform
+    op.execute(
+        "DELETE FROM credential_details WHERE id NOT IN "
+        "(SELECT MAX(id) FROM credential_details GROUP BY user_id, platform_id, key)"
+    )
+
+    op.create_index("ix_users_username", "users", ["username"], unique=True)
+    with op.batch_alter_table("user_integrations") as batch_op:
+        batch_op.create_unique_constraint(
+            "uq_user_integrations_user_platform", ["user_id", "platform_id"]
+        )
+    with op.batch_alter_table("credential_details") as batch_op:
+        batch_op.create_unique_constraint(
+            "uq_credential_details_user_platform_key", ["user_id", "platform_id", "key"]
+        )
+    op.create_index(
+        "ix_credential_details_integration_id", "credential_details", ["integration_id"]
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # The merged duplicates are not restored
+    op.drop_index("ix_credential_details_integration_id", table_name="credential_details")
+    with op.batch_alter_table("credential_details") as batch_op:
+        batch_op.drop_constraint("uq_credential_details_user_platform_key", type_="unique")
+    with op.batch_alter_table("user_integrations") as batch_op:
+        batch_op.drop_constraint("uq_user_integrations_user_platform", type_="unique")
+    op.drop_index("ix_users_username", table_name="users")
@@ -0,0 +1,37 @@
+"""Add users.token_version for the access token claims
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, Sequence[str], None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.add_column(
+            sa.Column("token_version", sa.Integer(), server_default="0", nullable=False)
+        )
+    resource_versions = sa.table(
+        "resource_versions", sa.column("name", sa.String), sa.column("version", sa.Integer)
+    )
+    op.bulk_insert(resource_versions, [{"name": "users", "version": 1}])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DELETE FROM resource_versions WHERE name = 'users'")
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("token_version")
@@ -0,0 +1,52 @@
+"""Add the credential_keys table holding the wrapped data keys of the credential values
+
+Existing credential values stay in plaintext, run the key rotation job
+(POST /admin/credentials/rotate-keys) once CREDENTIAL_MASTER_KEY is set to seal them.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0007"
+down_revision: Union[str, Sequence[str], None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "credential_keys",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("platform_id", sa.Integer(), nullable=False),
+        sa.Column("master_key_id", sa.String(), nullable=False),
+        sa.Column("wrapped_key", sa.String(), nullable=False),
+        sa.Column("created_at", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(["platform_id"], ["platforms.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_credential_keys_platform_id"),
+        "credential_keys",
+        ["platform_id"],
+        unique=False,
+    )
+    resource_versions = sa.table(
+        "resource_versions", sa.column("name", sa.String), sa.column("version", sa.Integer)
+    )
+    op.bulk_insert(resource_versions, [{"name": "credential_keys", "version": 1}])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DELETE FROM resource_versions WHERE name = 'credential_keys'")
+    op.drop_index(op.f("ix_credential_keys_platform_id"), table_name="credential_keys")
+    op.drop_table("credential_keys")
@@ -0,0 +1,48 @@
+"""Add the platform_stats table counting the integrations and credentials of each platform
+
+The counters start from the current tables and are kept up to date by the writes from then on.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0008"
+down_revision: Union[str, Sequence[str], None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "platform_stats",
+        sa.Column("platform_id", sa.Integer(), nullable=False),
+        sa.Column("integrations", sa.Integer(), nullable=False),
+        sa.Column("active_integrations", sa.Integer(), nullable=False),
+        sa.Column("credentials", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["platform_id"], ["platforms.id"]),
+        sa.PrimaryKeyConstraint("platform_id"),
+    )
+    op.execute(
+        "INSERT INTO platform_stats (platform_id, integrations, active_integrations, credentials) "
+        "SELECT platforms.id, COALESCE(i.integrations, 0), COALESCE(i.active_integrations, 0), "
+        "COALESCE(c.credentials, 0) FROM platforms "
+        "LEFT OUTER JOIN (SELECT platform_id, count(*) AS integrations, "
+        "sum(CASE WHEN is_active THEN 1 ELSE 0 END) AS active_integrations "
+        "FROM user_integrations GROUP BY platform_id) AS i ON i.platform_id = platforms.id "
+        "LEFT OUTER JOIN (SELECT platform_id, count(*) AS credentials "
+        "FROM credential_details GROUP BY platform_id) AS c ON c.platform_id = platforms.id"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("platform_stats")
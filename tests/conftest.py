@@ -0,0 +1,138 @@
+"""
+Runs the app in-process against a fresh SQLite database, with the query budgets enforced so
+every request of the suite fails when it runs more SQL statements than its endpoint declares.
+Run it from the repository root:
+
+    python -m pytest tests
+
+Set USE_ASYNC_DB=true to run it against the async database layer.
+"""
+from itertools import count
+import os
+import tempfile
+
+# Read when the app is imported, so they are set before any test module imports it
+_directory = tempfile.mkdtemp(prefix="app-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_directory, 'test.db')}"
+os.environ["ASYNC_DATABASE_URL"] = ""
+os.environ["REPLICA_DATABASE_URLS"] = ""
+os.environ["QUERY_BUDGET_ENFORCE"] = "true"
+os.environ["SECRET_KEY"] = "test-secret-key"
+os.environ["REFRESH_KEY"] = "test-refresh-key"
+os.environ["CREDENTIAL_MASTER_KEY"] = "dGVzdC1jcmVkZW50aWFsLW1hc3Rlci1rZXktMDAwMDA="
+os.environ["CREDENTIAL_PREVIOUS_MASTER_KEYS"] = ""
+os.environ["TRUSTED_PROXIES"] = ""
+# One above the lowest bcrypt cost keeps the logins fast and leaves a lower cost to rehash, the
+# hashing pool workers read it too
+os.environ["PASSWORD_SCHEMES"] = "bcrypt"
+os.environ["PASSWORD_BCRYPT_ROUNDS"] = "5"
+# Every request of the suite comes from the same address
+os.environ["LOGIN_IP_BURST"] = "0"
+os.environ["LOGIN_RATE_LIMIT_REDIS_URL"] = ""
+
+from fastapi.testclient import TestClient  # noqa: E402
+import pytest  # noqa: E402
+
+from app.main import app  # noqa: E402
+
+_names = count(1)
+
+
+def unique(prefix: str) -> str:
+    """
+    Returns a name no other test uses, the tests share one database
+    """
+    return f"{prefix}{next(_names)}"
+
+
+def login(client: TestClient, username: str, password: str = "password") -> dict:
+    """
+    Logs a user in and returns its access and refresh tokens
+    """
+    response = client.post("/login", data={"username": username, "password": password})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def bearer(tokens: dict) -> dict:
+    return {"Authorization": "Bearer " + tokens["Access Token"]}
+
+
+def integrate(client, account, platform_id: int, is_active: bool, credentials: dict) -> dict:
+    """
+    Integrates an account with a platform with the given credential keys and values
+    """
+    response = client.post(
+        "/users/integrate",
+        headers=account.headers,
+        json={
+            "integration_data": {"platform_id": platform_id, "is_active": is_active},
+            "credentials": [
+                {"platform_id": platform_id, "key": key, "value": value}
+                for key, value in credentials.items()
+            ],
+        },
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def details(client, account, platform_id: int) -> dict:
+    """
+    Returns the credential keys and values of an account on a platform, as the API reads them
+    """
+    integrations = client.get("/users/me/user_integrations", headers=account.headers).json()
+    (integration,) = [row for row in integrations if row["platform"]["id"] == platform_id]
+    return {detail["key"]: detail["value"] for detail in integration["details"]}
+
+
+def platform_stats(client, admin, platform_id: int, live: bool = False) -> dict:
+    """
+    Returns the statistics of a platform, from the counters or counted live
+    """
+    stats = client.get(f"/admin/stats?live={str(live).lower()}", headers=admin.headers).json()
+    return next((row for row in stats["platforms"] if row["platform_id"] == platform_id), None)
+
+
+class Account:
+    """
+    A registered user with its id and the headers of a logged in session
+    """
+
+    def __init__(self, client: TestClient, is_admin: bool = False):
+        self.username = unique("admin" if is_admin else "user")
+        response = client.post(
+            "/register",
+            json={"username": self.username, "password": "password", "is_admin": is_admin},
+        )
+        assert response.status_code == 200, response.text
+        self.id = response.json()["id"]
+        self.tokens = login(client, self.username)
+        self.headers = bearer(self.tokens)
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def admin(client) -> Account:
+    return Account(client, is_admin=True)
+
+
+@pytest.fixture
+def user(client) -> Account:
+    return Account(client)
+
+
+@pytest.fixture
+def platform(client, admin) -> dict:
+    response = client.post(
+        "/admin/platform/",
+        headers=admin.headers,
+        json={"name": unique("platform"), "description": "test platform"},
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
@@ -0,0 +1,25 @@
+from jose import jwt
+
+from app.auth.utils import ALGORITHM, SECRET_KEY
+from conftest import bearer, login
+
+
+def test_access_tokens_carry_the_user_claims(client, user):
+    claims = jwt.decode(user.tokens["Access Token"], SECRET_KEY, algorithms=[ALGORITHM])
+    assert (claims["sub"], claims["uid"], claims["adm"], claims["ver"]) == (user.username, user.id, False, 0)
+
+
+def test_forged_claims_are_rejected(client, user):
+    claims = jwt.decode(user.tokens["Access Token"], SECRET_KEY, algorithms=[ALGORITHM])
+    forged = jwt.encode({**claims, "adm": True}, "another-key", algorithm=ALGORITHM)
+    assert client.get("/admin/users", headers={"Authorization": "Bearer " + forged}).status_code == 401
+
+
+def test_removing_admin_stops_the_old_tokens_at_once(client, admin, user):
+    granted = client.put(f"/admin/users/{user.id}/admin", headers=admin.headers, json={"is_admin": True})
+    assert granted.status_code == 200 and granted.json()["is_admin"] is True
+    promoted = login(client, user.username)
+    assert client.get("/admin/users", headers=bearer(promoted)).status_code == 200
+    client.put(f"/admin/users/{user.id}/admin", headers=admin.headers, json={"is_admin": False})
+    assert client.get("/admin/users", headers=bearer(promoted)).status_code == 401
+    assert client.get("/users/me", headers=bearer(promoted)).status_code == 200
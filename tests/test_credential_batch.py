@@ -0,0 +1,64 @@
+import gzip
+import json
+
+from app.database.schemas import CREDENTIAL_BATCH_MAX_PAIRS
+from conftest import integrate
+
+
+def batch(client, admin, body: dict, **params) -> list:
+    response = client.post("/admin/credentials/batch", headers=admin.headers, json=body, params=params)
+    assert response.status_code == 200, response.text
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_batch_has_a_line_per_integrated_pair(client, admin, user, platform):
+    integration = integrate(client, user, platform["id"], True, {"token": "one", "secret": "s"})
+    other_platform = client.post(
+        "/admin/platform/", headers=admin.headers, json={"name": platform["name"] + "-d"}
+    ).json()
+    bare = integrate(client, user, other_platform["id"], False, {})
+    unknown = client.post(
+        "/admin/platform/", headers=admin.headers, json={"name": platform["name"] + "-e"}
+    ).json()
+    pairs = [
+        {"user_id": user.id, "platform_id": platform_id}
+        for platform_id in (platform["id"], other_platform["id"], unknown["id"])
+    ]
+    lines = batch(client, admin, {"pairs": pairs})
+    assert [(line["platform_id"], line["integration_id"]) for line in lines] == [
+        (platform["id"], integration["id"]),
+        (other_platform["id"], bare["id"]),
+    ]
+    assert {detail["key"]: detail["value"] for detail in lines[0]["credentials"]} == {
+        "token": "one",
+        "secret": "s",
+    }
+    # An integration without credentials is listed too
+    assert lines[1]["credentials"] == [] and lines[1]["is_active"] is False
+    # The filters narrow the credentials, the pair stays when none match
+    narrowed = batch(client, admin, {"platform_id": platform["id"], "user_ids": [user.id]}, key="token")
+    assert [detail["key"] for detail in narrowed[0]["credentials"]] == ["token"]
+    missing = batch(client, admin, {"platform_id": platform["id"], "user_ids": [user.id]}, key="none")
+    assert missing[0]["credentials"] == []
+
+
+def test_batch_is_gzipped_if_asked_to(client, admin, user, platform):
+    integrate(client, user, platform["id"], True, {"token": "one"})
+    body = {"pairs": [{"user_id": user.id, "platform_id": platform["id"]}]}
+    with client.stream(
+        "POST", "/admin/credentials/batch", headers=admin.headers, json=body, params={"gzip": "true"}
+    ) as response:
+        raw = b"".join(response.iter_raw())
+    (line,) = gzip.decompress(raw).decode().splitlines()
+    assert json.loads(line)["credentials"][0]["value"] == "one"
+
+
+def test_batch_over_the_cap_is_rejected_by_validation(client, admin):
+    user_ids = list(range(1, CREDENTIAL_BATCH_MAX_PAIRS + 2))
+    response = client.post(
+        "/admin/credentials/batch",
+        headers=admin.headers,
+        json={"platform_id": 1, "user_ids": user_ids},
+    )
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", "user_ids"]
@@ -0,0 +1,88 @@
+from sqlalchemy import select, update
+import pytest
+
+from app.database.connection import session_local
+from app.database.encryption import MasterKeys, credential_cipher, sealed_key_id
+from app.database.models import CredentialDetail, CredentialKey
+from app.service.admins.post.credential_key_post import CredentialKeyPostService
+from conftest import details, integrate
+
+MASTER_KEY = "dGVzdC1jcmVkZW50aWFsLW1hc3Rlci1rZXktMDAwMDA="
+NEW_MASTER_KEY = "dGVzdC1jcmVkZW50aWFsLW1hc3Rlci1rZXktMTExMTE="
+
+
+def stored_values(user_id: int) -> dict:
+    with session_local() as db:
+        rows = db.execute(
+            select(CredentialDetail.key, CredentialDetail.value).where(CredentialDetail.user_id == user_id)
+        )
+        return dict(rows.all())
+
+
+def rotate(client, admin, **params):
+    response = client.post("/admin/credentials/rotate-keys", headers=admin.headers, params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_values_are_stored_sealed_and_read_in_plaintext(client, user, platform):
+    integrate(client, user, platform["id"], True, {"token": "secret-token"})
+    (stored,) = stored_values(user.id).values()
+    assert stored.startswith("enc1:")
+    assert "secret-token" not in stored
+    assert details(client, user, platform["id"]) == {"token": "secret-token"}
+
+
+def test_rotation_seals_values_with_the_new_data_key(client, admin, user, platform):
+    integrate(client, user, platform["id"], True, {"a": "1", "b": "2"})
+    # A value written before encryption was enabled is sealed by the rotation too
+    with session_local() as db:
+        db.execute(
+            update(CredentialDetail)
+            .where(CredentialDetail.user_id == user.id, CredentialDetail.key == "b")
+            .values(value="2")
+        )
+        db.commit()
+    old_key_id = sealed_key_id(stored_values(user.id)["a"])
+    result = rotate(client, admin, new_data_keys="true", platform_id=platform["id"])
+    assert result["keys_created"] == 1
+    assert result["resealed"] == 2
+    key_ids = {sealed_key_id(value) for value in stored_values(user.id).values()}
+    assert len(key_ids) == 1 and old_key_id not in key_ids and None not in key_ids
+    assert details(client, user, platform["id"]) == {"a": "1", "b": "2"}
+    # Every value is current, running it again seals nothing
+    again = rotate(client, admin, new_data_keys="false", platform_id=platform["id"])
+    assert again["resealed"] == 0
+
+
+@pytest.fixture
+def new_master_key():
+    """
+    Switches to a new master key with the old one as previous, then wraps every data key with
+    the old one again for the tests that follow
+    """
+    configured = credential_cipher.master_keys
+    credential_cipher.master_keys = MasterKeys(NEW_MASTER_KEY, [MASTER_KEY])
+    credential_cipher.invalidate()
+    yield credential_cipher.master_keys
+    credential_cipher.master_keys = MasterKeys(MASTER_KEY, [NEW_MASTER_KEY])
+    with session_local() as db:
+        CredentialKeyPostService(db).rotate_keys(new_data_keys=False)
+    credential_cipher.master_keys = configured
+    credential_cipher.invalidate()
+
+
+def test_master_key_rotation_rewraps_the_data_keys(client, admin, user, platform, new_master_key):
+    integrate(client, user, platform["id"], True, {"token": "secret-token"})
+    stored = stored_values(user.id)
+    result = rotate(client, admin, new_data_keys="false")
+    assert result["keys_rewrapped"] >= 1
+    assert result["resealed"] == 0
+    # The values are untouched, only their data keys are wrapped again
+    assert stored_values(user.id) == stored
+    without_old_key = MasterKeys(NEW_MASTER_KEY, [])
+    with session_local() as db:
+        for key in db.scalars(select(CredentialKey)):
+            assert key.master_key_id == new_master_key.current_id
+            without_old_key.unwrap(key.platform_id, key.master_key_id, key.wrapped_key)
+    assert details(client, user, platform["id"]) == {"token": "secret-token"}
@@ -0,0 +1,53 @@
+import pytest
+
+
+def get(client, path: str, headers: dict, etag=None):
+    if etag is not None:
+        headers = {**headers, "If-None-Match": etag}
+    return client.get(path, headers=headers)
+
+
+@pytest.mark.parametrize("path", ["/users/me", "/users/me/platforms", "/users/me/user_integrations"])
+def test_matching_etag_gets_a_304(client, user, path):
+    response = get(client, path, user.headers)
+    etag = response.headers["etag"]
+    not_modified = get(client, path, user.headers, etag)
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == etag
+    assert get(client, path, user.headers, '"stale"').status_code == 200
+
+
+def test_etag_changes_with_the_data_of_the_user(client, admin, user, platform):
+    path = "/users/me/user_integrations"
+    etag = get(client, path, user.headers).headers["etag"]
+    client.post(
+        "/users/integrate",
+        headers=user.headers,
+        json={"integration_data": {"platform_id": platform["id"], "is_active": True}, "credentials": []},
+    )
+    changed = get(client, path, user.headers, etag)
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    etag = changed.headers["etag"]
+    # A write by an admin for the user changes it too
+    client.post(
+        "/admin/credential/",
+        headers=admin.headers,
+        json={"user_id": user.id, "platform_id": platform["id"], "key": "k", "value": "v"},
+    )
+    assert get(client, path, user.headers, etag).status_code == 200
+
+
+def test_etag_is_per_user(client, admin, user):
+    etag = get(client, "/users/me", user.headers).headers["etag"]
+    assert get(client, "/users/me", admin.headers, etag).status_code == 200
+
+
+def test_platform_etag(client, admin, platform):
+    path = f"/admin/platforms/{platform['id']}"
+    etag = get(client, path, admin.headers).headers["etag"]
+    assert get(client, path, admin.headers, etag).status_code == 304
+    # Another platform leaves this one's ETag valid
+    client.post("/admin/platform/", headers=admin.headers, json={"name": platform["name"] + "-other"})
+    assert get(client, path, admin.headers, etag).status_code == 304
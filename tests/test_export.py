@@ -0,0 +1,37 @@
+import gzip
+import json
+
+from conftest import integrate
+
+
+def export(client, admin, kind: str, **params) -> list:
+    response = client.get(f"/admin/export/{kind}", headers=admin.headers, params=params)
+    assert response.status_code == 200, response.text
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+
+def test_export_streams_every_row_and_the_filtered_rows(client, admin, user, platform):
+    integrate(client, user, platform["id"], True, {"a": "secret-a", "b": "secret-b"})
+    users = export(client, admin, "users")
+    assert user.id in {row["id"] for row in users}
+    assert set(users[0]) == {"id", "username", "is_admin"}
+    credentials = export(client, admin, "credentials", platform_id=platform["id"])
+    assert sorted(row["key"] for row in credentials) == ["a", "b"]
+    # The values never leave the database
+    assert all("value" not in row for row in credentials)
+    assert "secret" not in json.dumps(credentials)
+    integrations = export(client, admin, "integrations")
+    assert {"user_id": user.id, "platform_id": platform["id"], "is_active": True}.items() <= next(
+        row for row in integrations if row["user_id"] == user.id
+    ).items()
+
+
+def test_gzip_export(client, admin):
+    plain = client.get("/admin/export/users", headers=admin.headers).text
+    with client.stream(
+        "GET", "/admin/export/users", headers=admin.headers, params={"gzip": "true"}
+    ) as response:
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        compressed = b"".join(response.iter_raw())
+    assert gzip.decompress(compressed).decode() == plain
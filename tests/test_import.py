@@ -0,0 +1,76 @@
+import json
+
+from conftest import Account, details, login, unique
+
+NDJSON = {"Content-Type": "application/x-ndjson"}
+CSV = {"Content-Type": "text/csv"}
+
+
+def upload(client, admin, kind: str, body: str, headers: dict) -> dict:
+    response = client.post(
+        f"/admin/import/{kind}", headers={**admin.headers, **headers}, content=body.encode()
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_import_reports_the_failing_lines_and_imports_the_rest(client, admin):
+    taken = Account(client)
+    first, second = unique("imported"), unique("imported")
+    body = "\n".join(
+        [
+            json.dumps({"username": first, "password": "password"}),
+            "{not json",
+            json.dumps({"username": taken.username, "password": "password"}),
+            json.dumps({"username": second}),
+            json.dumps({"username": second, "password": "password", "is_admin": True}),
+        ]
+    )
+    result = upload(client, admin, "users", body, NDJSON)
+    assert (result["kind"], result["received"], result["imported"], result["failed"]) == ("users", 5, 2, 3)
+    assert [error["line"] for error in result["errors"]] == [2, 3, 4]
+    assert result["errors"][1]["detail"] == "username already taken"
+    assert result["errors_truncated"] is False
+    # Imported users log in with their password
+    login(client, first)
+    users = client.get("/admin/users", headers=admin.headers, params={"username__ilike": second}).json()
+    assert [(row["username"], row["is_admin"]) for row in users] == [(second, True)]
+
+
+def test_csv_import_of_integrations_and_credentials(client, admin, user, platform):
+    integrations = (
+        "username,platform_name,is_active\n"
+        f"{user.username},{platform['name']},false\n"
+        f"{user.username},{platform['name']},true\n"
+        f"missing-user,{platform['name']},true\n"
+        f"{user.username},{platform['name']}\n"
+    )
+    result = upload(client, admin, "integrations", integrations, CSV)
+    assert (result["received"], result["imported"], result["failed"]) == (4, 1, 3)
+    assert [error["line"] for error in result["errors"]] == [3, 4, 5]
+    assert result["errors"][1]["detail"] == "User not found"
+
+    credentials = (
+        "user_id,platform_id,key,value\n"
+        f"{user.id},{platform['id']},token,abc\n"
+        f"{user.id},{platform['id']},token,again\n"
+        f"{admin.id},{platform['id']},token,abc\n"
+    )
+    result = upload(client, admin, "credentials", credentials, CSV)
+    assert (result["imported"], result["failed"]) == (1, 2)
+    assert {error["detail"] for error in result["errors"]} == {
+        "Credential already exists",
+        "User is not integrated with this platform",
+    }
+    # Imported values are sealed like the written ones and read back in plaintext
+    assert details(client, user, platform["id"]) == {"token": "abc"}
+    stats = client.get("/admin/stats", headers=admin.headers).json()
+    live = client.get("/admin/stats?live=true", headers=admin.headers).json()
+    assert stats == live
+
+
+def test_import_needs_ndjson_or_csv(client, admin):
+    response = client.post(
+        "/admin/import/users", headers={**admin.headers, "Content-Type": "text/plain"}, content=b"x"
+    )
+    assert response.status_code == 415
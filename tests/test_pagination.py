@@ -0,0 +1,51 @@
+from conftest import Account
+
+
+def collect(client, headers, path: str) -> list:
+    """
+    Follows the X-Next-Cursor of a list endpoint and returns the rows of every page
+    """
+    rows, cursor = [], None
+    while True:
+        separator = "&" if "?" in path else "?"
+        response = client.get(
+            path + (f"{separator}cursor={cursor}" if cursor else ""), headers=headers
+        )
+        assert response.status_code == 200, response.text
+        rows += response.json()
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            return rows
+
+
+def test_pages_cover_every_user_once(client, admin):
+    for _ in range(7):
+        Account(client)
+    everything = client.get("/admin/users?limit=100", headers=admin.headers).json()
+    for ordering in ("", "&order_by=-username", "&order_by=is_admin,-username"):
+        rows = collect(client, admin.headers, "/admin/users?limit=3" + ordering)
+        ids = [row["id"] for row in rows]
+        assert len(ids) == len(set(ids))
+        assert sorted(ids) == sorted(row["id"] for row in everything)
+    descending = collect(client, admin.headers, "/admin/users?limit=3&order_by=-username")
+    names = [row["username"] for row in descending]
+    assert names == sorted(names, reverse=True)
+
+
+def test_last_page_has_no_cursor(client, admin):
+    response = client.get("/admin/users?limit=100", headers=admin.headers)
+    assert "x-next-cursor" not in response.headers
+
+
+def test_invalid_cursor_is_rejected(client, admin):
+    assert client.get("/admin/users?cursor=zzz", headers=admin.headers).status_code == 400
+
+
+def test_cursor_of_another_ordering_is_rejected(client, admin):
+    Account(client)
+    Account(client)
+    cursor = client.get("/admin/users?limit=1", headers=admin.headers).headers["x-next-cursor"]
+    response = client.get(
+        f"/admin/users?limit=1&order_by=-username&cursor={cursor}", headers=admin.headers
+    )
+    assert response.status_code == 400
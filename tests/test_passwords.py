@@ -0,0 +1,83 @@
+from fastapi import HTTPException
+from sqlalchemy import select, update
+import asyncio
+import os
+import pytest
+
+from app.auth.password import PasswordHasher, build_context, hash_password
+from app.database.connection import session_local
+from app.database.models import User
+from conftest import Account, login
+
+
+@pytest.fixture(scope="module")
+def hasher():
+    # One worker and one call in flight, so a second concurrent call is over the queue depth
+    password_hasher = PasswordHasher(1, 1)
+    yield password_hasher
+    password_hasher.shutdown()
+
+
+def test_only_weaker_bcrypt_hashes_need_an_update():
+    context = build_context(["bcrypt"], bcrypt_rounds=5)
+    assert not context.needs_update(context.hash("password"))
+    assert context.needs_update(build_context(["bcrypt"], bcrypt_rounds=4).hash("password"))
+    # Lowering the setting keeps the stronger hashes
+    assert not context.needs_update(build_context(["bcrypt"], bcrypt_rounds=6).hash("password"))
+
+
+def test_calls_over_the_queue_depth_get_a_503(hasher):
+    async def hash_twice():
+        return await asyncio.gather(
+            hasher.hash("password"), hasher.hash("password"), return_exceptions=True
+        )
+
+    rejected = hasher.rejected
+    hashed, refused = asyncio.run(hash_twice())
+    assert hashed.startswith("$2b$05$")
+    assert isinstance(refused, HTTPException) and refused.status_code == 503
+    assert refused.headers["Retry-After"] == "1"
+    assert hasher.rejected == rejected + 1
+    assert hasher.stats()["pending"] == 0
+
+
+def test_a_broken_pool_is_replaced(hasher):
+    asyncio.run(hasher.hash("password"))
+    # The worker exits without an answer, as when it is killed
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(hasher._submit(os._exit, 1))
+    assert exc_info.value.status_code == 503
+    assert asyncio.run(hasher.verify("password", hash_password("password")))
+    assert hasher.stats()["pending"] == 0
+
+
+def test_unknown_usernames_cost_a_verification_of_the_same_cost(hasher):
+    hash_time = hasher.hash_time.snapshot()["count"]
+    assert asyncio.run(hasher.verify_dummy("password")) is False
+    # The dummy hash is made once, then each call verifies against it
+    assert hasher.hash_time.snapshot()["count"] == hash_time + 2
+    assert asyncio.run(hasher.verify_dummy("dummy-password-of-unknown-users")) is False
+    assert hasher.hash_time.snapshot()["count"] == hash_time + 3
+    assert hasher._dummy_hash[:7] == hash_password("password")[:7]
+
+
+def test_unknown_usernames_fail_like_wrong_passwords(client):
+    response = client.post("/login", data={"username": "nobody-at-all", "password": "password"})
+    assert response.status_code == 401
+    account = Account(client)
+    wrong = client.post("/login", data={"username": account.username, "password": "wrong"})
+    assert wrong.json() == response.json()
+
+
+def test_login_rehashes_a_hash_of_a_lower_cost(client):
+    account = Account(client)
+    weaker = build_context(["bcrypt"], bcrypt_rounds=4).hash("password")
+    with session_local() as db:
+        db.execute(update(User).where(User.id == account.id).values(password=weaker))
+        db.commit()
+    # The rehash runs as a background task of the login, the test client waits for it
+    login(client, account.username)
+    with session_local() as db:
+        rehashed = db.scalar(select(User.password).where(User.id == account.id))
+    assert rehashed != weaker and rehashed.startswith("$2b$05$")
+    login(client, account.username)
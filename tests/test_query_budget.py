@@ -0,0 +1,73 @@
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+import pytest
+
+from app.database.connection import session_local
+from app.database.query_budget import (
+    QueryBudgetExceeded,
+    QueryBudgetRoute,
+    query_budget,
+    uncounted,
+)
+
+
+def budget_app() -> FastAPI:
+    router = APIRouter(route_class=QueryBudgetRoute)
+
+    @router.get("/two")
+    @query_budget(1)
+    def run_two():
+        with session_local() as db:
+            db.execute(text("SELECT 1"))
+            db.execute(text("SELECT 2"))
+        return {}
+
+    @router.get("/shared")
+    @query_budget(1)
+    def run_one_and_shared():
+        with session_local() as db:
+            db.execute(text("SELECT 1"))
+            with uncounted():
+                db.execute(text("SELECT 2"))
+        return {}
+
+    app = FastAPI()
+    app.include_router(router)
+    return app
+
+
+def test_request_over_its_budget_fails():
+    with pytest.raises(QueryBudgetExceeded, match="ran 2 SQL statements, its budget is 1"):
+        TestClient(budget_app()).get("/two")
+
+
+def test_uncounted_statements_are_left_out_of_the_budget():
+    assert TestClient(budget_app()).get("/shared").status_code == 200
+
+
+def test_endpoints_run_within_their_budgets(client, admin, user, platform):
+    # Every request of the suite is checked, this one walks the main read and write paths
+    integrate = client.post(
+        "/users/integrate",
+        headers=user.headers,
+        json={
+            "integration_data": {"platform_id": platform["id"], "is_active": True},
+            "credentials": [{"platform_id": platform["id"], "key": "token", "value": "abc"}],
+        },
+    )
+    assert integrate.status_code == 200, integrate.text
+    for path in ("/users/me", "/users/me/platforms", "/users/me/user_integrations"):
+        assert client.get(path, headers=user.headers).status_code == 200
+    for path in (
+        "/admin/users",
+        f"/admin/users/{user.id}",
+        f"/admin/users/{user.id}/platforms",
+        f"/admin/platforms/{platform['id']}",
+        f"/admin/users/{user.id}/{platform['id']}/credentials",
+        "/admin/search/users?q=user",
+        "/admin/search/platforms?q=platform",
+        "/admin/stats",
+        "/admin/stats?live=true",
+    ):
+        assert client.get(path, headers=admin.headers).status_code == 200, path
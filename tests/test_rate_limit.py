@@ -0,0 +1,111 @@
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+import asyncio
+import ipaddress
+import pytest
+
+from app.auth.rate_limit import (
+    BucketLimit,
+    LoginRateLimiter,
+    MemoryRateLimitBackend,
+    RateLimitBackend,
+    client_address,
+    login_rate_limiter,
+)
+from app.config import settings
+from app.main import app
+from conftest import Account
+
+
+def limiter(burst: int = 3, user_burst: int = 0) -> LoginRateLimiter:
+    return LoginRateLimiter(
+        MemoryRateLimitBackend(60, 1000),
+        [
+            BucketLimit("ip", 0, 60),
+            BucketLimit("username", burst, 0.001, failures_only=True),
+            BucketLimit("user", user_burst, 0.001, failures_only=True),
+        ],
+    )
+
+
+def allowed(rate_limiter: LoginRateLimiter, client_ip: str, username: str) -> bool:
+    try:
+        asyncio.run(rate_limiter.check(client_ip, username))
+    except HTTPException as exc:
+        assert exc.status_code == 429
+        assert int(exc.headers["Retry-After"]) > 0
+        return False
+    return True
+
+
+def test_only_failed_logins_take_from_the_username_bucket():
+    rate_limiter = limiter()
+    for _ in range(10):
+        assert allowed(rate_limiter, "10.0.0.1", "alice")
+    for _ in range(3):
+        asyncio.run(rate_limiter.failed("10.0.0.1", "alice"))
+    assert not allowed(rate_limiter, "10.0.0.1", "alice")
+
+
+def test_failures_from_one_address_leave_the_others_alone():
+    rate_limiter = limiter()
+    for _ in range(3):
+        asyncio.run(rate_limiter.failed("10.0.0.1", "alice"))
+    assert not allowed(rate_limiter, "10.0.0.1", "alice")
+    assert allowed(rate_limiter, "10.0.0.2", "alice")
+    assert allowed(rate_limiter, "10.0.0.1", "bob")
+
+
+def test_failures_from_many_addresses_run_out_of_the_username_bucket():
+    rate_limiter = limiter(user_burst=6)
+    for address in range(6):
+        asyncio.run(rate_limiter.failed(f"10.0.1.{address}", "alice"))
+    assert not allowed(rate_limiter, "10.0.2.1", "alice")
+    assert allowed(rate_limiter, "10.0.2.1", "bob")
+
+
+def test_limits_need_a_refill_rate_and_backends_a_take():
+    with pytest.raises(ValueError):
+        BucketLimit("username", 3, 0)
+    BucketLimit("username", 0, 0)
+    with pytest.raises(TypeError):
+        RateLimitBackend()
+
+
+def request(peer: str, forwarded: str = None) -> Request:
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "client": (peer, 1234), "headers": headers})
+
+
+def test_client_address_trusts_only_the_configured_proxies(monkeypatch):
+    assert client_address(request("10.0.0.5", "1.2.3.4")) == "10.0.0.5"
+    monkeypatch.setattr(settings, "trusted_proxies", [ipaddress.ip_network("10.0.0.0/8")])
+    assert client_address(request("10.0.0.5")) == "10.0.0.5"
+    assert client_address(request("10.0.0.5", "1.2.3.4")) == "1.2.3.4"
+    # The client prepends what it likes, the last untrusted hop is the address the proxy saw
+    assert client_address(request("10.0.0.5", "6.6.6.6, 1.2.3.4, 10.0.0.7")) == "1.2.3.4"
+    assert client_address(request("192.168.0.1", "1.2.3.4")) == "192.168.0.1"
+
+
+@pytest.fixture
+def username_limit(monkeypatch):
+    (limit,) = [limit for limit in login_rate_limiter.limits if limit.name == "username"]
+    monkeypatch.setattr(limit, "burst", 3)
+    return limit
+
+
+def test_failed_logins_lock_out_the_username_from_that_address(client, username_limit):
+    account = Account(client)
+    guesses = {"username": account.username, "password": "wrong"}
+    for _ in range(2):
+        assert client.post("/login", data=guesses).status_code == 401
+    # A correct password isn't counted
+    assert client.post("/login", data={**guesses, "password": "password"}).status_code == 200
+    assert client.post("/login", data=guesses).status_code == 401
+    locked = client.post("/login", data={**guesses, "password": "password"})
+    assert locked.status_code == 429
+    assert "retry-after" in locked.headers
+    # The user logs in from elsewhere
+    elsewhere = TestClient(app, client=("10.0.0.9", 1234))
+    assert elsewhere.post("/login", data={**guesses, "password": "password"}).status_code == 200
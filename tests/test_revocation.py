@@ -0,0 +1,49 @@
+from conftest import bearer, login
+
+
+def refresh(client, tokens: dict):
+    return client.post("/refresh", json={"refresh_token": tokens["Refresh Token"]})
+
+
+def test_refresh_rotates_the_tokens(client, user):
+    response = refresh(client, user.tokens)
+    assert response.status_code == 200, response.text
+    rotated = response.json()
+    assert client.get("/users/me", headers=bearer(rotated)).status_code == 200
+    assert refresh(client, rotated).status_code == 200
+
+
+def test_refresh_replay_revokes_every_token_of_the_user(client, user):
+    rotated = refresh(client, user.tokens).json()
+    replay = refresh(client, user.tokens)
+    assert replay.status_code == 401
+    assert replay.json()["detail"] == "Token has been revoked"
+    assert refresh(client, rotated).status_code == 401
+    assert client.get("/users/me", headers=user.headers).status_code == 401
+    assert client.get("/users/me", headers=bearer(rotated)).status_code == 401
+    # A new login is trusted again
+    assert client.get("/users/me", headers=bearer(login(client, user.username))).status_code == 200
+
+
+def test_logout_revokes_the_access_and_refresh_tokens(client, user):
+    other = login(client, user.username)
+    response = client.post(
+        "/logout", headers=user.headers, json={"refresh_token": user.tokens["Refresh Token"]}
+    )
+    assert response.status_code == 200
+    assert client.get("/users/me", headers=user.headers).status_code == 401
+    # Other sessions of the user stay logged in
+    assert client.get("/users/me", headers=bearer(other)).status_code == 200
+    # Using the revoked refresh token is a replay, it ends those too
+    assert refresh(client, user.tokens).status_code == 401
+    assert client.get("/users/me", headers=bearer(other)).status_code == 401
+
+
+def test_forced_logout_revokes_every_session(client, admin, user):
+    other = login(client, user.username)
+    response = client.post(f"/admin/users/{user.id}/logout", headers=admin.headers)
+    assert response.status_code == 200
+    assert client.get("/users/me", headers=user.headers).status_code == 401
+    assert client.get("/users/me", headers=bearer(other)).status_code == 401
+    assert refresh(client, other).status_code == 401
+    assert client.post("/admin/users/999999/logout", headers=admin.headers).status_code == 404
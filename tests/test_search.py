@@ -0,0 +1,31 @@
+import heapq
+import random
+
+from app.database.search_index import NgramIndex
+
+
+def ranked(texts: dict, query: str, limit: int) -> list:
+    query = query.lower()
+    matches = [(not text.startswith(query), len(text), text, key) for key, text in texts.items() if query in text]
+    return [match[3] for match in heapq.nsmallest(limit, matches)]
+
+
+def test_search_ranks_prefixes_then_the_shortest_texts():
+    index = NgramIndex()
+    index.add_many([(1, "Bob"), (2, "bobby"), (3, "Jimbo"), (4, "rob"), (5, "bo")])
+    assert index.search("bo", 10) == [5, 1, 2, 3]
+    assert index.search("B", 2) == [5, 1]
+    assert index.search("bob", 10) == [1, 2]
+    assert index.search("z", 10) == []
+
+
+def test_short_queries_rank_like_the_longer_ones():
+    generator = random.Random(7)
+    texts = {
+        key: "".join(generator.choice("abcd") for _ in range(generator.randint(1, 8))) for key in range(2000)
+    }
+    index = NgramIndex()
+    index.add_many(texts.items())
+    for query in ("a", "D", "ab", "ca", "dd", "abc", "cab"):
+        for limit in (1, 7, 100):
+            assert index.search(query, limit) == ranked(texts, query, limit)
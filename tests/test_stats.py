@@ -0,0 +1,56 @@
+from sqlalchemy import update
+
+from app.database.connection import session_local
+from app.database.models import PlatformStats
+from app.database.stats import count_inserts
+from conftest import integrate, platform_stats
+
+
+def test_stats_counters_follow_the_writes(client, admin, user, platform):
+    integrate(client, user, platform["id"], False, {"a": "1", "b": "2"})
+    integrate(client, user, platform["id"], True, {"a": "3", "c": "4"})
+    client.post(
+        "/users/credentials/",
+        headers=user.headers,
+        json={"platform_id": platform["id"], "key": "a", "value": "5"},
+    )
+    # Integrations the admins assign are active
+    assigned = {"user_id": admin.id, "platform_id": platform["id"], "is_active": True}
+    other = client.post("/admin/user-integration", headers=admin.headers, json=assigned)
+    assert other.status_code == 200, other.text
+    duplicate = client.post("/admin/user-integration", headers=admin.headers, json=assigned)
+    assert duplicate.status_code == 409
+    counted = platform_stats(client, admin, platform["id"])
+    assert counted == platform_stats(client, admin, platform["id"], live=True)
+    assert (counted["integrations"], counted["active_integrations"], counted["credentials"]) == (2, 1, 3)
+
+
+def test_count_inserts_counts_only_inserted_rows(platform, monkeypatch):
+    # Stands in for PostgreSQL, whose upserts return whether they inserted each row
+    monkeypatch.setattr("app.database.stats.reports_inserts", lambda dialect: True)
+    with session_local() as db:
+        count_inserts(
+            db,
+            integration=(platform["id"], True, True),
+            credentials=[(platform["id"], True), (platform["id"], False), (platform["id"], True)],
+        )
+        count_inserts(db, integration=(platform["id"], False, False))
+        row = db.get(PlatformStats, platform["id"])
+        assert (row.integrations, row.active_integrations, row.credentials) == (1, 1, 2)
+        db.rollback()
+
+
+def test_rebuild_recounts_drifted_counters(client, admin, user, platform):
+    integrate(client, user, platform["id"], True, {"a": "1"})
+    live = platform_stats(client, admin, platform["id"], live=True)
+    with session_local() as db:
+        db.execute(
+            update(PlatformStats)
+            .where(PlatformStats.platform_id == platform["id"])
+            .values(integrations=40, credentials=-3)
+        )
+        db.commit()
+    assert platform_stats(client, admin, platform["id"]) != live
+    response = client.post("/admin/stats/rebuild", headers=admin.headers)
+    assert response.status_code == 200, response.text
+    assert platform_stats(client, admin, platform["id"]) == live
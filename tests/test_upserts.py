@@ -0,0 +1,93 @@
+from sqlalchemy import select, update
+
+from app.database.connection import session_local
+from app.database.models import CredentialDetail, UserIntegration
+from conftest import details, integrate, platform_stats
+
+
+def test_integrate_again_updates_the_credentials_and_keeps_the_rows(client, user, platform):
+    first = integrate(client, user, platform["id"], True, {"token": "one", "secret": "s"})
+    second = integrate(client, user, platform["id"], True, {"token": "two"})
+    assert second["id"] == first["id"]
+    assert details(client, user, platform["id"]) == {"token": "two", "secret": "s"}
+
+
+def test_integrate_again_keeps_is_active_and_the_integration_of_credentials(client, admin, user, platform):
+    integration = integrate(client, user, platform["id"], True, {"token": "one"})
+    # A credential pointing at another integration of the user keeps pointing at it
+    other_platform = client.post(
+        "/admin/platform/", headers=admin.headers, json={"name": platform["name"] + "-b"}
+    ).json()
+    other = integrate(client, user, other_platform["id"], True, {})
+    with session_local() as db:
+        db.execute(
+            update(CredentialDetail)
+            .where(CredentialDetail.user_id == user.id, CredentialDetail.platform_id == platform["id"])
+            .values(integration_id=other["id"])
+        )
+        db.commit()
+    again = integrate(client, user, platform["id"], False, {"token": "two"})
+    assert again["id"] == integration["id"]
+    assert again["is_active"] is True
+    with session_local() as db:
+        assert db.scalar(select(UserIntegration.is_active).where(UserIntegration.id == integration["id"]))
+        integration_id = db.scalar(
+            select(CredentialDetail.integration_id).where(
+                CredentialDetail.user_id == user.id, CredentialDetail.platform_id == platform["id"]
+            )
+        )
+        assert integration_id == other["id"]
+    assert platform_stats(client, admin, platform["id"]) == platform_stats(
+        client, admin, platform["id"], live=True
+    )
+
+
+def test_credential_upsert_updates_the_value(client, admin, user, platform):
+    integrate(client, user, platform["id"], True, {})
+    for value in ("one", "two"):
+        response = client.post(
+            "/users/credentials/",
+            headers=user.headers,
+            json={"platform_id": platform["id"], "key": "token", "value": value},
+        )
+        assert response.status_code == 200, response.text
+    admin_write = client.post(
+        "/admin/credential/",
+        headers=admin.headers,
+        json={"user_id": user.id, "platform_id": platform["id"], "key": "token", "value": "three"},
+    )
+    assert admin_write.status_code == 200, admin_write.text
+    assert details(client, user, platform["id"]) == {"token": "three"}
+
+
+def test_credentials_need_an_integration(client, admin, user, platform):
+    response = client.post(
+        "/users/credentials/",
+        headers=user.headers,
+        json={"platform_id": platform["id"], "key": "token", "value": "one"},
+    )
+    assert response.status_code == 404
+    response = client.post(
+        "/admin/credential/",
+        headers=admin.headers,
+        json={"user_id": user.id, "platform_id": platform["id"], "key": "token", "value": "one"},
+    )
+    assert response.status_code == 400
+
+
+def test_integrate_rejects_credentials_of_another_platform(client, admin, user, platform):
+    other_platform = client.post(
+        "/admin/platform/", headers=admin.headers, json={"name": platform["name"] + "-c"}
+    ).json()
+    response = client.post(
+        "/users/integrate",
+        headers=user.headers,
+        json={
+            "integration_data": {"platform_id": platform["id"], "is_active": True},
+            "credentials": [{"platform_id": other_platform["id"], "key": "token", "value": "one"}],
+        },
+    )
+    assert response.status_code == 422
+    with session_local() as db:
+        assert db.scalar(select(UserIntegration.id).where(UserIntegration.user_id == user.id)) is None
+        assert db.scalar(select(CredentialDetail.id).where(CredentialDetail.user_id == user.id)) is None